@@ -5,13 +5,21 @@ import sys
 import argparse
 import asyncio
 import signal
-from core.bot_engine import BotEngine
-from utils.logger import setup_logger
+from utils import startup_profiler
 
+# 需要在导入核心组件之前启用，才能统计依赖包的导入耗时
+if "--profile-startup" in sys.argv:
+    startup_profiler.enable()
 
-async def main_async():
-    """异步主函数"""
-    # 解析命令行参数
+from core.bot_engine import BotEngine  # noqa: E402
+from core.config_manager import ConfigManager  # noqa: E402
+from core.sharding import ShardDispatcher  # noqa: E402
+from utils.logger import setup_logger  # noqa: E402
+from utils import event_loop  # noqa: E402
+
+
+def parse_args():
+    """解析命令行参数"""
     parser = argparse.ArgumentParser(description="模块化 Telegram Bot")
     parser.add_argument("--config", help="配置目录路径", default="config")
     parser.add_argument("--token", help="Telegram Bot Token")
@@ -20,11 +28,33 @@ async def main_async():
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         help="日志级别",
         default="INFO")
-    args = parser.parse_args()
+    parser.add_argument("--shards",
+                        type=int,
+                        help="工作进程数量，大于 1 时启用多进程分片（覆盖配置文件）",
+                        default=None)
+    parser.add_argument("--profile-startup",
+                        action="store_true",
+                        help="记录启动各阶段耗时并输出报告")
+    parser.add_argument("--profile-output",
+                        help="启动追踪文件路径（Chrome Trace 格式，需配合 --profile-startup）",
+                        default=None)
+    parser.add_argument("--loop",
+                        choices=event_loop.LOOP_CHOICES,
+                        help="事件循环实现，uvloop 未安装时退回到 asyncio（覆盖配置文件）",
+                        default=None)
+    return parser.parse_args()
+
+
+async def main_async(args):
+    """异步主函数
+
+    Args:
+        args: 命令行参数
+    """
 
     # 设置主日志
     logger = setup_logger("Main", args.log_level)
-    logger.info("启动中...")
+    logger.info(f"启动中... (事件循环: {event_loop.get_loop_name()})")
 
     # 创建停止事件
     stop_event = asyncio.Event()
@@ -43,16 +73,48 @@ async def main_async():
             logger.warning("当前平台不支持信号处理，将使用传统的键盘中断检测")
             pass
 
+    async def finish_profile(task, timeout=5):
+        # 停止前等待启动耗时报告输出完成，超时后取消，并记录报告中的异常
+        if task is None:
+            return
+        try:
+            await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("启动耗时报告未能按时完成，已取消")
+        except Exception as e:
+            logger.error(f"输出启动耗时报告失败: {e}")
+
     # 创建并运行机器人
     bot = None
+    profile_task = None
     try:
-        # 创建 Bot 引擎
-        bot = BotEngine(config_dir=args.config, token=args.token)
+        # 确定工作进程数量
+        shards = args.shards
+        if shards is None:
+            shards = ConfigManager(args.config).main_config.get(
+                "sharding", {}).get("workers", 0)
+
+        # 创建 Bot 引擎（分片模式下为分发进程）
+        if shards > 1:
+            bot = ShardDispatcher(config_dir=args.config,
+                                  token=args.token,
+                                  workers=shards)
+        else:
+            bot = BotEngine(config_dir=args.config, token=args.token)
 
         # 初始化并启动
         await bot.initialize()
         await bot.start()
 
+        # 输出启动耗时报告（轮询模式下等待首次轮询成功）
+        profiler = startup_profiler.get_profiler()
+        if profiler:
+            engine = getattr(bot, "engine", bot)
+            wait_mark = "first_poll" if engine.network_mode == "polling" \
+                else None
+            profile_task = asyncio.create_task(
+                profiler.finish(args.profile_output, wait_mark))
+
         # 等待停止信号
         try:
             await stop_event.wait()
@@ -61,13 +123,16 @@ async def main_async():
             pass
 
         logger.info("正在关闭...")
+        await finish_profile(profile_task)
         await bot.stop()
 
     except KeyboardInterrupt:
+        await finish_profile(profile_task)
         if bot:
             await bot.stop()
     except Exception as e:
         logger.error(f"启动过程中发生错误: {e}", exc_info=True)
+        await finish_profile(profile_task)
         if bot:
             await bot.stop()
         return 1
@@ -77,11 +142,12 @@ async def main_async():
 
 def main():
     """入口点函数"""
-    # 在 Windows 上需要使用特定的事件循环策略
-    if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    args = parse_args()
 
-    return asyncio.run(main_async())
+    # 选择事件循环（在 Windows 上使用 Selector 事件循环）
+    loop = args.loop or ConfigManager(args.config).main_config.get(
+        "event_loop", "asyncio")
+    return event_loop.run(main_async(args), loop)
 
 
 if __name__ == "__main__":
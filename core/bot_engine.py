@@ -4,25 +4,47 @@ import asyncio
 import logging
 import os
 import time
-import gc
+import hmac
+import hashlib
 import telegram
+from aiohttp import web
 from datetime import datetime
-from telegram.ext import Application
+from telegram.ext import Application, TypeHandler
 from core.config_manager import ConfigManager
 from core.module_manager import ModuleManager
 from core.command_manager import CommandManager
 from core.event_system import EventSystem
+from core.web_server import WebServer
+from core.file_watcher import FileWatcher
+from core.metrics import MetricsCollector, InstrumentedApplication
+from core.update_poller import AdaptivePoller, FirstPollRequest
+from core.update_processor import KeyedUpdateProcessor, ORDERING_KEYS
 from utils.logger import setup_logger
 from utils.session_manager import SessionManager
 from utils.state_manager import StateManager
+from utils.traffic_recorder import TrafficRecorder
+from utils.memory_profiler import MemoryProfiler
+from utils.gc_tuner import GCTuner
+from utils.atomic_file import is_own_write
+from utils import startup_profiler
 
 
 class BotEngine:
     """Bot 引擎，负责协调各组件的工作"""
 
-    def __init__(self, config_dir="config", token=None):
+    def __init__(self,
+                 config_dir="config",
+                 token=None,
+                 request=None,
+                 get_updates_request=None,
+                 shard_id=0,
+                 shard_count=1,
+                 shard_channel=None,
+                 dispatch_only=False,
+                 record_traffic=True):
         # 初始化配置管理器
-        self.config_manager = ConfigManager(config_dir)
+        with startup_profiler.stage("ConfigManager"):
+            self.config_manager = ConfigManager(config_dir)
 
         # 设置日志
         log_level = self.config_manager.main_config.get("log_level", "INFO")
@@ -56,6 +78,39 @@ class BotEngine:
         self.event_system = None
         self.session_manager = None
         self.state_manager = None
+        self.traffic_recorder = None
+        self.update_poller = None
+        self.file_watcher = None
+        self.update_processor = None
+        self.memory_profiler = None
+        self.gc_tuner = None
+        self.metrics = None
+
+        # 内嵌 HTTP 服务器，(listen, port) -> WebServer
+        self.web_servers = {}
+
+        # Webhook 状态
+        self.webhook_path = None
+        self.webhook_secret = None
+        self.webhook_registered = False
+
+        # 启动完成后设置；停止时设置 draining，之后不再接收新的更新
+        self.ready = False
+        self.draining = False
+
+        # 自定义请求对象（回放工具使用假的 Bot 请求）
+        self.request = request
+        self.get_updates_request = get_updates_request
+
+        # 是否允许录制流量（回放工具关闭，避免回放的更新被再次录制）
+        self.record_traffic = record_traffic
+
+        # 分片设置：工作进程通过 shard_channel 向分发进程发送通知，
+        # 分发进程（dispatch_only）只获取更新，不加载模块
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.shard_channel = shard_channel
+        self.dispatch_only = dispatch_only
 
         # 任务跟踪
         self.tasks = []
@@ -79,16 +134,77 @@ class BotEngine:
         self.read_timeout = network_config.get("read_timeout", 20.0)
         self.write_timeout = network_config.get("write_timeout", 20.0)
         self.poll_interval = network_config.get("poll_interval", 1.0)
+        self.network_mode = network_config.get("mode", "polling")
+        self.webhook_config = network_config.get("webhook", {})
+        self.adaptive_polling = network_config.get("adaptive_polling", False)
+        self.concurrent_updates = max(
+            1, int(network_config.get("concurrent_updates", 1)))
+        self.update_ordering = network_config.get("update_ordering", "chat")
+        self.max_pending_updates = network_config.get("max_pending_updates",
+                                                      1000)
+
+        if self.network_mode not in ["polling", "webhook"]:
+            raise ValueError(f"不支持的更新获取方式: {self.network_mode}")
+
+        if self.update_ordering not in ORDERING_KEYS:
+            raise ValueError(f"不支持的更新排序键: {self.update_ordering}")
+
+        if self.network_mode == "webhook" and not self.webhook_config.get(
+                "url"):
+            raise ValueError("Webhook 模式需要设置 network.webhook.url")
 
         # 初始化 Telegram Application
         builder = Application.builder().token(self.token)
+        if self.request:
+            builder = builder.request(self.request)
+        get_updates_request = self.get_updates_request
+        if self.network_mode == "polling" and not self.adaptive_polling and \
+                startup_profiler.get_profiler():
+            # Updater.start_polling 没有成功回调，通过请求对象记录首次轮询成功
+            get_updates_request = FirstPollRequest(get_updates_request)
+        if get_updates_request:
+            builder = builder.get_updates_request(get_updates_request)
+
+        # 并发处理更新（同一聊天或同一聊天内的用户保持顺序）
+        if self.concurrent_updates > 1 and not self.dispatch_only:
+            self.update_processor = KeyedUpdateProcessor(
+                max_concurrent=self.concurrent_updates,
+                ordering=self.update_ordering,
+                max_pending=self.max_pending_updates)
+            builder = builder.concurrent_updates(self.update_processor)
+
+        # 监控端点：分片模式下只由分发进程提供，工作进程的指标不汇总
+        monitoring_config = self.config_manager.main_config.get(
+            "monitoring", {})
+        if monitoring_config.get("enabled", False) and self.shard_channel is None:
+            self.metrics = MetricsCollector(
+                self, max_loop_lag=monitoring_config.get("max_loop_lag", 5.0))
+            if self.dispatch_only:
+                self.logger.warning(
+                    "分片模式下 /metrics 只包含分发进程的指标，"
+                    "不包含更新处理耗时、会话和模块后台任务等工作进程指标")
+            else:
+                builder = builder.application_class(InstrumentedApplication)
+
+        with startup_profiler.stage("Application.build"):
+            self.application = builder.build()
+        self.application.bot_data["metrics"] = self.metrics
 
-        self.application = builder.build()
+        if self.metrics:
+            self.metrics.add_routes(
+                self.get_web_server(monitoring_config.get("listen", "127.0.0.1"),
+                                    monitoring_config.get("port", 9090)))
 
         # 将 bot_engine 和 config_manager 添加到 bot_data 中
         self.application.bot_data["bot_engine"] = self
         self.application.bot_data["config_manager"] = self.config_manager
 
+        # 分发进程只需要获取更新
+        if self.dispatch_only:
+            self.traffic_recorder = self._create_traffic_recorder()
+            self.logger.info("分发进程组件初始化完成")
+            return
+
         # 初始化事件系统
         self.event_system = EventSystem()
         self.application.bot_data["event_system"] = self.event_system
@@ -101,17 +217,49 @@ class BotEngine:
         self.state_manager = StateManager()
         self.application.bot_data["state_manager"] = self.state_manager
 
+        # 初始化内存分析器
+        memory_config = self.config_manager.main_config.get("memory", {})
+        self.memory_profiler = MemoryProfiler(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            frames=memory_config.get("tracemalloc_frames", 10))
+        self.application.bot_data["memory_profiler"] = self.memory_profiler
+
+        # 初始化垃圾回收调优
+        gc_config = self.config_manager.main_config.get("gc", {})
+        self.gc_tuner = GCTuner(
+            growth_ratio=gc_config.get("growth_ratio", 0.25),
+            min_objects=gc_config.get("min_objects", 10000))
+        self.gc_tuner.install(gc_config.get("thresholds"))
+        self.application.bot_data["gc_tuner"] = self.gc_tuner
+
         # 初始化命令管理器
         self.command_manager = CommandManager(self.application,
                                               self.config_manager)
         self.application.bot_data["command_manager"] = self.command_manager
 
         # 初始化模块管理器
-        self.module_manager = ModuleManager(
-            self.application, self.config_manager, self.command_manager,
-            self.event_system, self.state_manager, self.session_manager)
+        lazy_config = self.config_manager.main_config.get("lazy_modules", {})
+        self.module_manager = ModuleManager(self.application,
+                                            self.config_manager,
+                                            self.command_manager,
+                                            self.event_system,
+                                            self.state_manager,
+                                            self.session_manager,
+                                            shard_id=self.shard_id,
+                                            shard_count=self.shard_count,
+                                            lazy_loading=lazy_config.get(
+                                                "enabled", False),
+                                            idle_unload=lazy_config.get(
+                                                "idle_unload", 0))
         self.application.bot_data["module_manager"] = self.module_manager
 
+        # 分片工作进程：配置和模块状态变化时通知其他工作进程
+        if self.shard_channel is not None:
+            self.config_manager.add_save_listener(
+                self._broadcast_config_change)
+            self.state_manager.add_change_listener(
+                self._broadcast_state_change)
+
         # 注册群组成员变更处理器
         from telegram.ext import ChatMemberHandler
         self.application.add_handler(
@@ -149,51 +297,144 @@ class BotEngine:
         # 注册错误处理器
         self.application.add_error_handler(self.handle_error)
 
+        # 初始化流量录制（可选，分片模式下由分发进程统一录制）
+        if self.shard_channel is None:
+            self.traffic_recorder = self._create_traffic_recorder()
+        if self.traffic_recorder:
+            # 使用最小的处理器组，确保每个更新都先被录制
+            self.application.add_handler(
+                TypeHandler(telegram.Update, self._record_update),
+                group=-1000)
+
         self.logger.info("机器人组件初始化完成")
 
-    async def start(self):
-        """启动机器人"""
+    async def start(self, fetch_updates=True):
+        """启动机器人
+
+        Args:
+            fetch_updates: 是否从 Telegram 获取更新，回放工具会关闭此项
+        """
         self.logger.info("正在启动机器人...")
 
         # 初始化应用
-        await self.application.initialize()
-
-        # 注册核心命令
-        await self.command_manager.register_core_commands(self)
-
-        # 启动机器人
-        await self.application.start()
-
-        # 启动轮询
-        await self.application.updater.start_polling(
-            poll_interval=self.poll_interval,
-            timeout=self.read_timeout,
-            bootstrap_retries=5,
-            drop_pending_updates=False,
-            allowed_updates=None,
-            error_callback=self.polling_error_callback)
+        with startup_profiler.stage("Application.initialize"):
+            await self.application.initialize()
+
+        # 分发进程不处理更新，更新队列由 ShardDispatcher 消费
+        if not self.dispatch_only:
+            # 注册核心命令
+            await self.command_manager.register_core_commands(self)
+
+            # 启动机器人
+            with startup_profiler.stage("Application.start"):
+                await self.application.start()
+
+        # 添加 Webhook 路由（需要在 HTTP 服务器启动前完成）
+        use_webhook = fetch_updates and self.network_mode == "webhook"
+        if use_webhook:
+            self._setup_webhook_route()
+
+        # 启动内嵌 HTTP 服务器
+        if self.metrics:
+            await self.metrics.start()
+        for server in self.web_servers.values():
+            await server.start()
+
+        # 开始获取更新
+        if use_webhook:
+            with startup_profiler.stage("register_webhook"):
+                await self._register_webhook()
+        elif fetch_updates and self.adaptive_polling:
+            self.update_poller = AdaptivePoller(
+                self.application,
+                timeout=self.read_timeout,
+                idle_interval=self.poll_interval,
+                error_callback=self.polling_error_callback)
+            with startup_profiler.stage("start_polling"):
+                await self.update_poller.start(drop_pending_updates=False,
+                                               bootstrap_retries=5)
+        elif fetch_updates:
+            with startup_profiler.stage("start_polling"):
+                await self.application.updater.start_polling(
+                    poll_interval=self.poll_interval,
+                    timeout=self.read_timeout,
+                    bootstrap_retries=5,
+                    drop_pending_updates=False,
+                    allowed_updates=None,
+                    error_callback=self.polling_error_callback)
+
+        if self.dispatch_only:
+            self.ready = True
+            self.logger.info("分发进程已启动")
+            return
 
         # 加载模块
-        await self.module_manager.start()
+        with startup_profiler.stage("load_modules"):
+            await self.module_manager.start()
 
         # 启动会话清理
         await self.session_manager.start_cleanup()
 
+        # 启动完成后冻结长期存在的对象（处理器、模块数据表等），之后的完整回收不再扫描它们
+        gc_config = self.config_manager.main_config.get("gc", {})
+        if gc_config.get("freeze_after_startup", True):
+            with startup_profiler.stage("gc.freeze"):
+                self.gc_tuner.freeze()
+
         # 启动定期清理任务
-        cleanup_task = asyncio.create_task(self.periodic_cleanup())
+        cleanup_task = asyncio.create_task(
+            self.periodic_cleanup(gc_config.get("check_interval", 600)))
         self.tasks.append(cleanup_task)
 
-        # 启动配置文件监控任务
-        config_watch_task = asyncio.create_task(self.watch_config_changes())
-        self.tasks.append(config_watch_task)
-        self.logger.debug("已启动主配置文件监控")
-
+        # 启动内存增长监控
+        memory_config = self.config_manager.main_config.get("memory", {})
+        if memory_config.get("watch_enabled", False):
+            self.tasks.append(
+                asyncio.create_task(
+                    self.memory_profiler.watch_rss(
+                        self._send_admin_alert,
+                        interval=memory_config.get("sample_interval", 300),
+                        window=memory_config.get("window", 12),
+                        slope_threshold=memory_config.get(
+                            "slope_threshold", 5),
+                        cooldown=memory_config.get("alert_cooldown",
+                                                   21600))))
+
+        # 启动配置和模块文件监控
+        await self._start_file_watcher()
+
+        self.ready = True
         self.logger.info("机器人已成功启动")
 
     async def stop(self):
-        """停止机器人"""
+        """停止机器人
+
+        先停止获取更新，在 shutdown.drain_timeout 时间内等待已收到的更新和模块后台任务
+        处理完成，再保存所有尚未写入的数据，最后卸载模块并关闭应用
+        """
         self.logger.info("正在停止机器人...")
 
+        # 停止接收新的更新
+        self.ready = False
+        self.draining = True
+
+        if self.update_poller:
+            await self.update_poller.stop()
+
+        if hasattr(self.application, 'updater') and self.application.updater \
+                and self.application.updater.running:
+            await self.application.updater.stop()
+
+        # 等待处理中的更新完成，然后停止应用
+        if self.application and self.application.running:
+            shutdown_config = self.config_manager.main_config.get(
+                "shutdown", {})
+            await self._drain(shutdown_config.get("drain_timeout", 30))
+            try:
+                await self.application.stop()
+            except Exception as e:
+                self.logger.error(f"停止应用时出错: {e}")
+
         # 取消所有任务
         for task in self.tasks:
             if not task.done():
@@ -203,28 +444,108 @@ class BotEngine:
         if self.tasks:
             await asyncio.gather(*self.tasks, return_exceptions=True)
 
+        # 停止文件监控
+        if self.file_watcher:
+            await self.file_watcher.stop()
+
         # 停止会话清理
         if self.session_manager:
             await self.session_manager.stop_cleanup()
 
+        # 保存尚未写入的模块数据和会话
+        if self.module_manager:
+            await self.module_manager.flush_all()
+        if self.session_manager:
+            try:
+                self.session_manager.flush()
+            except Exception as e:
+                self.logger.error(f"保存会话数据失败: {e}")
+
         # 卸载所有模块
         if self.module_manager:
             await self.module_manager.stop()
 
-        # 停止轮询
-        if hasattr(self.application, 'updater') and self.application.updater:
-            await self.application.updater.stop()
+        # 注销 Webhook
+        if self.webhook_registered:
+            try:
+                await self.application.bot.delete_webhook()
+                self.logger.info("Webhook 已注销")
+            except Exception as e:
+                self.logger.error(f"注销 Webhook 失败: {e}")
+            self.webhook_registered = False
+
+        # 停止内嵌 HTTP 服务器
+        for server in self.web_servers.values():
+            await server.stop()
+        if self.metrics:
+            await self.metrics.stop()
 
-        # 停止应用
+        # 关闭应用
         if self.application:
             try:
-                await self.application.stop()
                 await self.application.shutdown()
             except Exception as e:
-                self.logger.error(f"停止应用时出错: {e}")
+                self.logger.error(f"关闭应用时出错: {e}")
+
+        # 关闭流量录制文件
+        if self.traffic_recorder:
+            self.traffic_recorder.close()
+
+        if self.memory_profiler:
+            self.memory_profiler.stop()
+
+        if self.gc_tuner:
+            self.gc_tuner.uninstall()
 
         self.logger.info("机器人已停止")
 
+    def _get_pending_work(self):
+        """获取尚未处理完成的更新和模块后台任务数量
+
+        Returns:
+            tuple: (排队的更新, 处理中的更新, 后台任务)
+        """
+        queued = self.application.update_queue.qsize()
+        processing = self.application.update_processor.current_concurrent_updates
+        tasks = (self.module_manager.get_drainable_task_count()
+                 if self.module_manager else 0)
+        return queued, processing, tasks
+
+    async def _drain(self, timeout):
+        """等待已收到的更新和模块后台任务处理完成
+
+        Args:
+            timeout: 最长等待时间（秒），超时后取消剩余的处理
+        """
+        deadline = time.monotonic() + timeout
+        next_report = time.monotonic()
+
+        while True:
+            queued, processing, tasks = self._get_pending_work()
+            if not (queued or processing or tasks):
+                self.logger.info("所有更新和后台任务已处理完成")
+                return
+
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_report:
+                self.logger.info(
+                    f"等待处理完成: 排队更新 {queued}, 处理中 {processing}, "
+                    f"后台任务 {tasks}，剩余 {deadline - now:.0f} 秒")
+                next_report = now + 1
+            await asyncio.sleep(0.05)
+
+        self.logger.warning(
+            f"等待处理完成超时 ({timeout} 秒)，取消剩余的 {queued} 个排队更新、"
+            f"{processing} 个处理中的更新和 {tasks} 个后台任务")
+
+        # 丢弃排队的更新，取消按键排序的处理任务（模块后台任务在卸载时取消）
+        while not self.application.update_queue.empty():
+            self.application.update_queue.get_nowait()
+        if self.update_processor:
+            await self.update_processor.shutdown()
+
     async def handle_error(self, update, context):
         """全局错误处理器"""
         self.logger.error("处理更新时发生异常:", exc_info=context.error)
@@ -242,6 +563,160 @@ class BotEngine:
             except Exception as e:
                 self.logger.warning(f"无法发送错误消息: {e}")
 
+    def get_web_server(self, listen, port, cert=None, key=None):
+        """获取（或创建）指定地址上的内嵌 HTTP 服务器，相同地址的端点共用一个服务器
+
+        Args:
+            listen: 监听地址
+            port: 监听端口
+            cert: TLS 证书文件路径（可选）
+            key: TLS 私钥文件路径（可选）
+
+        Returns:
+            WebServer: 服务器实例
+        """
+        server_key = (listen, int(port))
+        if server_key not in self.web_servers:
+            self.web_servers[server_key] = WebServer(listen, int(port), cert,
+                                                     key)
+        return self.web_servers[server_key]
+
+    def _setup_webhook_route(self):
+        """生成 Webhook 路径和密钥，并注册接收路由"""
+        # 未配置时从 Token 派生，路径本身也作为一层密钥
+        token_hash = hashlib.sha256(self.token.encode("utf-8")).hexdigest()
+        self.webhook_path = self.webhook_config.get(
+            "path") or f"/webhook/{token_hash[:24]}"
+        self.webhook_secret = self.webhook_config.get(
+            "secret_token") or token_hash[24:56]
+
+        server = self.get_web_server(self.webhook_config.get("listen",
+                                                             "0.0.0.0"),
+                                     self.webhook_config.get("port", 8443),
+                                     self.webhook_config.get("cert") or None,
+                                     self.webhook_config.get("key") or None)
+        server.add_route("POST", self.webhook_path,
+                         self._handle_webhook_request)
+
+    async def _register_webhook(self, retries=5):
+        """向 Telegram 注册 Webhook
+
+        Args:
+            retries: 网络错误时的重试次数
+        """
+        url = self.webhook_config["url"].rstrip("/") + self.webhook_path
+        cert_path = self.webhook_config.get("cert")
+        upload_cert = self.webhook_config.get("upload_cert",
+                                              False) and cert_path
+
+        for attempt in range(1, retries + 1):
+            try:
+                if upload_cert:
+                    # 自签名证书需要上传给 Telegram
+                    with open(cert_path, "rb") as cert_file:
+                        await self.application.bot.set_webhook(
+                            url=url,
+                            certificate=cert_file,
+                            max_connections=self.webhook_config.get(
+                                "max_connections", 40),
+                            drop_pending_updates=False,
+                            secret_token=self.webhook_secret)
+                else:
+                    await self.application.bot.set_webhook(
+                        url=url,
+                        max_connections=self.webhook_config.get(
+                            "max_connections", 40),
+                        drop_pending_updates=False,
+                        secret_token=self.webhook_secret)
+
+                self.webhook_registered = True
+                self.logger.info(f"Webhook 已注册: {url}")
+                return
+
+            except telegram.error.NetworkError as e:
+                if attempt == retries:
+                    raise
+                self.logger.warning(f"注册 Webhook 失败: {e}，将在 {attempt} 秒后重试")
+                await asyncio.sleep(attempt)
+
+    async def _handle_webhook_request(self, request):
+        """处理 Telegram 推送的 Webhook 更新"""
+        secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secret, self.webhook_secret):
+            self.logger.warning(f"拒绝来自 {request.remote} 的 Webhook 请求: 密钥不匹配")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = telegram.Update.de_json(data, self.application.bot)
+        except Exception as e:
+            self.logger.warning(f"解析 Webhook 更新失败: {e}")
+            return web.Response(status=400)
+
+        # 停止过程中拒绝新的更新，Telegram 会稍后重新推送
+        if self.draining:
+            return web.Response(status=503)
+
+        # 放入更新队列，立即响应 Telegram，由 Application 异步处理
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    def _create_traffic_recorder(self):
+        """根据配置创建流量录制器
+
+        Returns:
+            TrafficRecorder: 录制器，未启用时返回 None
+        """
+        capture_config = self.config_manager.main_config.get("capture", {})
+        if not self.record_traffic or not capture_config.get("enabled", False):
+            return None
+
+        # Bot 自身的 ID 不匿名化，回放时与 Bot ID 的比较保持有效
+        bot_id = self.token.split(":")[0]
+
+        self.logger.info("已启用更新流量录制")
+        return TrafficRecorder(
+            storage_dir=capture_config.get("path", "data/captures"),
+            compress=capture_config.get("compress", True),
+            anonymize=capture_config.get("anonymize", True),
+            salt=capture_config.get("salt", ""),
+            max_bytes=capture_config.get("max_bytes", 50 * 1024 * 1024),
+            backup_count=capture_config.get("backup_count", 10),
+            bot_id=int(bot_id) if bot_id.isdigit() else None)
+
+    async def _record_update(self, update, context):
+        """录制原始更新"""
+        self.traffic_recorder.record(update.to_dict())
+
+    def _broadcast_config_change(self):
+        """通知其他分片主配置已变化"""
+        self.shard_channel.put(
+            ("broadcast", self.shard_id, ("config_changed", None)))
+
+    def _broadcast_state_change(self, module_name):
+        """通知其他分片模块状态已变化
+
+        Args:
+            module_name: 模块名称
+        """
+        self.shard_channel.put(
+            ("broadcast", self.shard_id, ("state_changed", module_name)))
+
+    async def handle_shard_message(self, kind, payload):
+        """处理其他分片发来的通知
+
+        Args:
+            kind: 通知类型
+            payload: 通知内容
+        """
+        if kind == "config_changed":
+            self.config_manager.reload_main_config()
+            self.logger.debug("已根据其他分片的通知重新加载主配置")
+        elif kind == "state_changed":
+            await self.module_manager.notify_state_changed(payload)
+        else:
+            self.logger.warning(f"未知的分片通知: {kind}")
+
     def polling_error_callback(self, error):
         """轮询错误回调"""
         if isinstance(error, telegram.error.NetworkError):
@@ -249,8 +724,25 @@ class BotEngine:
         else:
             self.logger.error(f"轮询时发生错误: {error}", exc_info=True)
 
-    async def periodic_cleanup(self, interval=3600):
-        """定期清理资源"""
+    async def _send_admin_alert(self, text):
+        """向所有超级管理员发送提醒
+
+        Args:
+            text: 提醒内容
+        """
+        for admin_id in self.config_manager.get_valid_admin_ids():
+            try:
+                await self.application.bot.send_message(chat_id=admin_id,
+                                                        text=text)
+            except Exception as e:
+                self.logger.warning(f"向管理员 {admin_id} 发送提醒失败: {e}")
+
+    async def periodic_cleanup(self, interval=600):
+        """定期清理资源
+
+        Args:
+            interval: 检查间隔（秒）
+        """
         try:
             while True:
                 await asyncio.sleep(interval)
@@ -258,9 +750,10 @@ class BotEngine:
                 self.logger.debug("开始执行资源清理...")
                 start_time = time.time()
 
-                # 执行垃圾回收
-                collected = gc.collect()
-                self.logger.debug(f"垃圾回收完成，回收了 {collected} 个对象")
+                # 只在第 2 代对象明显增长时执行完整回收
+                collected = self.gc_tuner.maybe_collect()
+                if collected is not None:
+                    self.logger.debug(f"垃圾回收完成，回收了 {collected} 个对象")
 
                 # 更新统计信息
                 self.stats["last_cleanup"] = time.time()
@@ -272,47 +765,39 @@ class BotEngine:
             self.logger.debug("资源清理任务已取消")
             raise
 
-    async def watch_config_changes(self):
-        """监控配置文件变化"""
-        config_dir = self.config_manager.config_dir
-        main_config_path = os.path.join(config_dir, "config.json")
-
-        # 初始化文件最后修改时间
-        last_mtime = os.path.getmtime(main_config_path) if os.path.exists(
-            main_config_path) else 0
-
-        check_interval = 5  # 5 秒检查一次
-
-        try:
-            while True:
-                try:
-                    # 检查配置文件
-                    if not os.path.exists(main_config_path):
-                        await asyncio.sleep(check_interval)
-                        continue
-
-                    current_mtime = os.path.getmtime(main_config_path)
-                    if current_mtime > last_mtime:
-                        self.logger.info(f"检测到配置文件变化: {main_config_path}")
-                        last_mtime = current_mtime
-
-                        # 适当延迟，确保文件写入完成
-                        await asyncio.sleep(0.5)
-
-                        # 重新加载配置
-                        self.config_manager.reload_main_config()
-
-                    await asyncio.sleep(check_interval)
-
-                except asyncio.CancelledError:
-                    raise
-                except Exception as e:
-                    self.logger.error(f"监控配置文件时出错: {e}", exc_info=True)
-                    await asyncio.sleep(check_interval)
+    async def _start_file_watcher(self):
+        """启动配置和模块文件监控"""
+        watch_config = self.config_manager.main_config.get("file_watch", {})
+
+        self.file_watcher = FileWatcher(
+            backend=watch_config.get("backend", "auto"),
+            debounce=watch_config.get("debounce", 0.2))
+        self.file_watcher.watch(self.config_manager.config_dir, "*.json",
+                                self._handle_config_file_changed)
+        if watch_config.get("reload_modules", True):
+            self.file_watcher.watch(self.module_manager.modules_dir, "*.py",
+                                    self.module_manager.handle_module_file_changed)
+
+        await self.file_watcher.start()
+        self.logger.debug(f"已启动文件监控 ({self.file_watcher.active_backend})")
+
+    async def _handle_config_file_changed(self, path):
+        """处理配置目录中的文件变化
+
+        Args:
+            path: 变化的文件路径
+        """
+        # 本进程自身保存（模块 save_config、主配置保存等）引起的变化不需要重新加载
+        if is_own_write(path):
+            self.logger.debug(f"忽略自身写入引起的文件变化: {path}")
+            return
 
-        except asyncio.CancelledError:
-            self.logger.debug("配置文件监控任务已取消")
-            raise
+        if os.path.abspath(path) == os.path.abspath(
+                self.config_manager.main_config_path):
+            self.logger.info(f"检测到配置文件变化: {path}")
+            self.config_manager.reload_main_config()
+        else:
+            await self.module_manager.handle_config_file_changed(path)
 
     async def _handle_my_chat_member(self, update, context):
         """处理 Bot 的成员状态变化"""
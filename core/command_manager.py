@@ -9,6 +9,8 @@ from telegram.ext import CommandHandler, MessageHandler, filters, CallbackQueryH
 from utils.logger import setup_logger
 from utils.formatter import TextFormatter
 from utils.pagination import PaginationHelper
+from utils.memory_profiler import format_size
+from utils.event_loop import get_loop_name
 
 
 class CommandManager:
@@ -85,6 +87,12 @@ class CommandManager:
                 "admin_level": "super_admin",
                 "description": "显示机器人统计信息"
             },
+            {
+                "name": "memprof",
+                "callback": self._memprof_command,
+                "admin_level": "super_admin",
+                "description": "内存分析"
+            },
             {
                 "name": "cancel",
                 "callback": self._cancel_command,
@@ -204,7 +212,7 @@ class CommandManager:
             group: 处理器组
 
         Returns:
-            bool: 是否成功注册
+            CallbackQueryHandler: 注册的处理器（供模块卸载时移除）
         """
 
         # 创建权限包装器
@@ -222,8 +230,21 @@ class CommandManager:
                         await update.callback_query.answer("⚠️ 您没有执行此操作的权限")
                     return
 
+                # 记录模块使用时间（用于懒加载模块的空闲卸载）
+                module_manager = context.bot_data.get("module_manager")
+                if module_manager:
+                    module_manager.touch_module(module_name)
+
                 # 调用原始回调
-                return await callback(update, context)
+                handler_name = f"{module_name}:{callback.__name__}"
+                start = time.perf_counter()
+                try:
+                    result = await callback(update, context)
+                except Exception:
+                    self._observe_handler(context, handler_name, start, True)
+                    raise
+                self._observe_handler(context, handler_name, start)
+                return result
             except telegram.error.Forbidden as e:
                 # 处理权限错误（例如机器人被踢出群组）
                 self.logger.warning(f"权限错误: {e}")
@@ -244,7 +265,7 @@ class CommandManager:
         # 添加到应用
         self.application.add_handler(handler, group)
 
-        return True
+        return handler
 
     async def unregister_command(self, command_name):
         """注销单个命令
@@ -308,6 +329,19 @@ class CommandManager:
 
         return command_count
 
+    def _observe_handler(self, context, name, start, error=False):
+        """记录处理器执行耗时（未启用监控端点时忽略）
+
+        Args:
+            context: 上下文对象
+            name: 处理器名称
+            start: 开始时间（time.perf_counter）
+            error: 是否出错
+        """
+        metrics = context.bot_data.get("metrics")
+        if metrics:
+            metrics.observe_handler(name, time.perf_counter() - start, error)
+
     def _create_command_wrapper(self, command_name, callback, admin_level,
                                 module_name):
         """创建命令包装器，处理权限检查和模块聊天类型检查
@@ -345,20 +379,17 @@ class CommandManager:
                     # 获取模块管理器
                     module_manager = context.bot_data.get("module_manager")
                     if module_manager:
-                        # 获取模块信息
-                        module_info = module_manager.get_module_info(
+                        # 检查模块是否支持当前聊天类型（未加载的懒加载模块按元数据检查）
+                        supported_types = module_manager.get_module_chat_types(
                             module_name)
-                        if module_info:
-                            # 检查模块是否支持当前聊天类型
-                            module = module_info["module"]
-                            supported_types = getattr(module,
-                                                      "MODULE_CHAT_TYPES",
-                                                      ["private", "group"])
-
-                            if chat_type not in supported_types:
-                                await message.reply_text(
-                                    f"模块 {module_name} 不支持在 {chat_type} 中使用")
-                                return
+                        if supported_types is not None and \
+                                chat_type not in supported_types:
+                            await message.reply_text(
+                                f"模块 {module_name} 不支持在 {chat_type} 中使用")
+                            return
+
+                        # 记录模块使用时间（用于懒加载模块的空闲卸载）
+                        module_manager.touch_module(module_name)
 
                 # 检查用户权限
                 if not await self._check_permission(admin_level, update,
@@ -366,7 +397,14 @@ class CommandManager:
                     return
 
                 # 执行命令
-                await callback(update, context)
+                start = time.perf_counter()
+                try:
+                    await callback(update, context)
+                except Exception:
+                    self._observe_handler(context, f"/{command_name}", start,
+                                          True)
+                    raise
+                self._observe_handler(context, f"/{command_name}", start)
 
             except telegram.error.Forbidden as e:
                 # 处理权限错误（例如机器人被踢出群组）
@@ -702,7 +740,15 @@ class CommandManager:
         chat_types_str = ", ".join(chat_types)
         status = "✅" if item["supports_current_type"] else "❌"
 
-        return f"{status} *{name}* v{version} [{chat_types_str}]\n  {description}"
+        # 显示模块初始化耗时
+        setup_time = ""
+        if item.get("setup_time") is not None:
+            setup_time = f" ⏱{item['setup_time'] * 1000:.0f}ms"
+        elif item.get("lazy") and not item.get("loaded"):
+            # 懒加载模块尚未加载，首次使用时才加载
+            setup_time = " 💤"
+
+        return f"{status} *{name}* v{version} [{chat_types_str}]{setup_time}\n  {description}"
 
     async def _list_commands_command(self, update, context):
         """处理 /commands 命令
@@ -761,11 +807,21 @@ class CommandManager:
                 module = module_info["module"]
                 supported_types = getattr(module, "MODULE_CHAT_TYPES",
                                           ["private", "group"])
+                setup_time = module_info.get("setup_time")
+            elif module_name in module_manager.lazy_modules:
+                # 尚未加载的懒加载模块，使用解析出的元数据
+                metadata = module_manager.lazy_modules[module_name]["metadata"]
+                description = metadata.get("description", "")
+                version = metadata.get("version", "unknown")
+                supported_types = metadata.get("chat_types",
+                                               ["private", "group"])
+                setup_time = None
             else:
                 metadata = None
                 description = ""
                 version = "unknown"
                 supported_types = ["private", "group"]  # 默认全部支持
+                setup_time = None
 
             # 检查是否支持当前聊天类型
             supports_current_type = current_chat_type in supported_types
@@ -776,7 +832,9 @@ class CommandManager:
                 "supported_types": supported_types,
                 "description": description,
                 "version": version,
-                "loaded": module_info is not None
+                "loaded": module_info is not None,
+                "lazy": module_name in module_manager.lazy_modules,
+                "setup_time": setup_time
             })
 
         # 按当前聊天类型支持状态和名称排序
@@ -1054,12 +1112,17 @@ class CommandManager:
         # 构建统计信息
         stats_message = f"📊 *机器人统计信息*\n\n"
         stats_message += f"⏱️ 运行时间: {uptime_str}\n"
+        if bot_engine.shard_count > 1:
+            stats_message += (f"🧩 当前分片: {bot_engine.shard_id + 1}"
+                              f"/{bot_engine.shard_count}（统计仅含本分片）\n")
         stats_message += f"📦 已加载模块: {loaded_modules}\n"
         stats_message += f"🔖 已注册命令: {len(self.commands)}\n"
 
         # 获取系统信息
         import platform
         stats_message += f"🖥️ 系统: {platform.system()} {platform.release()}\n"
+        stats_message += (f"🐍 Python {platform.python_version()}"
+                          f"，事件循环: {get_loop_name()}\n")
 
         # 获取活跃会话数量
         active_sessions = await session_manager.get_active_sessions_count()
@@ -1082,10 +1145,87 @@ class CommandManager:
             self.logger.warning("无法导入 psutil 模块，跳过内存使用统计")
             pass
 
+        memory_profiler = context.bot_data.get("memory_profiler")
+        if memory_profiler and len(memory_profiler.rss_samples) >= 2:
+            slope = memory_profiler.get_status()["rss_slope"]
+            stats_message += f"📈 内存增长: {format_size(int(slope))}/小时\n"
+
+        # 垃圾回收暂停
+        gc_tuner = context.bot_data.get("gc_tuner")
+        if gc_tuner:
+            gc_stats = gc_tuner.get_stats()
+            gen0, gen1, gen2 = gc_stats["collections"]
+            stats_message += (
+                f"🗑️ 垃圾回收: {gen0}/{gen1}/{gen2} 次，"
+                f"暂停平均 {gc_stats['pause_avg'] * 1000:.2f} ms"
+                f" / p99 {gc_stats['pause_p99'] * 1000:.2f} ms"
+                f" / 最长 {gc_stats['pause_max'] * 1000:.1f} ms\n")
+            if gc_stats["frozen"]:
+                stats_message += (
+                    f"🧊 已冻结对象: {gc_stats['frozen']}"
+                    f"（主动完整回收 {gc_stats['adaptive_runs']} 次，"
+                    f"跳过 {gc_stats['adaptive_skips']} 次）\n")
+
         # 获取网络配置
         network_config = self.config_manager.main_config.get("network", {})
-        poll_interval = network_config.get("poll_interval", 1.0)
-        stats_message += f"📡 轮询间隔: {poll_interval} 秒\n"
+        if network_config.get("mode", "polling") == "webhook":
+            stats_message += f"📡 更新方式: Webhook\n"
+        elif bot_engine.update_poller:
+            poller_stats = bot_engine.update_poller.get_stats()
+            stats_message += f"📡 更新方式: 自适应轮询\n"
+            stats_message += (
+                f"⏱ 轮询往返: 平均 {poller_stats['rtt_avg'] * 1000:.0f} ms"
+                f" / p95 {poller_stats['rtt_p95'] * 1000:.0f} ms"
+                f"（{poller_stats['polls']} 次，空轮询 {poller_stats['empty_polls']} 次）\n")
+            stats_message += (f"📦 批次大小: 平均 {poller_stats['batch_avg']:.1f}"
+                              f" / 最大 {poller_stats['batch_max']}\n")
+        else:
+            poll_interval = network_config.get("poll_interval", 1.0)
+            stats_message += f"📡 轮询间隔: {poll_interval} 秒\n"
+
+        # 并发处理状态
+        if bot_engine.update_processor:
+            processor_stats = bot_engine.update_processor.get_stats()
+            stats_message += (
+                f"⚙️ 并发处理: {processor_stats['running']}/{processor_stats['max_concurrent']}"
+                f"（活跃队列 {processor_stats['active_keys']}，"
+                f"排队 {processor_stats['queued']}，"
+                f"最长队列 {processor_stats['max_queue']}，"
+                f"峰值 {processor_stats['peak_queue']}）\n")
+            stats_message += (
+                f"⏳ 平均排队: {processor_stats['avg_wait'] * 1000:.1f} ms"
+                f"（已处理 {processor_stats['processed']}）\n")
+            busy_keys = [(key, length) for key, length in
+                         bot_engine.update_processor.get_queue_lengths(3)
+                         if length > 0]
+            if busy_keys:
+                stats_message += "📋 排队最多: " + "，".join(
+                    f"{':'.join(str(k) for k in key)} ({length})"
+                    for key, length in busy_keys) + "\n"
+
+        # 模块后台任务
+        task_stats = {
+            name: stats
+            for name, stats in module_manager.get_task_stats().items()
+            if stats["live"] or stats["rejected"]
+        }
+        if task_stats:
+            stats_message += (
+                f"🧵 后台任务: {sum(s['live'] for s in task_stats.values())}"
+                f"（运行 {sum(s['running'] for s in task_stats.values())}，"
+                f"排队 {sum(s['queued'] for s in task_stats.values())}）\n")
+            busy_modules = sorted(task_stats.items(),
+                                  key=lambda x: x[1]["live"],
+                                  reverse=True)[:5]
+            module_parts = []
+            for name, stats in busy_modules:
+                part = f"{TextFormatter.escape_markdown(name)} {stats['live']}"
+                if stats["queued"]:
+                    part += f"（排队 {stats['queued']}）"
+                if stats["rejected"]:
+                    part += f"（已拒绝 {stats['rejected']}）"
+                module_parts.append(part)
+            stats_message += "📋 任务最多: " + "，".join(module_parts) + "\n"
 
         # 最后清理时间
         if bot_engine.stats.get("last_cleanup", 0) > 0:
@@ -1100,6 +1240,79 @@ class CommandManager:
             await message_obj.reply_text(
                 TextFormatter.markdown_to_plain(stats_message))
 
+    async def _memprof_command(self, update, context):
+        """处理 /memprof 命令，通过 tracemalloc 分析内存占用
+
+        用法: /memprof [start|snapshot|diff|stop]
+
+        Args:
+            update: 更新对象
+            context: 上下文对象
+        """
+        message_obj = update.message or update.edited_message
+        profiler = context.bot_data.get("memory_profiler")
+        action = context.args[0].lower() if context.args else "status"
+
+        if action == "start":
+            if profiler.start():
+                text = ("✅ 已开始记录内存分配，当前状态已保存为基准\n"
+                        "记录期间内存占用和分配开销会增加，完成后请使用 /memprof stop")
+            else:
+                text = "内存分配记录已在进行中"
+
+        elif action == "stop":
+            if not profiler.tracing:
+                text = "内存分配记录未开始"
+            else:
+                profiler.stop()
+                text = "✅ 已停止记录内存分配"
+
+        elif action in ("snapshot", "diff"):
+            if not profiler.tracing:
+                await message_obj.reply_text("内存分配记录未开始，请先使用 /memprof start")
+                return
+            # 处理快照需要遍历所有分配，放到线程中执行
+            if action == "snapshot":
+                result = await asyncio.to_thread(profiler.snapshot)
+                lines = [f"📸 当前记录的内存: {format_size(result['total'])}"
+                         f"（{result['count']} 个分配）", "", "按文件:"]
+                lines += [f"  {format_size(size):>10}  {name}（{count}）"
+                          for name, size, count in result["files"]]
+            else:
+                result = await asyncio.to_thread(profiler.diff)
+                lines = [f"📈 相对基准的变化: {format_size(result['total_diff'])}",
+                         "", "按文件:"]
+                lines += [f"  {format_size(size):>10}  {name}"
+                          for name, size in result["files"]]
+                lines += ["", "增长最多的位置:"]
+                lines += [f"  {format_size(size):>10}  {site}（{count:+d}）"
+                          for site, size, count in result["sites"]]
+            text = "\n".join(lines)
+
+        elif action == "status":
+            status = profiler.get_status()
+            lines = ["🧠 内存分析"]
+            if status["rss"] is not None:
+                lines.append(f"常驻内存: {format_size(status['rss'])}")
+            if status["rss_samples"] >= 2:
+                lines.append(f"增长速度: {format_size(int(status['rss_slope']))}/小时"
+                             f"（{status['rss_samples']} 个样本）")
+            if status["tracing"]:
+                started = datetime.fromtimestamp(
+                    status["started_at"]).strftime("%Y-%m-%d %H:%M:%S")
+                lines.append(f"记录中: 开始于 {started}，当前 {format_size(status['traced'])}，"
+                             f"峰值 {format_size(status['peak'])}，"
+                             f"额外开销 {format_size(status['overhead'])}")
+            else:
+                lines.append("未记录内存分配")
+            lines.append("\n用法: /memprof start|snapshot|diff|stop")
+            text = "\n".join(lines)
+
+        else:
+            text = "用法: /memprof start|snapshot|diff|stop"
+
+        await message_obj.reply_text(text)
+
     async def _cancel_command(self, update, context):
         """处理 /cancel 命令，取消当前操作
 
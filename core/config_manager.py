@@ -4,6 +4,7 @@ import os
 import json
 import time
 from utils.logger import setup_logger
+from utils.atomic_file import atomic_write_json
 
 
 class ConfigManager:
@@ -19,6 +20,9 @@ class ConfigManager:
         # 配置缓存
         self.main_config = {}
 
+        # 主配置保存后的回调（分片模式下用于通知其他进程）
+        self.save_listeners = []
+
         # 确保配置目录存在
         os.makedirs(self.config_dir, exist_ok=True)
 
@@ -69,8 +73,7 @@ class ConfigManager:
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
             # 保存数据
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            atomic_write_json(file_path, data, indent=2, ensure_ascii=False)
             return True
         except Exception as e:
             self.logger.error(f"保存配置文件 {file_path} 失败: {e}")
@@ -101,11 +104,58 @@ class ConfigManager:
             "admin_ids": [],
             "log_level": "INFO",
             "allowed_groups": {},
+            "event_loop": "asyncio",
             "network": {
                 "connect_timeout": 20.0,
                 "read_timeout": 20.0,
                 "write_timeout": 20.0,
                 "poll_interval": 1.0
+            },
+            "sharding": {
+                "workers": 0
+            },
+            "lazy_modules": {
+                "enabled": False,
+                "idle_unload": 0
+            },
+            "monitoring": {
+                "enabled": False,
+                "listen": "127.0.0.1",
+                "port": 9090,
+                "max_loop_lag": 5.0
+            },
+            "shutdown": {
+                "drain_timeout": 30
+            },
+            "gc": {
+                "freeze_after_startup": True,
+                "thresholds": None,
+                "check_interval": 600,
+                "growth_ratio": 0.25,
+                "min_objects": 10000
+            },
+            "memory": {
+                "tracemalloc_frames": 10,
+                "watch_enabled": False,
+                "sample_interval": 300,
+                "window": 12,
+                "slope_threshold": 5,
+                "alert_cooldown": 21600
+            },
+            "tasks": {
+                "max_concurrent": 16,
+                "max_queued": 500
+            },
+            "file_watch": {
+                "backend": "auto",
+                "debounce": 0.2,
+                "reload_modules": True
+            },
+            "capture": {
+                "enabled": False,
+                "path": "data/captures",
+                "compress": True,
+                "anonymize": True
             }
         }
 
@@ -138,7 +188,23 @@ class ConfigManager:
         Returns:
             bool: 是否成功保存
         """
-        return self._save_json_file(self.main_config_path, self.main_config)
+        success = self._save_json_file(self.main_config_path,
+                                       self.main_config)
+        if success:
+            for listener in self.save_listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    self.logger.error(f"执行配置保存回调时出错: {e}")
+        return success
+
+    def add_save_listener(self, callback):
+        """添加主配置保存后的回调
+
+        Args:
+            callback: 无参数的回调函数
+        """
+        self.save_listeners.append(callback)
 
     def get_token(self):
         """获取 Bot Token
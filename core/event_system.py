@@ -16,6 +16,10 @@ class EventSystem:
         self.concurrent_limit = 100  # 最大并发事件数
         self.active_tasks = 0
 
+        # 统计数据
+        self.published = defaultdict(int)  # 事件类型 -> 发布次数
+        self.dropped = 0  # 因并发限制跳过的事件数量
+
     def subscribe(self, event_type, callback, priority=0, filter_func=None):
         """订阅事件
 
@@ -97,6 +101,7 @@ class EventSystem:
         async with self.event_lock:
             # 检查是否超过并发限制
             if self.active_tasks >= self.concurrent_limit:
+                self.dropped += 1
                 self.logger.warning(
                     f"并发事件数已达到限制 ({self.concurrent_limit})，跳过事件 {event_type}")
                 return 0
@@ -121,6 +126,7 @@ class EventSystem:
 
             # 增加活跃任务计数
             self.active_tasks += len(tasks)
+            self.published[event_type] += 1
 
         # 不等待任务完成
         if tasks:
@@ -148,6 +154,7 @@ class EventSystem:
         async with self.event_lock:
             # 检查是否超过并发限制
             if self.active_tasks >= self.concurrent_limit:
+                self.dropped += 1
                 self.logger.warning(
                     f"并发事件数已达到限制 ({self.concurrent_limit})，跳过事件 {event_type}")
                 return 0, 0
@@ -171,6 +178,7 @@ class EventSystem:
 
             # 增加活跃任务计数
             self.active_tasks += len(tasks)
+            self.published[event_type] += 1
 
         if not tasks:
             return 0, 0
@@ -247,3 +255,20 @@ class EventSystem:
         finally:
             # 减少活跃任务计数
             self.active_tasks -= len(tasks)
+
+    def get_stats(self):
+        """获取事件系统统计信息
+
+        Returns:
+            dict: 统计信息
+        """
+        return {
+            "active_tasks": self.active_tasks,
+            "concurrent_limit": self.concurrent_limit,
+            "published": dict(self.published),
+            "dropped": self.dropped,
+            "subscribers": {
+                event_type: len(subscribers)
+                for event_type, subscribers in self.subscribers.items()
+            }
+        }
@@ -0,0 +1,295 @@
+# core/file_watcher.py - 文件变化监控
+
+import os
+import sys
+import errno
+import struct
+import ctypes
+import ctypes.util
+import fnmatch
+import asyncio
+from utils.logger import setup_logger
+
+# inotify 常量（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# 写入完成或通过重命名替换文件时触发（不使用 IN_MODIFY，避免读到写了一半的文件）
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# 支持的监控方式
+WATCH_BACKENDS = ("auto", "inotify", "polling")
+
+
+def _load_inotify():
+    """加载 libc 中的 inotify 函数
+
+    Returns:
+        ctypes.CDLL: libc，不支持 inotify 时返回 None
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    """文件变化监控器
+
+    在 Linux 上使用 inotify（通过 ctypes 调用，注册到事件循环，空闲时没有任何唤醒），
+    其他平台或 inotify 不可用时退回到定期比较修改时间。同一文件在 debounce
+    时间内的多次变化只触发一次回调。
+    """
+
+    def __init__(self, backend="auto", debounce=0.2, poll_interval=5):
+        """初始化监控器
+
+        Args:
+            backend: 监控方式，"auto"、"inotify" 或 "polling"
+            debounce: 合并连续变化的等待时间（秒）
+            poll_interval: 轮询方式的检查间隔（秒）
+        """
+        if backend not in WATCH_BACKENDS:
+            raise ValueError(f"不支持的文件监控方式: {backend}")
+
+        self.backend = backend
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.logger = setup_logger("FileWatcher")
+
+        # 目录 -> [(文件名模式, 回调)]
+        self.watches = {}
+
+        self._fd = None
+        self._wd_dirs = {}  # inotify watch descriptor -> 目录
+        self._poll_task = None
+        self._snapshots = {}  # 目录 -> {文件名: (mtime_ns, size)}
+        self._pending = {}  # (文件路径, 回调) -> TimerHandle
+        self._tasks = set()
+        self._loop = None
+
+        self.stats = {"events": 0, "callbacks": 0}
+
+    def watch(self, directory, pattern, callback):
+        """添加监控，必须在 start 之前调用
+
+        Args:
+            directory: 监控的目录
+            pattern: 文件名匹配模式（如 "*.json"）
+            callback: 文件变化时调用的异步函数 (path) -> None
+        """
+        directory = os.path.abspath(directory)
+        self.watches.setdefault(directory, []).append((pattern, callback))
+
+    @property
+    def active_backend(self):
+        """当前使用的监控方式"""
+        if self._fd is not None:
+            return "inotify"
+        if self._poll_task is not None:
+            return "polling"
+        return None
+
+    async def start(self):
+        """开始监控"""
+        self._loop = asyncio.get_running_loop()
+
+        if self.backend in ("auto", "inotify") and self._start_inotify():
+            self.logger.debug(f"已使用 inotify 监控 {len(self.watches)} 个目录")
+            return
+
+        if self.backend == "inotify":
+            self.logger.warning("inotify 不可用，改为轮询检查文件变化")
+
+        for directory in self.watches:
+            self._snapshots[directory] = self._scan(directory)
+        self._poll_task = asyncio.create_task(self._poll_loop())
+        self.logger.debug(f"已使用轮询方式监控 {len(self.watches)} 个目录")
+
+    async def stop(self):
+        """停止监控"""
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            self._wd_dirs.clear()
+
+        if self._poll_task and not self._poll_task.done():
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+        self._poll_task = None
+
+        for handle in self._pending.values():
+            handle.cancel()
+        self._pending.clear()
+
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _start_inotify(self):
+        """初始化 inotify
+
+        Returns:
+            bool: 是否成功
+        """
+        libc = _load_inotify()
+        if libc is None:
+            return False
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self.logger.debug(
+                f"inotify_init1 失败: {os.strerror(ctypes.get_errno())}")
+            return False
+
+        for directory in self.watches:
+            if not os.path.isdir(directory):
+                continue
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory),
+                                        WATCH_MASK)
+            if wd < 0:
+                self.logger.debug(f"无法监控目录 {directory}: "
+                                  f"{os.strerror(ctypes.get_errno())}")
+                os.close(fd)
+                return False
+            self._wd_dirs[wd] = directory
+
+        self._fd = fd
+        self._loop.add_reader(fd, self._read_inotify_events)
+        return True
+
+    def _read_inotify_events(self):
+        """读取 inotify 事件（由事件循环在文件描述符可读时调用）"""
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                self.logger.error(f"读取 inotify 事件失败: {e}")
+            return
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.logger.warning("inotify 事件队列溢出，部分文件变化可能被忽略")
+                continue
+
+            directory = self._wd_dirs.get(wd)
+            if directory is None:
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_IGNORED):
+                self.logger.warning(f"监控的目录已被删除: {directory}")
+                self._wd_dirs.pop(wd, None)
+                continue
+
+            if name:
+                self._on_change(directory, os.fsdecode(name))
+
+    def _scan(self, directory):
+        """获取目录中文件的修改时间和大小
+
+        Args:
+            directory: 目录
+
+        Returns:
+            dict: {文件名: (mtime_ns, size)}
+        """
+        snapshot = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_mtime_ns,
+                                                stat.st_size)
+        except OSError:
+            pass
+        return snapshot
+
+    async def _poll_loop(self):
+        """轮询检查文件变化（inotify 不可用时使用）"""
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                for directory in self.watches:
+                    snapshot = self._scan(directory)
+                    previous = self._snapshots.get(directory, {})
+                    for name, signature in snapshot.items():
+                        if previous.get(name) != signature:
+                            self._on_change(directory, name)
+                    self._snapshots[directory] = snapshot
+        except asyncio.CancelledError:
+            self.logger.debug("文件轮询任务已取消")
+            raise
+
+    def _on_change(self, directory, name):
+        """处理文件变化，按文件合并连续的变化
+
+        Args:
+            directory: 目录
+            name: 文件名
+        """
+        for pattern, callback in self.watches.get(directory, []):
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+
+            self.stats["events"] += 1
+            path = os.path.join(directory, name)
+            key = (path, callback)
+            handle = self._pending.pop(key, None)
+            if handle:
+                handle.cancel()
+            self._pending[key] = self._loop.call_later(self.debounce,
+                                                       self._fire, key)
+
+    def _fire(self, key):
+        """合并等待结束后执行回调
+
+        Args:
+            key: (文件路径, 回调)
+        """
+        self._pending.pop(key, None)
+        path, callback = key
+        task = asyncio.create_task(self._run_callback(callback, path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_callback(self, callback, path):
+        """执行回调并记录错误
+
+        Args:
+            callback: 回调函数
+            path: 变化的文件路径
+        """
+        self.stats["callbacks"] += 1
+        try:
+            await callback(path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"处理文件变化 {path} 时出错: {e}", exc_info=True)
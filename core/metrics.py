@@ -0,0 +1,403 @@
+# core/metrics.py - 运行指标和健康检查端点
+
+import time
+import asyncio
+from collections import defaultdict
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from utils.logger import setup_logger
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+# 事件循环延迟的采样间隔（秒）
+LOOP_LAG_INTERVAL = 0.5
+
+
+def get_update_type(update):
+    """获取更新类型（如 message、callback_query）
+
+    Args:
+        update: 更新对象
+
+    Returns:
+        str: 更新类型
+    """
+    if not isinstance(update, Update):
+        return type(update).__name__
+    for update_type in Update.ALL_TYPES:
+        if getattr(update, update_type, None) is not None:
+            return update_type
+    return "unknown"
+
+
+class Histogram:
+    """累计直方图（Prometheus histogram 语义）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """记录一个观测值
+
+        Args:
+            value: 观测值（秒）
+        """
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def snapshot(self):
+        """获取直方图的副本
+
+        Returns:
+            tuple: (累计桶计数 [(上限, 数量)], 总和, 总数)
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative, self.sum, self.count
+
+
+class InstrumentedApplication(Application):
+    """统计每个更新处理耗时的 Application"""
+
+    async def process_update(self, update):
+        start = time.perf_counter()
+        try:
+            await super().process_update(update)
+        finally:
+            metrics = self.bot_data.get("metrics")
+            if metrics:
+                metrics.observe_update(get_update_type(update),
+                                       time.perf_counter() - start)
+
+
+def _escape_label(value):
+    """转义 Prometheus 标签值"""
+    return str(value).replace("\\", "\\\\").replace("\n",
+                                                    "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"'
+                          for key, value in labels.items()) + "}"
+
+
+def render_prometheus(families):
+    """生成 Prometheus 文本格式
+
+    Args:
+        families: [(名称, 类型, 说明, [(标签字典, 值)])]，
+            histogram 类型的值为 Histogram.snapshot() 的结果
+
+    Returns:
+        str: 文本格式的指标
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            if metric_type != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            buckets, total, count = value
+            for bound, bucket_count in buckets:
+                bucket_labels = dict(labels, le=bound)
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {bucket_count}")
+            lines.append(
+                f"{name}_bucket{_format_labels(dict(labels, le='+Inf'))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def get_http_pool_stats(bot, index):
+    """获取 Bot API 请求连接池中各主机的连接数量
+
+    Args:
+        bot: telegram.Bot
+        index: 请求对象序号，0 为 getUpdates，1 为其他请求
+
+    Returns:
+        tuple: ({主机: {"connections": 总数, "idle": 空闲数}}, 等待连接的请求数)，
+            无法获取时返回 ({}, 0)
+    """
+    try:
+        pool = bot._request[index]._client._transport._pool
+        stats = defaultdict(lambda: {"connections": 0, "idle": 0})
+        for connection in pool.connections:
+            host = connection._origin.host.decode("ascii")
+            stats[host]["connections"] += 1
+            if connection.is_idle():
+                stats[host]["idle"] += 1
+        return dict(stats), len(pool._requests)
+    except (AttributeError, IndexError, TypeError):
+        # 自定义请求对象（如回放工具）或 PTB、httpx 内部结构变化
+        return {}, 0
+
+
+class MetricsCollector:
+    """运行指标收集器，并提供 /healthz、/readyz、/metrics 端点"""
+
+    def __init__(self, engine, max_loop_lag=5.0):
+        """初始化收集器
+
+        Args:
+            engine: BotEngine 实例
+            max_loop_lag: 事件循环延迟超过该值（秒）时健康检查失败
+        """
+        self.engine = engine
+        self.max_loop_lag = max_loop_lag
+        self.logger = setup_logger("Metrics")
+
+        self.updates = defaultdict(Histogram)  # 更新类型 -> 处理耗时
+        self.handlers = defaultdict(Histogram)  # 处理器 -> 执行耗时
+        self.handler_errors = defaultdict(int)  # 处理器 -> 出错次数
+
+        self.loop_lag = 0.0
+        self.loop_lag_max = 0.0
+        self._lag_task = None
+
+    def observe_update(self, update_type, duration):
+        """记录一个更新的处理耗时"""
+        self.updates[update_type].observe(duration)
+
+    def observe_handler(self, name, duration, error=False):
+        """记录一次命令或回调处理器的执行耗时
+
+        Args:
+            name: 处理器名称（如 /weather 或 模块名:callback）
+            duration: 执行耗时（秒）
+            error: 是否出错
+        """
+        self.handlers[name].observe(duration)
+        if error:
+            self.handler_errors[name] += 1
+
+    def add_routes(self, server, prefix=""):
+        """在 HTTP 服务器上注册端点
+
+        Args:
+            server: WebServer 实例
+            prefix: 路径前缀
+        """
+        server.add_route("GET", f"{prefix}/healthz", self._handle_healthz)
+        server.add_route("GET", f"{prefix}/readyz", self._handle_readyz)
+        server.add_route("GET", f"{prefix}/metrics", self._handle_metrics)
+
+    async def start(self):
+        """开始测量事件循环延迟"""
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self):
+        """停止测量事件循环延迟"""
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    async def _measure_loop_lag(self):
+        """定期休眠，实际唤醒时间与预期的差即为事件循环延迟"""
+        try:
+            while True:
+                expected = time.monotonic() + LOOP_LAG_INTERVAL
+                await asyncio.sleep(LOOP_LAG_INTERVAL)
+                self.loop_lag = max(0.0, time.monotonic() - expected)
+                self.loop_lag_max = max(self.loop_lag_max, self.loop_lag)
+        except asyncio.CancelledError:
+            raise
+
+    def get_readiness(self):
+        """检查是否可以处理更新
+
+        Returns:
+            dict: {检查项: 是否通过}
+        """
+        engine = self.engine
+        application = engine.application
+        receiving = bool(
+            engine.webhook_registered
+            or (engine.update_poller and engine.update_poller.running)
+            or (application.updater and application.updater.running)
+            or engine.shard_count > 1)
+        return {
+            "started": engine.ready,
+            "receiving_updates": receiving,
+            "modules_loaded": engine.dispatch_only
+            or bool(engine.module_manager
+                    and engine.module_manager.loaded_modules),
+            "not_draining": not engine.draining
+        }
+
+    async def _handle_healthz(self, request):
+        """事件循环能在规定时间内响应即为健康"""
+        if self.loop_lag > self.max_loop_lag:
+            return web.Response(status=503,
+                                text=f"event loop lag {self.loop_lag:.3f}s\n")
+        return web.Response(text=f"ok (loop lag {self.loop_lag:.3f}s)\n")
+
+    async def _handle_readyz(self, request):
+        checks = self.get_readiness()
+        text = "".join(f"{name}: {'ok' if passed else 'fail'}\n"
+                       for name, passed in checks.items())
+        return web.Response(status=200 if all(checks.values()) else 503,
+                            text=text)
+
+    async def _handle_metrics(self, request):
+        # 在事件循环中快速复制数据，格式化放到线程中执行
+        families = await self.collect()
+        text = await asyncio.to_thread(render_prometheus, families)
+        return web.Response(text=text,
+                            content_type="text/plain",
+                            charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def collect(self):
+        """收集所有指标的当前值
+
+        Returns:
+            list: render_prometheus 使用的指标列表
+        """
+        engine = self.engine
+        families = []
+
+        families.append(("bot_uptime_seconds", "gauge", "Seconds since start",
+                         [({}, round(time.time() - engine.stats["start_time"],
+                                     1))]))
+        families.append(("bot_event_loop_lag_seconds", "gauge",
+                         "Most recent event loop wake-up delay",
+                         [({}, round(self.loop_lag, 6))]))
+        families.append(("bot_event_loop_lag_max_seconds", "gauge",
+                         "Largest event loop wake-up delay since start",
+                         [({}, round(self.loop_lag_max, 6))]))
+        families.append(("bot_ready", "gauge", "1 when the bot can process updates",
+                         [({}, int(all(self.get_readiness().values())))]))
+
+        # 更新数量和处理耗时（分发进程不处理更新，不输出这些指标）
+        if not engine.dispatch_only:
+            families.append(("bot_update_duration_seconds", "histogram",
+                             "Time to process an update, by update type",
+                             [({"type": update_type}, histogram.snapshot())
+                              for update_type, histogram in
+                              self.updates.items()]))
+            families.append(("bot_handler_duration_seconds", "histogram",
+                             "Command and callback handler execution time",
+                             [({"handler": name}, histogram.snapshot())
+                              for name, histogram in self.handlers.items()]))
+            families.append(("bot_handler_errors_total", "counter",
+                             "Command and callback handler failures",
+                             [({"handler": name}, count)
+                              for name, count in
+                              self.handler_errors.items()]))
+
+        # 更新队列
+        application = engine.application
+        queue_samples = [({"queue": "update_queue"},
+                          application.update_queue.qsize())]
+        if engine.update_processor:
+            processor_stats = engine.update_processor.get_stats()
+            queue_samples.append(({"queue": "ordered_pending"},
+                                  processor_stats["queued"]))
+            families.append(("bot_updates_processing", "gauge",
+                             "Updates currently being processed",
+                             [({}, processor_stats["running"])]))
+        families.append(("bot_queue_length", "gauge", "Pending items per queue",
+                         queue_samples))
+
+        # 事件系统
+        if engine.event_system:
+            event_stats = engine.event_system.get_stats()
+            families.append(("bot_event_callbacks_active", "gauge",
+                             "Event callbacks currently running",
+                             [({}, event_stats["active_tasks"])]))
+            families.append(("bot_events_published_total", "counter",
+                             "Events published, by event type",
+                             [({"event": event_type}, count)
+                              for event_type, count in
+                              event_stats["published"].items()]))
+            families.append(("bot_events_dropped_total", "counter",
+                             "Events dropped because of the concurrency limit",
+                             [({}, event_stats["dropped"])]))
+
+        # 会话
+        if engine.session_manager:
+            families.append(
+                ("bot_sessions_active", "gauge", "Active user sessions",
+                 [({}, await
+                   engine.session_manager.get_active_sessions_count())]))
+
+        # 模块和后台任务
+        if engine.module_manager:
+            families.append(("bot_modules_loaded", "gauge", "Loaded modules",
+                             [({}, len(engine.module_manager.loaded_modules))]))
+            task_stats = engine.module_manager.get_task_stats()
+            families.append(("bot_module_tasks", "gauge",
+                             "Live background tasks per module",
+                             [({"module": name, "state": state}, stats[key])
+                              for name, stats in task_stats.items()
+                              for state, key in (("running", "running"),
+                                                 ("queued", "queued"))]))
+            families.append(("bot_module_tasks_total", "counter",
+                             "Background tasks per module, by outcome",
+                             [({"module": name, "outcome": outcome}, stats[outcome])
+                              for name, stats in task_stats.items()
+                              for outcome in ("completed", "failed",
+                                              "rejected")]))
+
+        # Bot API 连接池
+        pool_samples = []
+        pending_samples = []
+        for pool_name, index in (("bot", 1), ("get_updates", 0)):
+            hosts, pending = get_http_pool_stats(application.bot, index)
+            pending_samples.append(({"pool": pool_name}, pending))
+            for host, stats in hosts.items():
+                pool_samples.append(({"pool": pool_name, "host": host,
+                                      "state": "idle"}, stats["idle"]))
+                pool_samples.append(({"pool": pool_name, "host": host,
+                                      "state": "active"},
+                                     stats["connections"] - stats["idle"]))
+        families.append(("bot_http_pool_connections", "gauge",
+                         "Bot API connection pool connections per host",
+                         pool_samples))
+        families.append(("bot_http_pool_pending_requests", "gauge",
+                         "Bot API requests waiting for a pooled connection",
+                         pending_samples))
+
+        # 轮询
+        if engine.update_poller:
+            poller_stats = engine.update_poller.get_stats()
+            families.append(("bot_polls_total", "counter", "getUpdates calls",
+                             [({}, poller_stats["polls"])]))
+
+        # 垃圾回收
+        if engine.gc_tuner:
+            gc_stats = engine.gc_tuner.get_stats()
+            families.append(("bot_gc_collections_total", "counter",
+                             "Garbage collections, by generation",
+                             [({"generation": generation}, count)
+                              for generation, count in enumerate(
+                                  gc_stats["collections"])]))
+            families.append(("bot_gc_pause_seconds_total", "counter",
+                             "Total garbage collection pause time",
+                             [({}, round(gc_stats["pause_total"], 6))]))
+
+        return families
@@ -1,10 +1,43 @@
 # core/module_manager.py - 模块管理器
 
 import os
+import re
 import sys
+import ast
+import time
 import asyncio
 import importlib
+from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler, filters
+from core.sharding import shard_for
+from core.task_supervisor import TaskSupervisor, DEFAULT_GROUP
 from utils.logger import setup_logger
+from utils import startup_profiler
+
+# 懒加载时通过 AST 读取的模块元数据（变量名 -> (元数据键, 默认值)）
+LAZY_METADATA_FIELDS = {
+    "MODULE_NAME": ("name", None),
+    "MODULE_VERSION": ("version", "unknown"),
+    "MODULE_DESCRIPTION": ("description", ""),
+    "MODULE_COMMANDS": ("commands", []),
+    "MODULE_CHAT_TYPES": ("chat_types", ["private", "group"]),
+    "MODULE_DEPENDS": ("depends", []),
+    "MODULE_LAZY": ("lazy", True),
+    "MODULE_LAZY_TRIGGERS": ("lazy_triggers", []),
+    "CALLBACK_PREFIX": ("callback_prefix", None),
+}
+
+# 权限级别从低到高（占位回调处理器使用模块回调处理器中最低的级别）
+ADMIN_LEVELS = (False, "group_admin", "super_admin")
+
+# 懒加载触发消息的占位处理器组（独立分组，不影响其他处理器匹配）
+LAZY_TRIGGER_GROUP = -50
+
+# 懒加载模块除命令和回调外可以声明的触发消息类型
+LAZY_TRIGGER_FILTERS = {
+    "sticker": filters.Sticker.ALL,
+    "photo": filters.PHOTO,
+    "document": filters.Document.ALL,
+}
 
 
 class ModuleInterface:
@@ -28,6 +61,13 @@ class ModuleInterface:
         self.commands = []  # [command_name]
         self.event_subscriptions = []  # [(event_type, callback)]
 
+        # 后台任务管理
+        task_config = self.config_manager.main_config.get("tasks", {})
+        self.supervisor = TaskSupervisor(
+            module_name,
+            max_concurrent=task_config.get("max_concurrent", 16),
+            max_queued=task_config.get("max_queued", 500))
+
     async def register_command(self,
                                command_name,
                                callback,
@@ -116,10 +156,13 @@ class ModuleInterface:
             bool: 是否成功注册
         """
         # 使用命令管理器注册回调处理器
-        success = await self.command_manager.register_callback_handler(
+        handler = await self.command_manager.register_callback_handler(
             self.module_name, callback, pattern, admin_level, group)
 
-        return success
+        # 跟踪处理器以便清理
+        if handler:
+            self.handlers.append((handler, group))
+        return handler is not None
 
     async def subscribe_event(self, event_type, callback):
         """订阅事件
@@ -187,6 +230,31 @@ class ModuleInterface:
         else:
             return "private"
 
+    def spawn(self, coro, name=None, group=DEFAULT_GROUP):
+        """创建受管理的后台任务
+
+        任务会被持有强引用，异常会被记录，模块卸载时自动取消。
+        同一分组中同时运行的任务数量受限，超过时排队；排队过多时拒绝
+
+        Args:
+            coro: 协程对象
+            name: 任务名称（用于日志）
+            group: 分组名称
+
+        Returns:
+            asyncio.Task: 创建的任务，被拒绝时返回 None
+        """
+        return self.supervisor.spawn(coro, name=name, group=group)
+
+    def set_task_limit(self, group, limit):
+        """设置后台任务分组的并发上限
+
+        Args:
+            group: 分组名称
+            limit: 并发上限，0 为不限制
+        """
+        self.supervisor.set_limit(group, limit)
+
     async def publish_event(self, event_type, **event_data):
         """发布事件
 
@@ -201,6 +269,38 @@ class ModuleInterface:
                                                source_module=self.module_name,
                                                **event_data)
 
+    @property
+    def shard_id(self):
+        """当前分片编号（未启用分片时为 0），用于区分各分片自己写入的文件"""
+        return self.module_manager.shard_id
+
+    @property
+    def is_primary_shard(self):
+        """是否为主分片（未启用分片时始终为 True）
+
+        只应运行一份的后台任务（如定时抓取）应只在主分片上启动
+        """
+        return self.module_manager.shard_id == 0
+
+    def owns_chat(self, chat_id):
+        """判断聊天是否由当前分片处理（未启用分片时始终为 True）
+
+        Args:
+            chat_id: 聊天 ID
+
+        Returns:
+            bool: 是否由当前分片处理
+        """
+        return shard_for(chat_id, self.module_manager.shard_count
+                         ) == self.module_manager.shard_id
+
+    def notify_state_changed(self):
+        """通知其他分片本模块的数据已变化
+
+        save_state 会自动通知；模块自行写入的配置文件需要手动调用
+        """
+        self.state_manager.notify_change(self.module_name)
+
     def save_state(self, state):
         """保存模块状态
 
@@ -212,6 +312,36 @@ class ModuleInterface:
         """
         return self.state_manager.save_state(self.module_name, state)
 
+    def update_state(self, updater, default=None):
+        """在跨进程文件锁内读取、修改并保存模块状态
+
+        分片模式下多个分片修改同一个状态文件时使用，updater 只修改本分片负责的部分
+
+        Args:
+            updater: 修改函数 (文件中的状态) -> 新状态
+            default: 没有保存的状态时传给 updater 的默认值
+
+        Returns:
+            Any: 保存的新状态，保存失败时返回 None
+        """
+        return self.state_manager.update_state(self.module_name, updater,
+                                               default)
+
+    def merge_state(self, state, base):
+        """把本分片的修改合并到文件中的最新状态后保存
+
+        多个分片修改同一个状态文件、但无法按聊天划分归属时使用：只有相对 base
+        变化的部分会覆盖文件中的内容
+
+        Args:
+            state: 当前状态
+            base: 上次加载或保存的状态（需要是副本）
+
+        Returns:
+            Any: 保存的状态（包含其他分片的修改），保存失败时返回 None
+        """
+        return self.state_manager.merge_state(self.module_name, state, base)
+
     def load_state(self, default=None):
         """加载模块状态
 
@@ -225,6 +355,9 @@ class ModuleInterface:
 
     async def cleanup(self):
         """清理模块资源，在模块卸载前调用"""
+        # 取消所有后台任务
+        await self.supervisor.cancel_all()
+
         # 注销所有处理器
         for handler, group in self.handlers:
             try:
@@ -257,7 +390,11 @@ class ModuleManager:
                  event_system,
                  state_manager,
                  session_manager,
-                 modules_dir="modules"):
+                 modules_dir="modules",
+                 shard_id=0,
+                 shard_count=1,
+                 lazy_loading=False,
+                 idle_unload=0):
         self.application = application
         self.config_manager = config_manager
         self.command_manager = command_manager
@@ -265,12 +402,25 @@ class ModuleManager:
         self.state_manager = state_manager
         self.session_manager = session_manager
         self.modules_dir = modules_dir
+        self.shard_id = shard_id
+        self.shard_count = shard_count
         self.logger = setup_logger("ModuleManager")
 
         # 模块跟踪
         self.loaded_modules = {}  # 模块名 -> {module, interface, metadata}
         self.module_locks = {}  # 模块名 -> 锁
 
+        # 懒加载：启动时只注册占位处理器，首次使用时才导入模块
+        self.lazy_loading = lazy_loading
+        self.idle_unload = idle_unload  # 空闲多久后卸载懒加载模块（秒），0 为不卸载
+        self.lazy_modules = {}  # 模块名 -> {metadata, placeholders, activations}
+        self.module_last_used = {}  # 模块名 -> 最后使用时间
+        self._activation_lock = asyncio.Lock()
+        self._idle_task = None
+
+        # 热重载
+        self._reload_lock = asyncio.Lock()
+
         # 确保模块目录存在
         os.makedirs(modules_dir, exist_ok=True)
 
@@ -286,13 +436,33 @@ class ModuleManager:
         # 加载所有模块
         await self.load_all_modules()
 
+        # 启动空闲模块卸载任务
+        if self.lazy_modules and self.idle_unload > 0:
+            self._idle_task = asyncio.create_task(self._idle_unload_loop())
+
     async def stop(self):
         """停止模块管理器"""
+        if self._idle_task and not self._idle_task.done():
+            self._idle_task.cancel()
+            try:
+                await self._idle_task
+            except asyncio.CancelledError:
+                pass
+
         # 卸载所有模块
         await self.unload_all_modules()
 
+        # 移除懒加载模块的占位处理器
+        for module_name in list(self.lazy_modules):
+            await self._remove_placeholders(module_name)
+        self.lazy_modules.clear()
+
     async def load_all_modules(self):
-        """加载所有可用模块"""
+        """加载所有可用模块
+
+        每个模块只导入一次，然后按 MODULE_DEPENDS 声明的依赖关系分层，
+        同一层的模块并发执行 setup
+        """
         # 获取所有可用模块
         available_modules = self.discover_modules()
         self.logger.debug(f"正在加载所有可用模块: {available_modules}")
@@ -301,15 +471,124 @@ class ModuleManager:
             self.logger.debug("没有可用模块需要加载")
             return
 
-        # 加载所有模块
+        start_time = time.perf_counter()
+
+        # 懒加载模式下只为可延迟的模块注册占位处理器
+        lazy_names = set()
+        if self.lazy_loading:
+            lazy_names = await self._setup_lazy_modules(available_modules)
+
+        # 导入其余模块
+        modules = {}
         for module_name in available_modules:
-            await self.load_module(module_name)
+            if module_name in lazy_names:
+                continue
+            module = await self._import_module(module_name)
+            if module:
+                modules[module_name] = module
+            else:
+                self.logger.error(f"无法导入模块 {module_name}")
+
+        # 按依赖关系分层并发加载
+        layers, unresolved = self._resolve_load_order(modules)
+        for module_name, reason in unresolved.items():
+            self.logger.error(f"跳过模块 {module_name}: {reason}")
+
+        for layer in layers:
+            # 依赖加载失败的模块不再加载
+            ready = []
+            for module_name in layer:
+                missing = [
+                    dep for dep in self._get_module_depends(modules[module_name])
+                    if dep not in self.loaded_modules
+                ]
+                if missing:
+                    self.logger.error(
+                        f"跳过模块 {module_name}: 依赖模块 {', '.join(missing)} 加载失败")
+                else:
+                    ready.append(module_name)
+
+            await asyncio.gather(*[
+                self.load_module(module_name, modules[module_name])
+                for module_name in ready
+            ])
+
+        elapsed = time.perf_counter() - start_time
+        lazy_info = f"，{len(lazy_names)} 个模块将按需加载" if lazy_names else ""
+        self.logger.info(
+            f"已加载 {len(self.loaded_modules)}/{len(available_modules)} 个模块，"
+            f"耗时 {elapsed * 1000:.0f} ms{lazy_info}")
+
+    def _resolve_load_order(self, modules):
+        """按依赖关系将模块分层
+
+        Args:
+            modules: 模块名称 -> 模块对象
+
+        Returns:
+            tuple: (分层列表 [[模块名称, ...], ...], 无法加载的模块 {模块名称: 原因})
+        """
+        unresolved = {}
+        depends = {}
+        for module_name, module in modules.items():
+            deps = self._get_module_depends(module)
+            missing = [
+                dep for dep in deps
+                if dep not in modules and dep not in self.loaded_modules
+            ]
+            if missing:
+                unresolved[module_name] = f"缺少依赖模块 {', '.join(missing)}"
+            else:
+                # 已加载的依赖无需等待
+                depends[module_name] = {dep for dep in deps if dep in modules}
+
+        # 缺少依赖的模块会导致依赖它的模块也无法加载
+        changed = True
+        while changed:
+            changed = False
+            for module_name, deps in list(depends.items()):
+                failed = [dep for dep in deps if dep in unresolved]
+                if failed:
+                    unresolved[module_name] = f"依赖模块 {', '.join(failed)} 无法加载"
+                    del depends[module_name]
+                    changed = True
+
+        layers = []
+        resolved = set()
+        while depends:
+            layer = sorted(name for name, deps in depends.items()
+                           if deps <= resolved)
+            if not layer:
+                # 剩余的模块存在循环依赖
+                for module_name in depends:
+                    unresolved[module_name] = "存在循环依赖"
+                break
+
+            layers.append(layer)
+            resolved.update(layer)
+            for module_name in layer:
+                del depends[module_name]
+
+        return layers, unresolved
+
+    @staticmethod
+    def _get_module_depends(module):
+        """获取模块声明的依赖
+
+        Args:
+            module: 模块对象
 
-    async def load_module(self, module_name):
+        Returns:
+            list: 依赖的模块名称列表
+        """
+        return list(getattr(module, "MODULE_DEPENDS", []) or [])
+
+    async def load_module(self, module_name, module=None):
         """加载模块
 
         Args:
             module_name: 模块名称
+            module: 已导入的模块对象（可选，为空时导入）
 
         Returns:
             bool: 是否成功加载
@@ -321,23 +600,31 @@ class ModuleManager:
                 return True
 
             try:
-                # 获取模块元数据
-                metadata = await self._get_module_metadata(module_name)
-                if not metadata:
-                    self.logger.error(f"无法获取模块 {module_name} 的元数据")
-                    return False
-
-                # 加载模块
-                module = await self._import_module(module_name)
+                # 导入模块
+                if module is None:
+                    module = await self._import_module(module_name)
                 if not module:
                     self.logger.error(f"无法导入模块 {module_name}")
                     return False
 
+                # 获取模块元数据
+                metadata = self._get_module_metadata(module_name, module)
+
                 # 验证模块接口
                 if not hasattr(module, "setup") or not callable(module.setup):
                     self.logger.error(f"模块 {module_name} 缺少 setup 方法")
                     return False
 
+                # 检查依赖模块是否已加载
+                missing = [
+                    dep for dep in metadata["depends"]
+                    if dep not in self.loaded_modules
+                ]
+                if missing:
+                    self.logger.error(
+                        f"模块 {module_name} 的依赖模块未加载: {', '.join(missing)}")
+                    return False
+
                 # 检查模块是否声明了支持的聊天类型
                 if not hasattr(module, "MODULE_CHAT_TYPES"):
                     self.logger.debug(
@@ -353,16 +640,22 @@ class ModuleManager:
 
                 # 初始化模块
                 try:
+                    setup_start = time.perf_counter()
                     await module.setup(interface)
+                    setup_time = time.perf_counter() - setup_start
+                    startup_profiler.record(f"setup {module_name}",
+                                            setup_start, setup_time, "module")
 
                     # 添加到已加载模块
                     self.loaded_modules[module_name] = {
                         "module": module,
                         "interface": interface,
-                        "metadata": metadata
+                        "metadata": metadata,
+                        "setup_time": setup_time
                     }
 
-                    self.logger.debug(f"模块 {module_name} 已加载")
+                    self.logger.debug(
+                        f"模块 {module_name} 已加载，setup 耗时 {setup_time * 1000:.0f} ms")
                     return True
 
                 except Exception as e:
@@ -427,15 +720,191 @@ class ModuleManager:
                 self.logger.error(f"卸载模块 {module_name} 时出错: {e}")
                 return False
 
+    async def notify_state_changed(self, module_name):
+        """通知模块其数据已被其他分片修改
+
+        调用模块的 on_state_changed(interface) 方法（如果存在）
+
+        Args:
+            module_name: 模块名称
+        """
+        module_info = self.loaded_modules.get(module_name)
+        if not module_info:
+            return
+
+        module = module_info["module"]
+        if hasattr(module, "on_state_changed") and callable(
+                module.on_state_changed):
+            try:
+                await module.on_state_changed(module_info["interface"])
+            except Exception as e:
+                self.logger.error(
+                    f"调用模块 {module_name} 的 on_state_changed 方法出错: {e}")
+
+    async def reload_module(self, module_name):
+        """重新加载模块
+
+        先检查新代码能否编译，再调用 cleanup 保存状态并卸载，最后导入新代码并
+        调用 setup（模块在 setup 中通过 load_state 恢复状态）。新代码加载失败时
+        使用旧的模块对象重新加载，保证模块不会因为一次错误的修改而消失
+
+        Args:
+            module_name: 模块名称
+
+        Returns:
+            bool: 是否成功加载新代码
+        """
+        async with self._reload_lock:
+            module_file = self._get_module_file(module_name)
+            if not module_file:
+                return False
+
+            # 语法错误时保留旧模块（编辑器可能还没有写完文件）
+            try:
+                with open(module_file, "r", encoding="utf-8") as f:
+                    compile(f.read(), module_file, "exec")
+            except (SyntaxError, ValueError, OSError) as e:
+                self.logger.error(f"模块 {module_name} 的新代码无法编译，保留旧版本: {e}")
+                return False
+
+            # 尚未加载的懒加载模块只需要更新占位处理器
+            if module_name in self.lazy_modules and \
+                    module_name not in self.loaded_modules:
+                async with self._activation_lock:
+                    await self._remove_placeholders(module_name)
+                    metadata = self._parse_module_metadata(module_name)
+                    if metadata:
+                        self.lazy_modules[module_name]["metadata"] = metadata
+                    await self._register_placeholders(module_name)
+                self.logger.info(f"已更新按需加载模块 {module_name} 的元数据")
+                return True
+
+            old_module_info = self.loaded_modules.get(module_name)
+            if old_module_info:
+                # 依赖此模块的模块需要重新初始化，暂不支持自动处理
+                dependents = [
+                    name for name, info in self.loaded_modules.items()
+                    if module_name in self._get_module_depends(info["module"])
+                ]
+                if dependents:
+                    self.logger.warning(
+                        f"模块 {module_name} 被 {dependents} 依赖，跳过热重载")
+                    return False
+
+                if not await self.unload_module(module_name):
+                    return False
+
+            start_time = time.perf_counter()
+            importlib.invalidate_caches()
+            module = await self._import_module(module_name)
+            if module and await self.load_module(module_name, module):
+                self.logger.info(
+                    f"模块 {module_name} 已重新加载，耗时 {(time.perf_counter() - start_time) * 1000:.0f} ms"
+                )
+                return True
+
+            # 回滚到旧版本
+            if old_module_info:
+                old_module = old_module_info["module"]
+                sys.modules[old_module.__name__] = old_module
+                if await self.load_module(module_name, old_module):
+                    self.logger.warning(f"模块 {module_name} 新代码加载失败，已恢复旧版本")
+                    return False
+
+            self.logger.error(f"模块 {module_name} 重新加载失败")
+            return False
+
+    async def handle_module_file_changed(self, path):
+        """处理模块文件变化（由文件监控调用）
+
+        Args:
+            path: 变化的文件路径
+        """
+        name = os.path.basename(path)
+        if name.startswith("_") or not name.endswith(".py"):
+            return
+
+        module_name = name[:-3]
+        if not os.path.exists(path):
+            return
+
+        self.logger.info(f"检测到模块文件变化: {name}")
+        await self.reload_module(module_name)
+
+    async def handle_config_file_changed(self, path):
+        """处理模块配置文件变化（由文件监控调用）
+
+        根据模块的 CONFIG_FILE 找到对应模块，调用其 on_state_changed(interface)
+
+        Args:
+            path: 变化的文件路径
+        """
+        name = os.path.basename(path)
+        for module_name, module_info in list(self.loaded_modules.items()):
+            config_file = getattr(module_info["module"], "CONFIG_FILE", None)
+            if config_file and os.path.basename(config_file) == name:
+                self.logger.debug(f"模块 {module_name} 的配置文件已变化")
+                await self.notify_state_changed(module_name)
+
+    def _get_module_file(self, module_name):
+        """获取模块源文件路径
+
+        Args:
+            module_name: 模块名称
+
+        Returns:
+            str: 文件路径，不存在时返回 None
+        """
+        for module_file in (os.path.join(self.modules_dir,
+                                         f"{module_name}.py"),
+                            os.path.join(self.modules_dir, module_name,
+                                         "__init__.py")):
+            if os.path.exists(module_file):
+                return module_file
+        return None
+
     async def unload_all_modules(self):
         """卸载所有模块"""
-        modules_to_unload = list(self.loaded_modules.keys())
+        # 按加载顺序的逆序卸载，确保依赖其他模块的模块先卸载
+        modules_to_unload = list(reversed(self.loaded_modules.keys()))
 
         for module_name in modules_to_unload:
             await self.unload_module(module_name)
 
         self.logger.debug(f"已卸载全部 {len(modules_to_unload)} 个模块")
 
+    async def flush_all(self):
+        """调用所有模块的 flush(interface) 方法（如果存在），保存尚未写入的数据"""
+        for module_name, module_info in list(self.loaded_modules.items()):
+            module = module_info["module"]
+            if not callable(getattr(module, "flush", None)):
+                continue
+            try:
+                await module.flush(module_info["interface"])
+            except Exception as e:
+                self.logger.error(f"调用模块 {module_name} 的 flush 方法出错: {e}")
+
+    def get_drainable_task_count(self):
+        """获取所有模块中停止前需要等待完成的后台任务数量
+
+        Returns:
+            int: 任务数量
+        """
+        return sum(
+            module_info["interface"].supervisor.get_drainable_count()
+            for module_info in self.loaded_modules.values())
+
+    def get_task_stats(self):
+        """获取各模块的后台任务统计
+
+        Returns:
+            dict: 模块名称 -> 任务统计
+        """
+        return {
+            module_name: module_info["interface"].supervisor.get_stats()
+            for module_name, module_info in self.loaded_modules.items()
+        }
+
     def get_module_info(self, module_name):
         """获取模块信息
 
@@ -447,6 +916,24 @@ class ModuleManager:
         """
         return self.loaded_modules.get(module_name)
 
+    def get_module_chat_types(self, module_name):
+        """获取模块支持的聊天类型（未加载的懒加载模块从元数据读取）
+
+        Args:
+            module_name: 模块名称
+
+        Returns:
+            list: 聊天类型列表，模块不存在时返回 None
+        """
+        module_info = self.loaded_modules.get(module_name)
+        if module_info:
+            return getattr(module_info["module"], "MODULE_CHAT_TYPES",
+                           ["private", "group"])
+        lazy_info = self.lazy_modules.get(module_name)
+        if lazy_info:
+            return lazy_info["metadata"]["chat_types"]
+        return None
+
     def is_module_loaded(self, module_name):
         """检查模块是否已加载
 
@@ -496,6 +983,374 @@ class ModuleManager:
 
         return available_modules
 
+    def touch_module(self, module_name):
+        """记录模块被使用（用于空闲卸载）
+
+        Args:
+            module_name: 模块名称
+        """
+        if module_name in self.lazy_modules:
+            self.module_last_used[module_name] = time.time()
+
+    async def _setup_lazy_modules(self, available_modules):
+        """解析模块元数据并为可懒加载的模块注册占位处理器
+
+        Args:
+            available_modules: 可用模块列表
+
+        Returns:
+            set: 懒加载的模块名称
+        """
+        metadata_map = {
+            module_name: self._parse_module_metadata(module_name)
+            for module_name in available_modules
+        }
+
+        # 被其他模块依赖的模块需要立即加载
+        depended = set()
+        for metadata in metadata_map.values():
+            if metadata:
+                depended.update(metadata["depends"])
+
+        lazy_names = set()
+        for module_name, metadata in metadata_map.items():
+            if not metadata or module_name in depended:
+                continue
+            if not metadata["lazy"] or metadata["depends"]:
+                continue
+            if not (metadata["commands"] or metadata["callback_prefix"]):
+                continue
+
+            self.lazy_modules[module_name] = {
+                "metadata": metadata,
+                "placeholders": [],
+                "activations": 0
+            }
+            await self._register_placeholders(module_name)
+            lazy_names.add(module_name)
+
+        if lazy_names:
+            self.logger.debug(f"以下模块将按需加载: {sorted(lazy_names)}")
+        return lazy_names
+
+    def _parse_module_metadata(self, module_name):
+        """通过 AST 解析模块元数据，不导入模块
+
+        Args:
+            module_name: 模块名称
+
+        Returns:
+            dict: 模块元数据，无法解析时返回 None
+        """
+        module_file = self._get_module_file(module_name)
+
+        try:
+            with open(module_file, "r", encoding="utf-8") as f:
+                tree = ast.parse(f.read(), filename=module_file)
+        except Exception as e:
+            self.logger.warning(f"解析模块 {module_name} 元数据失败: {e}")
+            return None
+
+        metadata = {
+            key: (list(default) if isinstance(default, list) else default)
+            for key, default in LAZY_METADATA_FIELDS.values()
+        }
+        metadata["name"] = module_name
+
+        # 只读取模块顶层的字面量赋值
+        for node in tree.body:
+            if not isinstance(node, ast.Assign) or len(node.targets) != 1:
+                continue
+            target = node.targets[0]
+            if not isinstance(target, ast.Name) or \
+                    target.id not in LAZY_METADATA_FIELDS:
+                continue
+            try:
+                value = ast.literal_eval(node.value)
+            except ValueError:
+                # 非字面量（如表达式计算结果）无法静态解析，不能懒加载
+                self.logger.debug(
+                    f"模块 {module_name} 的 {target.id} 不是字面量，将立即加载")
+                return None
+            metadata[LAZY_METADATA_FIELDS[target.id][0]] = value
+
+        # 占位处理器需要和模块注册的处理器使用相同的权限级别
+        admin_levels = self._parse_admin_levels(tree)
+        if admin_levels is None:
+            self.logger.debug(f"模块 {module_name} 的权限级别无法静态解析，将立即加载")
+            return None
+        command_levels, callback_levels = admin_levels
+        missing = [
+            command for command in metadata["commands"]
+            if command not in command_levels
+        ]
+        if missing:
+            self.logger.debug(
+                f"模块 {module_name} 的命令 {missing} 没有以字面量注册，将立即加载")
+            return None
+        metadata["command_admin_levels"] = command_levels
+        metadata["callback_admin_level"] = min(
+            callback_levels, key=ADMIN_LEVELS.index, default=False)
+
+        return metadata
+
+    @staticmethod
+    def _parse_admin_levels(tree):
+        """从模块代码中的 register_command 和 register_callback_handler 调用读取权限级别
+
+        Args:
+            tree: 模块的 AST
+
+        Returns:
+            tuple: (命令名 -> 权限级别, 回调处理器的权限级别列表)，
+                参数不是字面量时返回 None
+        """
+        command_levels = {}
+        callback_levels = []
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or \
+                    not isinstance(node.func, ast.Attribute) or \
+                    node.func.attr not in ("register_command",
+                                           "register_callback_handler"):
+                continue
+
+            # 两个方法的 admin_level 都是第三个参数：
+            # register_command(command_name, callback, admin_level, ...)
+            # register_callback_handler(callback, pattern, admin_level, ...)
+            level_node = node.args[2] if len(node.args) > 2 else next(
+                (keyword.value for keyword in node.keywords
+                 if keyword.arg == "admin_level"), None)
+            try:
+                level = ast.literal_eval(
+                    level_node) if level_node is not None else False
+            except ValueError:
+                return None
+            if level not in ADMIN_LEVELS:
+                return None
+
+            if node.func.attr == "register_callback_handler":
+                callback_levels.append(level)
+            elif node.args and isinstance(node.args[0], ast.Constant) and \
+                    isinstance(node.args[0].value, str):
+                command_levels[node.args[0].value] = level
+
+        return command_levels, callback_levels
+
+    async def _register_placeholders(self, module_name):
+        """注册懒加载模块的占位处理器
+
+        Args:
+            module_name: 模块名称
+        """
+        lazy_info = self.lazy_modules[module_name]
+        metadata = lazy_info["metadata"]
+        trigger = self._create_lazy_trigger(module_name)
+        placeholders = []
+
+        # 占位命令（同时让 /commands 和别名模块能识别这些命令），
+        # 使用模块注册的权限级别，没有权限的用户不会触发加载
+        for command_name in metadata["commands"]:
+            await self.command_manager.register_command(
+                module_name, command_name,
+                self._create_lazy_trigger(module_name, command_name),
+                metadata["command_admin_levels"][command_name],
+                metadata["description"])
+
+        # 占位回调处理器（由命令管理器检查权限后才触发加载）
+        if metadata["callback_prefix"]:
+            handler = await self.command_manager.register_callback_handler(
+                module_name,
+                trigger,
+                pattern=f"^{re.escape(metadata['callback_prefix'])}",
+                admin_level=metadata["callback_admin_level"])
+            lazy_info["placeholders"].append((handler, 0))
+
+        # 其他触发消息，按模块支持的聊天类型过滤
+        chat_filter = None
+        if metadata["chat_types"] == ["private"]:
+            chat_filter = filters.ChatType.PRIVATE
+        elif metadata["chat_types"] == ["group"]:
+            chat_filter = filters.ChatType.GROUPS
+
+        for trigger_name in metadata["lazy_triggers"]:
+            trigger_filter = LAZY_TRIGGER_FILTERS.get(trigger_name)
+            if trigger_filter is None:
+                self.logger.warning(
+                    f"模块 {module_name} 声明了未知的触发类型: {trigger_name}")
+                continue
+            if chat_filter is not None:
+                trigger_filter = trigger_filter & chat_filter
+            placeholders.append((MessageHandler(trigger_filter, trigger),
+                                 LAZY_TRIGGER_GROUP))
+
+        for handler, group in placeholders:
+            self.application.add_handler(handler, group)
+
+        lazy_info["placeholders"].extend(placeholders)
+
+    async def _remove_placeholders(self, module_name):
+        """移除懒加载模块的占位处理器
+
+        Args:
+            module_name: 模块名称
+        """
+        lazy_info = self.lazy_modules[module_name]
+
+        for command_name in lazy_info["metadata"]["commands"]:
+            command_info = self.command_manager.commands.get(command_name)
+            if command_info and command_info["module"] == module_name:
+                await self.command_manager.unregister_command(command_name)
+
+        for handler, group in lazy_info["placeholders"]:
+            try:
+                self.application.remove_handler(handler, group)
+            except Exception as e:
+                self.logger.error(f"移除占位处理器时出错: {e}")
+        lazy_info["placeholders"] = []
+
+    def _create_lazy_trigger(self, module_name, command_name=None):
+        """创建占位处理器的回调：加载模块后把触发的更新转交给模块
+
+        Args:
+            module_name: 模块名称
+            command_name: 占位的命令名称，为 None 时按模块处理器匹配
+
+        Returns:
+            function: 回调函数
+        """
+
+        async def trigger(update, context):
+            # 命令的聊天类型由命令包装器检查，回调在这里检查
+            chat = update.effective_chat
+            if update.callback_query and chat:
+                chat_type = "private" if chat.type == "private" else "group"
+                if chat_type not in (self.get_module_chat_types(module_name)
+                                     or [chat_type]):
+                    await update.callback_query.answer(
+                        f"模块 {module_name} 不支持在 {chat_type} 中使用")
+                    return
+
+            if not await self.activate_module(module_name):
+                if update.callback_query:
+                    await update.callback_query.answer("模块加载失败，请稍后再试")
+                return
+
+            if command_name:
+                await self._forward_command(command_name, update, context)
+            else:
+                await self._forward_update(module_name, update, context)
+
+        return trigger
+
+    async def activate_module(self, module_name):
+        """加载懒加载模块
+
+        Args:
+            module_name: 模块名称
+
+        Returns:
+            bool: 模块是否已加载
+        """
+        async with self._activation_lock:
+            if module_name in self.loaded_modules:
+                return True
+
+            lazy_info = self.lazy_modules.get(module_name)
+            if not lazy_info:
+                return False
+
+            start_time = time.perf_counter()
+            await self._remove_placeholders(module_name)
+
+            if not await self.load_module(module_name):
+                # 加载失败，恢复占位处理器以便下次重试
+                await self._register_placeholders(module_name)
+                return False
+
+            lazy_info["activations"] += 1
+            self.module_last_used[module_name] = time.time()
+            self.logger.info(
+                f"已按需加载模块 {module_name}，耗时 {(time.perf_counter() - start_time) * 1000:.0f} ms"
+            )
+            return True
+
+    async def _forward_command(self, command_name, update, context):
+        """把触发懒加载的命令交给模块刚注册的命令处理器
+
+        直接调用命令包装器，以便重新进行权限和聊天类型检查；
+        通过别名调用时消息文本不是该命令，因此不能重新匹配
+
+        Args:
+            command_name: 命令名称
+            update: 更新对象
+            context: 上下文对象
+        """
+        for handler in self.application.handlers.get(0, []):
+            if isinstance(handler, CommandHandler) and \
+                    command_name in handler.commands:
+                await handler.callback(update, context)
+                return
+
+        self.logger.warning(f"模块加载后未注册命令 /{command_name}")
+
+    async def _forward_update(self, module_name, update, context):
+        """把触发懒加载的更新交给刚加载的模块处理
+
+        PTB 在处理更新前会复制处理器列表，新注册的处理器不会收到当前更新，
+        因此这里按处理器组顺序手动匹配，每组最多一个处理器
+
+        Args:
+            module_name: 模块名称
+            update: 更新对象
+            context: 上下文对象
+        """
+        interface = self.loaded_modules[module_name]["interface"]
+        handlers = sorted(interface.handlers, key=lambda x: x[1])
+
+        handled_groups = set()
+        for handler, group in handlers:
+            if group in handled_groups:
+                continue
+
+            check = handler.check_update(update)
+            if check is None or check is False:
+                continue
+
+            handled_groups.add(group)
+            await handler.handle_update(update, self.application, check,
+                                        context)
+
+    async def _idle_unload_loop(self, interval=60):
+        """定期卸载长时间未使用的懒加载模块
+
+        Args:
+            interval: 检查间隔（秒）
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                now = time.time()
+
+                for module_name in list(self.lazy_modules):
+                    if module_name not in self.loaded_modules:
+                        continue
+                    if now - self.module_last_used.get(module_name,
+                                                       0) < self.idle_unload:
+                        continue
+                    # 有进行中的会话时不卸载
+                    if await self.session_manager.get_module_session_count(
+                            module_name):
+                        continue
+
+                    async with self._activation_lock:
+                        if await self.unload_module(module_name):
+                            await self._register_placeholders(module_name)
+                            self.logger.info(
+                                f"模块 {module_name} 空闲超过 {self.idle_unload} 秒，已卸载")
+        except asyncio.CancelledError:
+            self.logger.debug("空闲模块卸载任务已取消")
+            raise
+
     def _get_module_lock(self, module_name):
         """获取模块的锁
 
@@ -519,56 +1374,35 @@ class ModuleManager:
             module: 导入的模块或 None
         """
         try:
-            # 尝试从不同的路径导入
-            try:
-                # 直接导入
-                return importlib.import_module(module_name)
-            except ImportError:
-                # 从模块目录导入
-                return importlib.import_module(
-                    f"{self.modules_dir}.{module_name}")
+            with startup_profiler.stage(f"import {module_name}", "module"):
+                # 尝试从不同的路径导入
+                try:
+                    # 直接导入
+                    return importlib.import_module(module_name)
+                except ImportError:
+                    # 从模块目录导入
+                    return importlib.import_module(
+                        f"{self.modules_dir}.{module_name}")
         except Exception as e:
             self.logger.error(f"导入模块 {module_name} 失败: {e}")
             return None
 
-    async def _get_module_metadata(self, module_name):
+    def _get_module_metadata(self, module_name, module):
         """获取模块元数据
 
         Args:
             module_name: 模块名称
+            module: 已导入的模块对象
 
         Returns:
-            dict: 模块元数据或 None
+            dict: 模块元数据
         """
-        # 模块文件路径
-        module_file = os.path.join(self.modules_dir, f"{module_name}.py")
-
-        # 检查文件是否存在
-        if not os.path.exists(module_file):
-            self.logger.warning(f"模块文件不存在: {module_file}")
-            return None
-
-        try:
-            # 导入模块
-            module = await self._import_module(module_name)
-            if not module:
-                return None
-
-            # 提取元数据
-            metadata = {
-                "name":
-                getattr(module, "MODULE_NAME", module_name),
-                "version":
-                getattr(module, "MODULE_VERSION", "unknown"),
-                "description":
-                getattr(module, "MODULE_DESCRIPTION", ""),
-                "commands":
-                getattr(module, "MODULE_COMMANDS", []),
-                "chat_types":
-                getattr(module, "MODULE_CHAT_TYPES", ["private", "group"]),
-            }
-
-            return metadata
-        except Exception as e:
-            self.logger.warning(f"获取模块 {module_name} 元数据失败: {e}")
-            return None
+        return {
+            "name": getattr(module, "MODULE_NAME", module_name),
+            "version": getattr(module, "MODULE_VERSION", "unknown"),
+            "description": getattr(module, "MODULE_DESCRIPTION", ""),
+            "commands": getattr(module, "MODULE_COMMANDS", []),
+            "chat_types": getattr(module, "MODULE_CHAT_TYPES",
+                                  ["private", "group"]),
+            "depends": self._get_module_depends(module)
+        }
@@ -0,0 +1,310 @@
+# core/sharding.py - 多进程分片
+
+import os
+import time
+import queue
+import signal
+import asyncio
+import multiprocessing
+from telegram import Update
+from utils.logger import setup_logger
+from utils import event_loop
+
+
+def shard_for(key, shard_count):
+    """计算聊天（或用户）所属的分片
+
+    Args:
+        key: 聊天 ID 或用户 ID，为 None 时归属分片 0
+        shard_count: 分片总数
+
+    Returns:
+        int: 分片编号
+    """
+    if shard_count <= 1 or key is None:
+        return 0
+    return hash(int(key)) % shard_count
+
+
+def get_update_shard_key(update):
+    """获取更新的分片键：优先使用聊天 ID，其次使用用户 ID
+
+    Args:
+        update: 更新对象
+
+    Returns:
+        int: 分片键，无法确定时返回 None
+    """
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class ShardDispatcher:
+    """前端分发进程
+
+    负责获取更新（轮询或 Webhook），按 hash(chat_id) % N 转发给工作进程；
+    同时转发工作进程之间的配置和状态变化通知，并在工作进程异常退出时重启它。
+    """
+
+    def __init__(self, config_dir="config", token=None, workers=2):
+        """初始化分发器
+
+        Args:
+            config_dir: 配置目录
+            token: Bot Token（可选，会写入配置文件供工作进程读取）
+            workers: 工作进程数量
+        """
+        # 避免循环导入
+        from core.bot_engine import BotEngine
+
+        self.config_dir = config_dir
+        self.worker_count = workers
+        self.logger = setup_logger("ShardDispatcher")
+
+        # 分发进程只负责获取更新，不加载模块
+        self.engine = BotEngine(config_dir=config_dir,
+                                token=token,
+                                dispatch_only=True)
+
+        self._context = multiprocessing.get_context("spawn")
+        self.control_queue = None
+        self.workers = []  # [{"process", "inbox", "restarts"}]
+        self.tasks = []
+        self.stopping = False
+
+        self.stats = {
+            "dispatched": [0] * workers,
+            "broadcasts": 0,
+            "restarts": 0,
+            "start_time": time.time()
+        }
+
+    async def initialize(self):
+        """初始化分发进程组件"""
+        await self.engine.initialize()
+
+    async def start(self):
+        """启动工作进程和更新获取"""
+        self.control_queue = self._context.Queue()
+
+        for shard_id in range(self.worker_count):
+            self.workers.append({
+                "process": None,
+                "inbox": self._context.Queue(),
+                "restarts": 0
+            })
+            self._start_worker(shard_id)
+
+        await self.engine.start()
+
+        self.tasks.append(asyncio.create_task(self._dispatch_loop()))
+        self.tasks.append(asyncio.create_task(self._control_loop()))
+        self.tasks.append(asyncio.create_task(self._monitor_workers()))
+
+        self.logger.info(f"分片模式已启动，工作进程数: {self.worker_count}")
+
+    async def stop(self, timeout=None):
+        """停止更新获取并关闭所有工作进程
+
+        Args:
+            timeout: 等待工作进程退出的最长时间（秒），默认为工作进程等待处理完成的
+                时间（shutdown.drain_timeout）再加 10 秒
+        """
+        self.stopping = True
+
+        if timeout is None:
+            timeout = self.engine.config_manager.main_config.get(
+                "shutdown", {}).get("drain_timeout", 30) + 10
+
+        # 先停止获取更新，再把已收到的更新全部分发出去
+        await self.engine.stop()
+        self._drain_update_queue()
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        for worker in self.workers:
+            worker["inbox"].put(("stop", None))
+
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for shard_id, worker in enumerate(self.workers):
+            process = worker["process"]
+            remaining = max(0, deadline - time.monotonic())
+            await loop.run_in_executor(None, process.join, remaining)
+            if process.is_alive():
+                self.logger.warning(f"工作进程 {shard_id} 未能按时退出，强制终止")
+                process.terminate()
+                await loop.run_in_executor(None, process.join, 5)
+
+        # 唤醒阻塞在控制队列上的读取线程
+        if self.control_queue:
+            self.control_queue.put(("stop", None, None))
+
+        self.logger.info("分片模式已停止")
+
+    def _start_worker(self, shard_id):
+        """启动（或重启）工作进程
+
+        Args:
+            shard_id: 分片编号
+        """
+        worker = self.workers[shard_id]
+        process = self._context.Process(
+            target=run_worker,
+            args=(shard_id, self.worker_count, self.config_dir,
+                  worker["inbox"], self.control_queue,
+                  event_loop.get_loop_name()),
+            name=f"shard-{shard_id}",
+            daemon=False)
+        process.start()
+        worker["process"] = process
+        self.logger.debug(f"工作进程 {shard_id} 已启动 (pid {process.pid})")
+
+    def _dispatch(self, update):
+        """将更新发送到对应的工作进程
+
+        Args:
+            update: 更新对象
+        """
+        data = update.to_dict()
+        if self.engine.traffic_recorder:
+            self.engine.traffic_recorder.record(data)
+
+        shard_id = shard_for(get_update_shard_key(update), self.worker_count)
+        self.workers[shard_id]["inbox"].put(("update", data))
+        self.stats["dispatched"][shard_id] += 1
+
+    def _drain_update_queue(self):
+        """分发更新队列中剩余的更新"""
+        update_queue = self.engine.application.update_queue
+        while not update_queue.empty():
+            update = update_queue.get_nowait()
+            if isinstance(update, Update):
+                self._dispatch(update)
+
+    async def _dispatch_loop(self):
+        """从更新队列中取出更新并分发"""
+        update_queue = self.engine.application.update_queue
+        while True:
+            update = await update_queue.get()
+            if not isinstance(update, Update):
+                continue
+            try:
+                self._dispatch(update)
+            except Exception as e:
+                self.logger.error(f"分发更新 {update.update_id} 失败: {e}")
+
+    async def _control_loop(self):
+        """处理工作进程发来的控制消息"""
+        loop = asyncio.get_running_loop()
+        while True:
+            kind, shard_id, payload = await loop.run_in_executor(
+                None, self.control_queue.get)
+
+            if kind == "stop":
+                return
+
+            if kind == "ready":
+                self.logger.info(f"工作进程 {shard_id} 已就绪")
+            elif kind == "broadcast":
+                # 转发给除发送者以外的所有工作进程
+                self.stats["broadcasts"] += 1
+                for target_id, worker in enumerate(self.workers):
+                    if target_id != shard_id:
+                        worker["inbox"].put(payload)
+
+    async def _monitor_workers(self, interval=5):
+        """监控工作进程，异常退出时重启
+
+        Args:
+            interval: 检查间隔（秒）
+        """
+        while True:
+            await asyncio.sleep(interval)
+            for shard_id, worker in enumerate(self.workers):
+                if self.stopping:
+                    return
+                process = worker["process"]
+                if process.is_alive():
+                    continue
+
+                self.logger.error(
+                    f"工作进程 {shard_id} 已退出 (退出码 {process.exitcode})，正在重启")
+                worker["restarts"] += 1
+                self.stats["restarts"] += 1
+                self._start_worker(shard_id)
+
+
+def run_worker(shard_id,
+               shard_count,
+               config_dir,
+               inbox,
+               control_queue,
+               loop="asyncio"):
+    """工作进程入口
+
+    Args:
+        shard_id: 分片编号
+        shard_count: 分片总数
+        config_dir: 配置目录
+        inbox: 接收更新和通知的队列
+        control_queue: 发往分发进程的队列
+        loop: 事件循环名称（与分发进程相同）
+    """
+    # 由分发进程统一处理中断信号
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    event_loop.run(
+        _worker_main(shard_id, shard_count, config_dir, inbox, control_queue,
+                     os.getppid()), loop)
+
+
+async def _worker_main(shard_id, shard_count, config_dir, inbox,
+                       control_queue, parent_pid):
+    """工作进程主循环
+
+    分发进程被强制结束（如 SIGKILL）时不会发送 stop，工作进程每次等待超时时检查
+    父进程是否仍然存在（父进程退出后 getppid 会变化），不存在时自行停止
+    """
+    # 避免循环导入
+    from core.bot_engine import BotEngine
+
+    logger = setup_logger(f"Shard.{shard_id}")
+    bot = BotEngine(config_dir=config_dir,
+                    shard_id=shard_id,
+                    shard_count=shard_count,
+                    shard_channel=control_queue)
+
+    await bot.initialize()
+    await bot.start(fetch_updates=False)
+    control_queue.put(("ready", shard_id, None))
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                kind, payload = await loop.run_in_executor(
+                    None, inbox.get, True, 1.0)
+            except queue.Empty:
+                if os.getppid() != parent_pid:
+                    logger.warning("分发进程已退出，正在停止工作进程")
+                    break
+                continue
+
+            if kind == "stop":
+                break
+
+            try:
+                if kind == "update":
+                    update = Update.de_json(payload, bot.application.bot)
+                    await bot.application.update_queue.put(update)
+                else:
+                    await bot.handle_shard_message(kind, payload)
+            except Exception as e:
+                logger.error(f"处理分片消息 {kind} 失败: {e}")
+    finally:
+        await bot.stop()
@@ -0,0 +1,181 @@
+# core/task_supervisor.py - 模块后台任务管理
+
+import asyncio
+import functools
+from utils.logger import setup_logger
+
+# 默认任务分组
+DEFAULT_GROUP = "default"
+
+
+class TaskSupervisor:
+    """模块后台任务管理器
+
+    持有模块创建的所有后台任务的强引用，按分组限制同时运行的数量（超过时排队），
+    排队数量达到上限时拒绝新任务；记录任务异常，模块卸载时取消全部任务。
+    """
+
+    def __init__(self, owner, max_concurrent=16, max_queued=500):
+        """初始化任务管理器
+
+        Args:
+            owner: 所属模块名称（用于日志）
+            max_concurrent: 每个分组同时运行的任务上限（0 为不限制）
+            max_queued: 所有分组排队等待的任务总数上限
+        """
+        self.owner = owner
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.logger = setup_logger(f"Tasks.{owner}")
+
+        self.tasks = {}  # 任务 -> 分组
+        self._limits = {}  # 分组 -> 并发上限
+        self._semaphores = {}  # 分组 -> 信号量
+        self._running = {}  # 分组 -> 运行中的任务数量
+        self._waiting = set()  # 排队等待的任务
+        self.closed = False
+
+        self.stats = {"spawned": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+    def set_limit(self, group, limit):
+        """设置分组的并发上限，必须在该分组创建第一个任务之前调用
+
+        长时间运行的任务（如等待到期的提醒）应使用单独的分组并设为 0（不限制）
+
+        Args:
+            group: 分组名称
+            limit: 并发上限，0 为不限制
+        """
+        self._limits[group] = limit
+        self._semaphores.pop(group, None)
+
+    def _get_semaphore(self, group):
+        if group not in self._semaphores:
+            limit = self._limits.get(group, self.max_concurrent)
+            self._semaphores[group] = asyncio.Semaphore(
+                limit) if limit else None
+        return self._semaphores[group]
+
+    def spawn(self, coro, name=None, group=DEFAULT_GROUP):
+        """创建受管理的后台任务
+
+        Args:
+            coro: 协程对象
+            name: 任务名称（用于日志）
+            group: 分组名称
+
+        Returns:
+            asyncio.Task: 创建的任务，被拒绝时返回 None
+        """
+        name = name or getattr(coro, "__qualname__", "task")
+
+        if self.closed:
+            coro.close()
+            self.logger.debug(f"模块已卸载，忽略任务 {name}")
+            return None
+
+        semaphore = self._get_semaphore(group)
+        if semaphore is not None:
+            # 分组已满时新任务需要排队，排队过多则拒绝
+            limit = self._limits.get(group, self.max_concurrent)
+            active = sum(1 for g in self.tasks.values() if g == group)
+            if active >= limit and len(self._waiting) >= self.max_queued:
+                coro.close()
+                self.stats["rejected"] += 1
+                self.logger.warning(
+                    f"排队的任务已达上限 ({self.max_queued})，拒绝任务 {name}")
+                return None
+        else:
+            limit = active = 0
+
+        task = asyncio.create_task(self._run(coro, name, group, semaphore),
+                                   name=f"{self.owner}:{name}")
+        self.tasks[task] = group
+        if limit and active >= limit:
+            self._waiting.add(task)
+        task.add_done_callback(functools.partial(self._on_done, coro))
+        self.stats["spawned"] += 1
+        return task
+
+    async def _run(self, coro, name, group, semaphore):
+        """在分组并发上限内执行协程"""
+        try:
+            if semaphore is not None:
+                await semaphore.acquire()
+                self._waiting.discard(asyncio.current_task())
+        except asyncio.CancelledError:
+            coro.close()
+            raise
+
+        self._running[group] = self._running.get(group, 0) + 1
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            self.logger.error(f"后台任务 {name} 出错: {e}", exc_info=True)
+        finally:
+            self._running[group] -= 1
+            if semaphore is not None:
+                semaphore.release()
+
+    def _on_done(self, coro, task):
+        self.tasks.pop(task, None)
+        self._waiting.discard(task)
+        if task.cancelled():
+            # 任务在开始执行前被取消时，协程需要手动关闭
+            coro.close()
+        else:
+            self.stats["completed"] += 1
+
+    async def cancel_group(self, group):
+        """取消分组中的所有任务
+
+        Args:
+            group: 分组名称
+        """
+        tasks = [task for task, g in self.tasks.items() if g == group]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def cancel_all(self):
+        """取消所有任务并拒绝之后创建的任务"""
+        self.closed = True
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.logger.debug(f"已取消 {len(tasks)} 个后台任务")
+
+    def get_drainable_count(self):
+        """获取停止前需要等待完成的任务数量
+
+        不限制并发的分组用于长时间等待的任务（如定时提醒），停止时直接取消，不计入
+
+        Returns:
+            int: 任务数量
+        """
+        return sum(1 for group in self.tasks.values()
+                   if self._limits.get(group, self.max_concurrent))
+
+    def get_stats(self):
+        """获取任务统计信息
+
+        Returns:
+            dict: 统计信息
+        """
+        stats = dict(self.stats)
+        stats.update({
+            "live": len(self.tasks),
+            "running": sum(self._running.values()),
+            "queued": len(self._waiting),
+            "groups": {
+                group: count
+                for group, count in self._running.items() if count
+            }
+        })
+        return stats
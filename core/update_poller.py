@@ -0,0 +1,234 @@
+# core/update_poller.py - 自适应长轮询
+
+import time
+import asyncio
+import telegram
+from collections import deque
+from telegram.request import BaseRequest, HTTPXRequest
+from utils.logger import setup_logger
+from utils import startup_profiler
+
+
+class AdaptivePoller:
+    """自适应长轮询器
+
+    与 Updater.start_polling 不同，批次非空时立即发起下一次轮询；
+    只有在空闲（批次为空且服务器未保持长连接）时才逐步退避到 idle_interval。
+    """
+
+    def __init__(self,
+                 application,
+                 timeout=20,
+                 idle_interval=1.0,
+                 limit=100,
+                 error_callback=None,
+                 stats_size=500):
+        """初始化轮询器
+
+        Args:
+            application: Telegram Application 实例
+            timeout: 长轮询超时时间（秒）
+            idle_interval: 空闲时的最大退避间隔（秒）
+            limit: 单次获取的最大更新数量
+            error_callback: 轮询错误回调 (error) -> None
+            stats_size: 保留的统计样本数量
+        """
+        self.application = application
+        self.timeout = int(timeout)
+        self.idle_interval = idle_interval
+        self.limit = limit
+        self.error_callback = error_callback
+        self.logger = setup_logger("UpdatePoller")
+
+        self.offset = 0
+        self.running = False
+        self._task = None
+
+        # 统计数据
+        self.round_trips = deque(maxlen=stats_size)  # 轮询往返时间（秒）
+        self.batch_sizes = deque(maxlen=stats_size)  # 非空批次大小
+        self.stats = {
+            "polls": 0,
+            "empty_polls": 0,
+            "updates": 0,
+            "errors": 0,
+            "first_poll_time": None
+        }
+
+    async def start(self, drop_pending_updates=False, bootstrap_retries=5):
+        """启动轮询
+
+        Args:
+            drop_pending_updates: 是否丢弃未处理的更新
+            bootstrap_retries: 删除 Webhook 失败时的重试次数
+        """
+        if self.running:
+            return
+
+        # 轮询前必须删除 Webhook
+        for attempt in range(1, bootstrap_retries + 1):
+            try:
+                await self.application.bot.delete_webhook(
+                    drop_pending_updates=drop_pending_updates)
+                break
+            except telegram.error.NetworkError as e:
+                if attempt == bootstrap_retries:
+                    raise
+                self.logger.warning(f"删除 Webhook 失败: {e}，将在 {attempt} 秒后重试")
+                await asyncio.sleep(attempt)
+
+        self.running = True
+        self._task = asyncio.create_task(self._poll_loop(),
+                                         name="AdaptivePoller")
+        self.logger.info("自适应轮询已启动")
+
+    async def stop(self):
+        """停止轮询，并向服务器确认已接收的更新"""
+        if not self.running:
+            return
+
+        self.running = False
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        # 确认已放入队列的更新，避免重启后重复接收
+        if self.offset:
+            try:
+                await self.application.bot.get_updates(offset=self.offset,
+                                                       limit=1,
+                                                       timeout=0)
+            except Exception as e:
+                self.logger.warning(f"确认已接收的更新失败: {e}")
+
+        self.logger.info("自适应轮询已停止")
+
+    async def _poll_loop(self):
+        """轮询主循环"""
+        idle_delay = 0
+        error_delay = 0
+
+        while self.running:
+            started = time.monotonic()
+            try:
+                updates = await self.application.bot.get_updates(
+                    offset=self.offset,
+                    limit=self.limit,
+                    timeout=self.timeout,
+                    allowed_updates=None)
+            except asyncio.CancelledError:
+                raise
+            except telegram.error.RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                self.logger.warning(f"轮询受到限流，将在 {retry_after} 秒后重试")
+                await asyncio.sleep(retry_after)
+                continue
+            except telegram.error.TimedOut:
+                # 长轮询超时属于正常情况，立即重试
+                continue
+            except Exception as e:
+                self.stats["errors"] += 1
+                if self.error_callback:
+                    self.error_callback(e)
+                # 连续错误时指数退避，最长 30 秒
+                error_delay = min(30, error_delay * 2 or 1)
+                await asyncio.sleep(error_delay)
+                continue
+
+            elapsed = time.monotonic() - started
+            error_delay = 0
+
+            self.stats["polls"] += 1
+            self.round_trips.append(elapsed)
+            if self.stats["first_poll_time"] is None:
+                self.stats["first_poll_time"] = time.time()
+                startup_profiler.mark("first_poll")
+
+            if updates:
+                # 有更新时立即放入队列并马上再次轮询
+                self.offset = updates[-1].update_id + 1
+                self.stats["updates"] += len(updates)
+                self.batch_sizes.append(len(updates))
+                for update in updates:
+                    await self.application.update_queue.put(update)
+                idle_delay = 0
+                continue
+
+            self.stats["empty_polls"] += 1
+
+            # 服务器保持了长连接说明已经在等待，无需额外退避
+            if self.timeout and elapsed >= self.timeout * 0.9:
+                idle_delay = 0
+                continue
+
+            # 短轮询或连接被提前返回时逐步退避
+            idle_delay = min(self.idle_interval, idle_delay * 2 or 0.05)
+            await asyncio.sleep(idle_delay)
+
+    def get_stats(self):
+        """获取轮询统计信息
+
+        Returns:
+            dict: 统计信息
+        """
+        round_trips = sorted(self.round_trips)
+        batch_sizes = list(self.batch_sizes)
+
+        stats = dict(self.stats)
+        stats["rtt_avg"] = sum(round_trips) / len(
+            round_trips) if round_trips else 0
+        stats["rtt_p95"] = round_trips[min(
+            len(round_trips) - 1, int(len(round_trips) *
+                                      0.95))] if round_trips else 0
+        stats["batch_avg"] = sum(batch_sizes) / len(
+            batch_sizes) if batch_sizes else 0
+        stats["batch_max"] = max(batch_sizes) if batch_sizes else 0
+        return stats
+
+
+class FirstPollRequest(BaseRequest):
+    """getUpdates 使用的请求对象包装，第一次轮询成功时记录 first_poll 标记
+
+    Updater.start_polling 没有轮询成功的回调，启动耗时分析通过此包装记录首次轮询时间
+    """
+
+    def __init__(self, request=None):
+        """初始化
+
+        Args:
+            request: 被包装的请求对象，默认与 ApplicationBuilder 相同（连接池大小为 1）
+        """
+        self._request = request or HTTPXRequest(connection_pool_size=1)
+        self._polled = False
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url, method, request_data=None,
+                         read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        result = await self._request.do_request(url,
+                                                method,
+                                                request_data=request_data,
+                                                read_timeout=read_timeout,
+                                                write_timeout=write_timeout,
+                                                connect_timeout=connect_timeout,
+                                                pool_timeout=pool_timeout)
+        if not self._polled and result[0] == 200:
+            self._polled = True
+            startup_profiler.mark("first_poll")
+        return result
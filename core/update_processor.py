@@ -0,0 +1,221 @@
+# core/update_processor.py - 并发更新处理器
+
+import time
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from utils.logger import setup_logger
+
+# 支持的排序键
+ORDERING_KEYS = ("chat", "chat_user")
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """按键分组的并发更新处理器
+
+    不同键（聊天或聊天内的用户）之间并发处理，同一键内的更新按到达顺序
+    依次处理。每个活跃的键拥有一个队列和一个工作任务，空闲超时后自动清理；
+    所有工作任务共享一个全局并发上限。
+    """
+
+    def __init__(self,
+                 max_concurrent=8,
+                 ordering="chat",
+                 max_pending=1000,
+                 idle_timeout=60):
+        """初始化处理器
+
+        Args:
+            max_concurrent: 同时执行的更新数量上限
+            ordering: 排序键，"chat" 或 "chat_user"
+            max_pending: 已接收但未完成的更新数量上限（超过时阻塞接收）
+            idle_timeout: 键空闲多久后清理其工作任务（秒）
+        """
+        if ordering not in ORDERING_KEYS:
+            raise ValueError(f"不支持的排序键: {ordering}")
+
+        # 父类的信号量限制的是排队中的更新总数，实际执行由全局信号量控制
+        super().__init__(max(max_pending, max_concurrent))
+        self.max_concurrent = max_concurrent
+        self.ordering = ordering
+        self.idle_timeout = idle_timeout
+        self.logger = setup_logger("UpdateProcessor")
+
+        self._execution_semaphore = asyncio.Semaphore(max_concurrent)
+        # 键 -> {"queue": 队列, "worker": 工作任务}
+        self._keys = {}
+        self._running = 0
+
+        self.stats = {
+            "processed": 0,
+            "unordered": 0,
+            "workers_started": 0,
+            "peak_queue": 0,
+            "peak_keys": 0,
+            "wait_time_total": 0.0
+        }
+
+    def get_key(self, update):
+        """计算更新的排序键
+
+        Args:
+            update: 更新对象
+
+        Returns:
+            tuple: 排序键，无法分组时返回 None
+        """
+        if not isinstance(update, Update):
+            return None
+
+        chat = update.effective_chat
+        user = update.effective_user
+
+        if chat:
+            if self.ordering == "chat_user" and user:
+                return (chat.id, user.id)
+            return (chat.id, )
+
+        # 内联查询等没有聊天的更新，按用户保序
+        if user:
+            return ("user", user.id)
+
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        """将更新放入对应键的队列并等待处理完成
+
+        Args:
+            update: 更新对象
+            coroutine: 处理该更新的协程
+        """
+        key = self.get_key(update)
+
+        if key is None:
+            self.stats["unordered"] += 1
+            await self._run(coroutine, time.monotonic())
+            return
+
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = {"queue": asyncio.Queue(), "worker": None}
+            self._keys[key] = entry
+            self.stats["peak_keys"] = max(self.stats["peak_keys"],
+                                          len(self._keys))
+
+        future = asyncio.get_running_loop().create_future()
+        entry["queue"].put_nowait((coroutine, future, time.monotonic()))
+        self.stats["peak_queue"] = max(self.stats["peak_queue"],
+                                       entry["queue"].qsize())
+
+        if entry["worker"] is None or entry["worker"].done():
+            entry["worker"] = asyncio.create_task(
+                self._worker(key, entry), name=f"UpdateWorker:{key}")
+            self.stats["workers_started"] += 1
+
+        await future
+
+    async def _worker(self, key, entry):
+        """依次处理某个键的队列，空闲超时后退出
+
+        Args:
+            key: 排序键
+            entry: 键对应的队列信息
+        """
+        queue = entry["queue"]
+        try:
+            while True:
+                try:
+                    coroutine, future, queued_at = await asyncio.wait_for(
+                        queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        break
+                    continue
+
+                try:
+                    await self._run(coroutine, queued_at)
+                    if not future.done():
+                        future.set_result(None)
+                except asyncio.CancelledError:
+                    if not future.done():
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+        finally:
+            # 取消剩余的等待者，并在仍指向自己时移除键
+            while not queue.empty():
+                coroutine, future, _ = queue.get_nowait()
+                coroutine.close()
+                if not future.done():
+                    future.cancel()
+            if self._keys.get(key) is entry:
+                del self._keys[key]
+
+    async def _run(self, coroutine, queued_at):
+        """在全局并发上限内执行协程
+
+        Args:
+            coroutine: 处理更新的协程
+            queued_at: 入队时间（monotonic）
+        """
+        async with self._execution_semaphore:
+            self.stats["wait_time_total"] += time.monotonic() - queued_at
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+                self.stats["processed"] += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        """停止所有工作任务"""
+        workers = [
+            entry["worker"] for entry in self._keys.values()
+            if entry["worker"] and not entry["worker"].done()
+        ]
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+        self._keys.clear()
+
+    def get_queue_lengths(self, top=5):
+        """获取队列最长的几个键
+
+        Args:
+            top: 返回的数量
+
+        Returns:
+            list: [(键, 队列长度), ...]
+        """
+        lengths = [(key, entry["queue"].qsize())
+                   for key, entry in self._keys.items()]
+        lengths.sort(key=lambda x: x[1], reverse=True)
+        return lengths[:top]
+
+    def get_stats(self):
+        """获取处理器统计信息
+
+        Returns:
+            dict: 统计信息
+        """
+        queue_lengths = [entry["queue"].qsize() for entry in self._keys.values()]
+        processed = self.stats["processed"]
+
+        stats = dict(self.stats)
+        stats.update({
+            "max_concurrent": self.max_concurrent,
+            "ordering": self.ordering,
+            "running": self._running,
+            "active_keys": len(self._keys),
+            "queued": sum(queue_lengths),
+            "max_queue": max(queue_lengths) if queue_lengths else 0,
+            "avg_wait": self.stats["wait_time_total"] /
+            processed if processed else 0
+        })
+        return stats
@@ -0,0 +1,93 @@
+# core/web_server.py - 内嵌 HTTP 服务器
+
+import ssl
+from aiohttp import web
+from utils.logger import setup_logger
+
+
+class WebServer:
+    """内嵌 aiohttp 服务器，用于接收 Webhook 以及提供监控端点"""
+
+    def __init__(self, listen="0.0.0.0", port=8443, cert=None, key=None):
+        """初始化服务器
+
+        Args:
+            listen: 监听地址
+            port: 监听端口
+            cert: TLS 证书文件路径（可选）
+            key: TLS 私钥文件路径（可选）
+        """
+        self.listen = listen
+        self.port = port
+        self.cert = cert
+        self.key = key
+        self.logger = setup_logger("WebServer")
+
+        # 路由表 [(method, path, handler)]，在启动时注册到应用
+        self.routes = []
+
+        self._runner = None
+        self._site = None
+
+    @property
+    def running(self):
+        """服务器是否正在运行"""
+        return self._runner is not None
+
+    def add_route(self, method, path, handler):
+        """添加路由，必须在 start 之前调用
+
+        Args:
+            method: HTTP 方法
+            path: 路径
+            handler: 异步处理函数 (request) -> web.Response
+
+        Returns:
+            bool: 是否成功添加
+        """
+        if self.running:
+            self.logger.warning(f"服务器已启动，无法添加路由 {method} {path}")
+            return False
+
+        self.routes.append((method, path, handler))
+        return True
+
+    async def start(self):
+        """启动服务器"""
+        if self.running:
+            return
+
+        app = web.Application()
+        for method, path, handler in self.routes:
+            app.router.add_route(method, path, handler)
+
+        # 配置 TLS（如果提供了证书）
+        ssl_context = None
+        if self.cert:
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(self.cert, self.key)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        self._site = web.TCPSite(self._runner,
+                                 self.listen,
+                                 self.port,
+                                 ssl_context=ssl_context)
+        await self._site.start()
+
+        scheme = "https" if ssl_context else "http"
+        self.logger.info(f"HTTP 服务器已启动: {scheme}://{self.listen}:{self.port}")
+
+    async def stop(self):
+        """停止服务器"""
+        if not self.running:
+            return
+
+        try:
+            await self._runner.cleanup()
+        except Exception as e:
+            self.logger.error(f"停止 HTTP 服务器时出错: {e}")
+
+        self._runner = None
+        self._site = None
+        self.logger.info("HTTP 服务器已停止")
@@ -8,9 +8,17 @@ import aiohttp
 import base64
 import telegram
 import re
+import io
+import bisect
+import hashlib
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
 from typing import Dict, List, Optional, Any, Tuple, Callable, Union
 from utils.formatter import TextFormatter
-from telegram import Update, File, InlineKeyboardButton, InlineKeyboardMarkup
+from utils.atomic_file import SharedJsonFile, atomic_write_json, file_lock
+from utils.live_message import LiveMessage
+from PIL import ExifTags, Image, ImageOps
+from telegram import Update, PhotoSize, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, MessageHandler, filters
 
 # 模块元数据
@@ -19,6 +27,7 @@ MODULE_VERSION = "3.2.1"
 MODULE_DESCRIPTION = "支持多种 AI 的聊天助手"
 MODULE_COMMANDS = ["ai", "aiconfig", "aiclear", "aiwhitelist"]
 MODULE_CHAT_TYPES = ["private", "group"]  # 支持私聊和群组
+MODULE_LAZY = False  # 需要响应群组中的提及和回复，不能按需加载
 
 # 按钮回调前缀
 CALLBACK_PREFIX = "ai_cfg"
@@ -33,8 +42,85 @@ CONFIG_FILE = "config/ai_config.json"  # 配置文件（API keys、服务商配
 MAX_CONTEXT_LENGTH = 20  # 上下文最大消息对数
 REQUEST_TIMEOUT = 60  # API 请求超时时间（秒）
 MAX_MESSAGE_LENGTH = 4000  # Telegram 最大消息长度
-MIN_UPDATE_INTERVAL = 1.5  # 最小流式更新间隔（秒）
+MIN_UPDATE_INTERVAL = 1.5  # 最小流式更新间隔（秒），消息越长间隔越大
 MAX_CONCURRENT_REQUESTS = 5  # 最大并发请求数
+MAX_USER_REQUESTS = 1  # 每个用户同时进行的请求数
+MAX_QUEUED_REQUESTS = 100  # 排队等待的请求数上限
+QUEUE_UPDATE_INTERVAL = 3.0  # 排队位置的更新间隔（秒）
+QUEUE_WAIT_SAMPLES = 200  # 统计排队时间使用的最近样本数量
+
+# 后台任务分组：AI 回复的并发由 RequestScheduler 公平分配，不能在默认分组中
+# 按先来后到排队；保存和压缩也不排在大量回复之后
+AI_RESPONSE_GROUP = "ai_response"
+# 回复分组的上限只需容纳调度器允许的运行和排队数量；不设为 0（不限制），
+# 停止时仍会等待进行中的回复完成
+AI_RESPONSE_TASK_LIMIT = MAX_CONCURRENT_REQUESTS + MAX_QUEUED_REQUESTS
+AI_SAVE_GROUP = "ai_save"
+AI_COMPACT_GROUP = "ai_compact"
+AI_PERIODIC_GROUP = "ai_periodic"  # 定期清理任务（长期运行，不占用其他分组的并发名额）
+
+# 图像预处理：缩小到服务商的最长边和像素上限后重新编码
+DEFAULT_IMAGE_MAX_EDGE = 1568  # 默认最长边（像素，服务商配置 image_max_edge）
+IMAGE_MAX_PIXELS = 1_200_000  # 像素总数上限
+IMAGE_QUALITY = 85  # JPEG 编码质量
+IMAGE_CACHE_SIZE = 64  # 缓存的处理结果数量
+IMAGE_CACHE_BYTES = 32 * 1024 * 1024  # 缓存的处理结果总大小上限
+
+# Anthropic 提示缓存断点
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# 服务商健康状态和熔断
+HEALTH_WINDOW = 50  # 统计错误率和延迟使用的最近请求数量
+CIRCUIT_FAILURE_THRESHOLD = 3  # 连续失败多少次后熔断
+CIRCUIT_OPEN_SECONDS = 60  # 熔断持续时间（秒），之后放行一个试探请求
+HEDGE_MIN_SAMPLES = 5  # 至少有多少个首字延迟样本才启用对冲请求
+NON_RETRYABLE_STATUS = (400, 413, 422)  # 请求内容有误，换服务商也不会成功
+
+# 对话记录按用户分别保存
+CONVERSATIONS_DIR = "data/ai/conversations"
+SAVE_DELAY = 2.0  # 合并保存的等待时间（秒）
+
+# 请求上下文的默认 token 上限（服务商配置 max_context_tokens）
+DEFAULT_MAX_CONTEXT_TOKENS = 8000
+MESSAGE_TOKEN_OVERHEAD = 4  # 每条消息的角色和分隔符开销
+
+# 各请求格式的 token 估算参数: (每个 token 的 ASCII 字符数, 每个非 ASCII 字符的 token 数)
+TOKEN_ESTIMATE_RATIOS = {"openai": (4.0, 1.0), "anthropic": (3.5, 1.2)}
+WIDE_CHAR_CACHE_SIZE = 4096  # 缓存非 ASCII 字符数量的文本数量
+
+# 对话压缩：上下文超过阈值时把较早的消息总结为一条摘要（默认关闭）
+DEFAULT_COMPACTION = {
+    "enabled": False,
+    "threshold_tokens": 4000,  # 触发压缩的上下文 token 数量
+    "keep_recent": 6,  # 保留不压缩的最近消息数量
+    "cooldown": 600  # 同一用户两次压缩之间的最短间隔（秒）
+}
+COMPACTION_PROMPT = ("请把下面的对话总结为简洁的摘要，保留用户的身份、偏好、目标、已确认的事实和结论，"
+                     "以及后续对话需要的上下文。只输出摘要本身，不超过 300 字。")
+SUMMARY_PREFIX = "之前对话的摘要：\n"
+
+# 响应缓存：相同的无上下文提问直接返回之前的回复（默认关闭）
+RESPONSE_CACHE_FILE = "data/ai/response_cache.json"
+DEFAULT_RESPONSE_CACHE = {
+    "enabled": False,
+    "ttl": 3600,  # 缓存有效期（秒）
+    "max_entries": 500,  # 最多缓存的回复数量
+    "max_bytes": 5 * 1024 * 1024,  # 缓存回复的总大小上限（内存和文件）
+    "include_context": False  # 是否缓存带有对话上下文的请求
+}
+
+# 用量统计：按小时分桶记录各服务商和模型的延迟直方图和 token 数量，与配置分开保存
+USAGE_METRICS_FILE = "data/ai/usage_metrics.json"
+METRICS_BUCKET_SECONDS = 3600  # 每个时间桶的长度（秒）
+METRICS_RETENTION = 7 * 24 * 3600  # 时间桶保留时长（秒）
+METRICS_WINDOW = 24 * 3600  # 统计面板显示的时间范围（秒）
+LATENCY_BOUNDS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)  # 延迟直方图的上界（秒）
+TPS_BOUNDS = (5, 10, 20, 30, 50, 75, 100, 150, 200)  # 生成速度直方图的上界（token/秒）
+
+# 消息角色的紧凑表示，消息保存为 [角色, 内容, 时间戳]，摘要在请求中作为系统消息发送
+ROLE_CODES = {"system": 0, "user": 1, "assistant": 2, "summary": 3}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+PINNED_ROLES = (ROLE_CODES["system"], ROLE_CODES["summary"])  # 截断上下文时保留的角色
 
 # 服务商模板
 PROVIDER_TEMPLATES = {
@@ -44,6 +130,10 @@ PROVIDER_TEMPLATES = {
         "api_key": "",
         "model": "gpt-4o",
         "temperature": 0.7,
+        "max_context_tokens": DEFAULT_MAX_CONTEXT_TOKENS,
+        "fallback_provider": None,
+        "hedge": False,
+        "image_max_edge": DEFAULT_IMAGE_MAX_EDGE,
         "system_prompt": "你是一个有用的助手。",
         "request_format": "openai",
         "supports_image": True
@@ -55,6 +145,10 @@ PROVIDER_TEMPLATES = {
         "api_key": "",
         "model": "gemini-2.0-flash",
         "temperature": 0.7,
+        "max_context_tokens": DEFAULT_MAX_CONTEXT_TOKENS,
+        "fallback_provider": None,
+        "hedge": False,
+        "image_max_edge": DEFAULT_IMAGE_MAX_EDGE,
         "system_prompt": "你是一个有用的助手。",
         "request_format": "openai",  # 使用 OpenAI 兼容模式
         "supports_image": True
@@ -65,6 +159,10 @@ PROVIDER_TEMPLATES = {
         "api_key": "",
         "model": "grok-3-beta",
         "temperature": 0.7,
+        "max_context_tokens": DEFAULT_MAX_CONTEXT_TOKENS,
+        "fallback_provider": None,
+        "hedge": False,
+        "image_max_edge": DEFAULT_IMAGE_MAX_EDGE,
         "system_prompt": "你是一个有用的助手。",
         "request_format": "openai",  # 使用 OpenAI 兼容模式
         "supports_image": True
@@ -75,6 +173,11 @@ PROVIDER_TEMPLATES = {
         "api_key": "",
         "model": "claude-3-7-sonnet-latest",
         "temperature": 0.7,
+        "max_context_tokens": DEFAULT_MAX_CONTEXT_TOKENS,
+        "fallback_provider": None,
+        "hedge": False,
+        "image_max_edge": DEFAULT_IMAGE_MAX_EDGE,
+        "prompt_caching": True,
         "system_prompt": "你是一个有用的助手。",
         "request_format": "anthropic",
         "supports_image": True
@@ -85,6 +188,10 @@ PROVIDER_TEMPLATES = {
         "api_key": "",
         "model": "",
         "temperature": 0.7,
+        "max_context_tokens": DEFAULT_MAX_CONTEXT_TOKENS,
+        "fallback_provider": None,
+        "hedge": False,
+        "image_max_edge": DEFAULT_IMAGE_MAX_EDGE,
         "system_prompt": "你是一个有用的助手。",
         "request_format": "openai",
         "supports_image": True
@@ -93,9 +200,10 @@ PROVIDER_TEMPLATES = {
 
 # 模块状态
 _state = {
+    "config_file": SharedJsonFile(CONFIG_FILE),  # 配置文件（分片之间合并写入）
     "providers": {},  # 服务商配置
     "whitelist": {},  # 白名单用户 ID -> 用户信息
-    "conversations": {},  # 用户对话上下文
+    "conversations": None,  # 用户对话记录（ConversationStore，运行时初始化）
     "default_provider": None,  # 默认服务商
     "usage_stats": {  # 使用统计
         "total_requests": 0,
@@ -103,11 +211,866 @@ _state = {
         "requests_by_user": {}
     },
     "conversation_timeout": 24 * 60 * 60,  # 默认 24 小时超时
-    "concurrent_requests": 0,  # 当前并发请求数
-    "request_lock": None  # 请求锁（运行时初始化）
+    "compaction": dict(DEFAULT_COMPACTION),  # 对话压缩设置
+    "compaction_times": {},  # 用户 ID -> 上次压缩时间
+    "compacting": set(),  # 正在压缩对话的用户 ID
+    "response_cache": dict(DEFAULT_RESPONSE_CACHE),  # 响应缓存设置
+    "cache": None,  # 响应缓存（ResponseCache，运行时初始化）
+    "metrics": None,  # 延迟和 token 用量统计（UsageMetrics，运行时初始化）
+    "image_cache": OrderedDict(),  # (file_unique_id, 最长边) -> 处理后的图像，从旧到新排序
+    "image_cache_bytes": 0,  # 缓存的图像数据总大小
+    "wide_char_counts": OrderedDict(),  # (长度, 哈希) -> 非 ASCII 字符数量，从旧到新排序
+    "scheduler": None,  # 请求调度器（RequestScheduler，运行时初始化）
+    "provider_health": {}  # 服务商 ID -> ProviderHealth（运行时统计，不保存）
 }
 
 
+class AIRequestError(Exception):
+    """AI API 请求失败（异常信息即显示给用户的错误文本）"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        """初始化异常
+
+        Args:
+            message: 错误文本
+            retryable: 换一个服务商重试是否可能成功
+        """
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ProviderHealth:
+    """服务商健康状态
+
+    记录最近请求的结果、总耗时和首字延迟；连续失败达到阈值后熔断，
+    熔断期间直接跳过该服务商，到期后放行一个试探请求，成功则恢复
+    """
+
+    def __init__(self, provider_id: str):
+        """初始化健康状态
+
+        Args:
+            provider_id: 服务商 ID
+        """
+        self.provider_id = provider_id
+        self.samples = deque(maxlen=HEALTH_WINDOW)  # [(是否成功, 总耗时, 首字延迟)]
+        self.failures = 0  # 连续失败次数
+        self.open_until = 0.0
+        self.trial = False  # 是否有试探请求正在进行
+        self.opened = 0  # 熔断次数
+
+    @property
+    def state(self) -> str:
+        """熔断状态: closed、open 或 half_open"""
+        if self.failures < CIRCUIT_FAILURE_THRESHOLD:
+            return "closed"
+        if time.monotonic() < self.open_until:
+            return "open"
+        return "half_open"
+
+    def allow_request(self) -> bool:
+        """判断是否可以向该服务商发送请求，熔断到期后只放行一个试探请求
+
+        Returns:
+            bool: 是否可以发送
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.trial:
+            return False
+        self.trial = True
+        return True
+
+    def record_success(self, latency: float,
+                       ttft: Optional[float] = None) -> None:
+        """记录成功的请求
+
+        Args:
+            latency: 总耗时（秒）
+            ttft: 首字延迟（秒），非流式请求为 None
+        """
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            _interface.logger.info(f"服务商 {self.provider_id} 已恢复")
+        self.samples.append((True, latency, ttft))
+        self.failures = 0
+        self.trial = False
+
+    def record_failure(self, latency: float) -> None:
+        """记录失败的请求，连续失败达到阈值时熔断
+
+        Args:
+            latency: 总耗时（秒）
+        """
+        self.samples.append((False, latency, None))
+        self.failures += 1
+        self.trial = False
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.open_until = time.monotonic() + CIRCUIT_OPEN_SECONDS
+            self.opened += 1
+            _interface.logger.warning(
+                f"服务商 {self.provider_id} 连续失败 {self.failures} 次，"
+                f"暂停使用 {CIRCUIT_OPEN_SECONDS} 秒")
+
+    def ttft_p95(self) -> Optional[float]:
+        """获取首字延迟的 P95
+
+        Returns:
+            Optional[float]: 秒数，样本不足时返回 None
+        """
+        values = sorted(ttft for _, _, ttft in self.samples if ttft is not None)
+        if len(values) < HEDGE_MIN_SAMPLES:
+            return None
+        return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取健康统计信息
+
+        Returns:
+            Dict: 统计信息
+        """
+        latencies = sorted(latency for ok, latency, _ in self.samples if ok)
+        errors = sum(1 for ok, _, _ in self.samples if not ok)
+        return {
+            "state": self.state,
+            "requests": len(self.samples),
+            "error_rate": errors / len(self.samples) if self.samples else 0.0,
+            "latency_p95": latencies[int(len(latencies) * 0.95)]
+            if latencies else None,
+            "ttft_p95": self.ttft_p95(),
+            "opened": self.opened
+        }
+
+
+class RequestScheduler:
+    """公平的请求调度器
+
+    限制同时进行的请求总数和每个用户的请求数，超过时排队而不是拒绝；
+    排队的请求按用户轮流分配，一个用户连续发送的大量请求不会占满所有名额；
+    没有用户 ID 的请求（如测试服务商）只受总数限制
+    """
+
+    def __init__(self,
+                 max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+                 max_per_user: int = MAX_USER_REQUESTS,
+                 max_queued: int = MAX_QUEUED_REQUESTS):
+        """初始化调度器
+
+        Args:
+            max_concurrent: 同时进行的请求总数上限
+            max_per_user: 每个用户同时进行的请求数上限
+            max_queued: 排队等待的请求数上限
+        """
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+
+        self.running = 0
+        self.active = {}  # 用户 ID -> 进行中的请求数
+        self.queues = OrderedDict()  # 用户 ID -> 等待的 Future，按轮转顺序排列
+        self.queued = 0
+
+        self.stats = {"granted": 0, "queued": 0, "rejected": 0, "wait_max": 0.0}
+        self._waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+
+    @staticmethod
+    def _key(user_id: Union[int, str, None]) -> Optional[str]:
+        return None if user_id is None else str(user_id)
+
+    def _can_run(self, user_id: Optional[str]) -> bool:
+        return user_id is None or \
+            self.active.get(user_id, 0) < self.max_per_user
+
+    def _grant(self, user_id: str) -> None:
+        self.running += 1
+        self.active[user_id] = self.active.get(user_id, 0) + 1
+        self.stats["granted"] += 1
+
+    def _dispatch(self) -> None:
+        """按轮转顺序把空闲名额分配给排队的用户"""
+        while self.running < self.max_concurrent and self.queues:
+            for user_id in self.queues:
+                if self._can_run(user_id):
+                    break
+            else:
+                return
+
+            queue = self.queues[user_id]
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                # 该用户的后续请求排到所有用户之后
+                self.queues.move_to_end(user_id)
+            else:
+                del self.queues[user_id]
+
+            self._grant(user_id)
+            future.set_result(None)
+
+    def get_position(self, user_id: str, future: asyncio.Future) -> int:
+        """估算请求前面还有多少个排队的请求
+
+        Args:
+            user_id: 用户 ID
+            future: 请求的 Future
+
+        Returns:
+            int: 前面的请求数量
+        """
+        index = self.queues[user_id].index(future)
+        position = index  # 同一用户更早的请求
+        passed = False
+        for other, queue in self.queues.items():
+            if other == user_id:
+                passed = True
+                continue
+            # 每一轮每个用户分配一次，轮转顺序在该用户之后的用户本轮排在后面
+            position += min(len(queue), index if passed else index + 1)
+        return position
+
+    async def acquire(self,
+                      user_id: Union[int, str, None],
+                      position_callback: Optional[Callable[[int], Any]] = None
+                      ) -> None:
+        """获取请求名额，没有空闲名额时排队等待
+
+        Args:
+            user_id: 用户 ID，为 None 时不受每个用户的数量限制
+            position_callback: 排队时的异步回调 (前面的请求数量) -> None，位置变化时再次调用
+
+        Raises:
+            AIRequestError: 排队的请求过多
+        """
+        user_id = self._key(user_id)
+        if not self.queues and self.running < self.max_concurrent and \
+                self._can_run(user_id):
+            self._grant(user_id)
+            self._waits.append(0.0)
+            return
+
+        if self.queued >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise AIRequestError("⚠️ 系统正在处理过多请求，请稍后再试")
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        started = time.monotonic()
+        self._dispatch()
+        if not future.done():
+            self.stats["queued"] += 1
+
+        last_position = None
+        try:
+            while not future.done():
+                position = self.get_position(user_id, future)
+                if position_callback and position != last_position:
+                    last_position = position
+                    try:
+                        await position_callback(position)
+                    except Exception as e:
+                        _interface.logger.debug(f"更新排队位置失败: {e}")
+                if not future.done():
+                    await asyncio.wait([future], timeout=QUEUE_UPDATE_INTERVAL)
+        except asyncio.CancelledError:
+            if future.done():
+                # 已分配名额但调用方已取消，归还名额
+                self.release(user_id)
+            else:
+                future.cancel()
+                queue = self.queues.get(user_id)
+                queue.remove(future)
+                self.queued -= 1
+                if not queue:
+                    del self.queues[user_id]
+            raise
+
+        wait = time.monotonic() - started
+        self._waits.append(wait)
+        self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+
+    def release(self, user_id: Union[int, str, None]) -> None:
+        """归还请求名额
+
+        Args:
+            user_id: 用户 ID
+        """
+        user_id = self._key(user_id)
+        self.running -= 1
+        self.active[user_id] -= 1
+        if not self.active[user_id]:
+            del self.active[user_id]
+        self._dispatch()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计信息
+
+        Returns:
+            Dict: 统计信息
+        """
+        waits = sorted(self._waits)
+        stats = dict(self.stats)
+        stats.update({
+            "running": self.running,
+            "waiting": self.queued,
+            "waiting_users": len(self.queues),
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0
+        })
+        return stats
+
+
+def shard_file_path(path: str, shard_id: int) -> str:
+    """分片自己写入的文件路径：主分片使用原文件名，其他分片加上分片编号
+
+    Args:
+        path: 文件路径（如 data/ai/usage_metrics.json）
+        shard_id: 分片编号
+
+    Returns:
+        str: 文件路径（如 data/ai/usage_metrics.1.json）
+    """
+    if not shard_id:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{shard_id}{ext}"
+
+
+def shard_file_paths(path: str) -> List[str]:
+    """列出所有分片写入的文件（包括分片数量减少后不再写入的文件）
+
+    Args:
+        path: 主分片的文件路径
+
+    Returns:
+        List[str]: 存在的文件路径
+    """
+    paths = [path] if os.path.exists(path) else []
+    directory = os.path.dirname(path) or "."
+    root, ext = os.path.splitext(os.path.basename(path))
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return paths
+    for name in names:
+        if name.startswith(f"{root}.") and name.endswith(ext) and \
+                name[len(root) + 1:len(name) - len(ext)].isdigit():
+            paths.append(os.path.join(directory, name))
+    return paths
+
+
+class ResponseCache:
+    """AI 回复缓存
+
+    以服务商、模型、规范化后的消息和图像的哈希为键缓存回复，按有效期和 LRU
+    限制数量与总大小；相同的请求同时到达时只向服务商发送一次（single-flight）
+
+    分片模式下每个分片只写入自己的缓存文件，启动时加载所有分片的缓存
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_FILE, shard_id: int = 0):
+        """初始化缓存
+
+        Args:
+            path: 缓存文件路径
+            shard_id: 分片编号
+        """
+        self.shared_path = path
+        self.path = shard_file_path(path, shard_id)
+        self.entries = OrderedDict()  # 键 -> (过期时间, 回复)，从旧到新排序
+        self.size = 0  # 缓存回复的总字节数
+        self.inflight = {}  # 键 -> 正在进行的请求的 Future
+        self.modified = False
+        self._save_lock = asyncio.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "bypassed": 0}
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return _state["response_cache"]
+
+    def make_key(self, provider_id: str, messages: List[Dict[str, str]],
+                 images: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+        """计算请求的缓存键
+
+        Args:
+            provider_id: 服务商 ID
+            messages: 消息列表
+            images: 图像列表
+
+        Returns:
+            Optional[str]: 缓存键，请求带有对话上下文且未开启 include_context 时返回 None
+        """
+        if not self.settings.get("include_context"):
+            history = [msg for msg in messages if msg["role"] != "system"]
+            has_summary = any(msg["content"].startswith(SUMMARY_PREFIX)
+                              for msg in messages if msg["role"] == "system")
+            if len(history) > 1 or has_summary:
+                self.stats["bypassed"] += 1
+                return None
+
+        provider = _state["providers"].get(provider_id, {})
+        payload = [
+            provider_id,
+            provider.get("model"),
+            [[msg["role"], " ".join(msg["content"].split())]
+             for msg in messages],
+            [
+                img.get("sha256") or
+                hashlib.sha256(img["data"].encode()).hexdigest()
+                for img in images or []
+            ]
+        ]
+        return hashlib.sha256(
+            json.dumps(payload, ensure_ascii=False).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """获取缓存的回复
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[str]: 回复，不存在或已过期时返回 None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, key: str, response: str) -> None:
+        """缓存回复，超过数量或大小上限时淘汰最久未使用的回复
+
+        Args:
+            key: 缓存键
+            response: 回复
+        """
+        if key in self.entries:
+            self._remove(key)
+        size = len(response.encode())
+        if size > self.settings.get("max_bytes", 0):
+            return
+        self.entries[key] = (time.time() + self.settings.get("ttl", 3600),
+                             response)
+        self.size += size
+        self.modified = True
+        self._evict()
+
+    def _evict(self) -> None:
+        """淘汰最久未使用的回复，直到不超过数量和大小上限"""
+        while self.entries and (
+                len(self.entries) > self.settings.get("max_entries", 0) or
+                self.size > self.settings.get("max_bytes", 0)):
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str) -> None:
+        _, response = self.entries.pop(key)
+        self.size -= len(response.encode())
+        self.modified = True
+
+    def purge_expired(self) -> int:
+        """清除过期的回复
+
+        Returns:
+            int: 清除的数量
+        """
+        now = time.time()
+        expired = [key for key, (expires, _) in self.entries.items()
+                   if expires < now]
+        for key in expired:
+            self._remove(key)
+        return len(expired)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        if self.entries:
+            self.modified = True
+        self.entries.clear()
+        self.size = 0
+
+    def load(self) -> int:
+        """从本分片和其他分片的缓存文件加载未过期的回复
+
+        Returns:
+            int: 加载的数量
+        """
+        paths = shard_file_paths(self.shared_path)
+        if self.path in paths:
+            # 本分片的文件最后加载，作为最近使用的回复
+            paths.remove(self.path)
+            paths.append(self.path)
+
+        now = time.time()
+        loaded = {}
+        for path in paths:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            except Exception as e:
+                _interface.logger.error(f"读取响应缓存 {path} 失败: {e}")
+                continue
+            for key, expires, response in records:
+                if expires >= now:
+                    loaded.pop(key, None)
+                    loaded[key] = (expires, response)
+
+        for key, entry in loaded.items():
+            self.entries[key] = entry
+            self.size += len(entry[1].encode())
+        self._evict()
+        self.modified = False
+        return len(self.entries)
+
+    def _snapshot(self) -> Optional[List[List[Any]]]:
+        """获取需要保存的记录，没有变化时返回 None"""
+        if not self.modified:
+            return None
+        self.modified = False
+        return [[key, expires, response]
+                for key, (expires, response) in self.entries.items()]
+
+    def _write(self, records: List[List[Any]]) -> None:
+        try:
+            if records:
+                atomic_write_json(self.path, records, ensure_ascii=False,
+                                  separators=(",", ":"))
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+        except Exception as e:
+            _interface.logger.error(f"保存响应缓存失败: {e}")
+
+    async def save(self) -> None:
+        """保存缓存（文件写入在线程中执行，多次保存依次进行）"""
+        async with self._save_lock:
+            records = self._snapshot()
+            if records is not None:
+                await asyncio.to_thread(self._write, records)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息
+
+        Returns:
+            Dict: 统计信息
+        """
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["coalesced"] + stats["misses"]
+        stats.update({
+            "entries": len(self.entries),
+            "size": self.size,
+            "hit_rate": (stats["hits"] + stats["coalesced"]) / lookups
+            if lookups else 0.0
+        })
+        return stats
+
+
+def histogram_quantile(counts: List[int], bounds: Tuple[float, ...],
+                       q: float) -> Optional[float]:
+    """根据直方图估算分位数（在所在区间内线性插值）
+
+    Args:
+        counts: 各区间的样本数量，最后一个区间没有上界
+        bounds: 各区间的上界
+        q: 分位数 (0-1)
+
+    Returns:
+        Optional[float]: 分位数的估计值，超过最大上界时返回最大上界，没有样本时返回 None
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if index == len(bounds):
+                break
+            lower = bounds[index - 1] if index else 0.0
+            return lower + (bounds[index] - lower) * (rank - seen) / count
+        seen += count
+    return float(bounds[-1])
+
+
+class UsageMetrics:
+    """延迟和 token 用量统计
+
+    按小时分桶，每个桶按 "服务商/模型" 记录请求数、错误数、token 数量，以及首字延迟、
+    总耗时和生成速度的直方图；只保留最近 METRICS_RETENTION 内的桶，
+    和请求计数（usage_stats）一起保存在单独的文件中，不再随配置文件一起写入
+
+    分片模式下每个分片只写入自己的统计文件，显示统计时读取其他分片的文件并汇总
+    """
+
+    def __init__(self, path: str = USAGE_METRICS_FILE, shard_id: int = 0):
+        """初始化统计
+
+        Args:
+            path: 统计文件路径
+            shard_id: 分片编号
+        """
+        self.shared_path = path
+        self.path = shard_file_path(path, shard_id)
+        self.shard_id = shard_id
+        self.buckets = {}  # (桶开始时间, "服务商/模型") -> 记录
+        self.modified = False
+        self._save_lock = asyncio.Lock()
+
+    @staticmethod
+    def _new_record() -> Dict[str, Any]:
+        return {
+            "n": 0,  # 成功的请求数
+            "e": 0,  # 失败的请求数
+            "in": 0,  # 输入 token（不含缓存部分）
+            "out": 0,  # 输出 token
+            "cr": 0,  # 缓存读取的 token
+            "cw": 0,  # 缓存写入的 token
+            "ttft": [0] * (len(LATENCY_BOUNDS) + 1),
+            "dur": [0] * (len(LATENCY_BOUNDS) + 1),
+            "tps": [0] * (len(TPS_BOUNDS) + 1)
+        }
+
+    def _get_record(self, provider_id: str,
+                    model: Optional[str]) -> Dict[str, Any]:
+        """获取当前时间桶中服务商和模型的记录"""
+        start = int(time.time() // METRICS_BUCKET_SECONDS *
+                    METRICS_BUCKET_SECONDS)
+        key = (start, f"{provider_id}/{model or '-'}")
+        record = self.buckets.get(key)
+        if record is None:
+            record = self.buckets[key] = self._new_record()
+        self.modified = True
+        return record
+
+    def record(self,
+               provider_id: str,
+               model: Optional[str],
+               duration: float,
+               ttft: Optional[float] = None,
+               usage: Optional[Dict[str, int]] = None,
+               output_text: Optional[str] = None,
+               request_format: str = "openai") -> None:
+        """记录一次成功的请求
+
+        Args:
+            provider_id: 服务商 ID
+            model: 模型名称
+            duration: 总耗时（秒）
+            ttft: 首字延迟（秒），非流式请求为 None
+            usage: normalize_usage 返回的用量
+            output_text: 回复文本，服务商没有返回用量时用于估算生成速度
+            request_format: 请求格式，用于估算 token 数量
+        """
+        record = self._get_record(provider_id, model)
+        record["n"] += 1
+        record["dur"][bisect.bisect_left(LATENCY_BOUNDS, duration)] += 1
+        if ttft is not None:
+            record["ttft"][bisect.bisect_left(LATENCY_BOUNDS, ttft)] += 1
+
+        output_tokens = 0
+        if usage:
+            record["in"] += usage.get("input_tokens", 0)
+            record["out"] += usage.get("output_tokens", 0)
+            record["cr"] += usage.get("cache_read_tokens", 0)
+            record["cw"] += usage.get("cache_write_tokens", 0)
+            output_tokens = usage.get("output_tokens", 0)
+        elif output_text:
+            output_tokens = estimate_tokens(output_text, request_format)
+
+        # 生成速度按首字之后的时间计算，不包含排队和处理输入的时间
+        generation = duration - (ttft or 0)
+        if output_tokens and generation > 0:
+            record["tps"][bisect.bisect_left(TPS_BOUNDS,
+                                             output_tokens / generation)] += 1
+
+    def record_error(self, provider_id: str, model: Optional[str]) -> None:
+        """记录一次失败的请求
+
+        Args:
+            provider_id: 服务商 ID
+            model: 模型名称
+        """
+        self._get_record(provider_id, model)["e"] += 1
+
+    def purge_expired(self) -> int:
+        """清除超过保留时长的时间桶
+
+        Returns:
+            int: 清除的记录数量
+        """
+        cutoff = time.time() - METRICS_RETENTION
+        expired = [key for key in self.buckets if key[0] < cutoff]
+        for key in expired:
+            del self.buckets[key]
+        if expired:
+            self.modified = True
+        return len(expired)
+
+    def summarize(self, window: int = METRICS_WINDOW) -> Dict[str, Dict[str, Any]]:
+        """汇总最近一段时间内各服务商和模型的统计
+
+        Args:
+            window: 时间范围（秒）
+
+        Returns:
+            Dict: "服务商/模型" -> {"requests", "errors", "input_tokens", "output_tokens",
+                "cache_read_tokens", "cache_write_tokens", "ttft_p50", "ttft_p95",
+                "duration_p50", "duration_p95", "tps_p50"}
+        """
+        cutoff = time.time() - window
+        buckets = [(start, key, record)
+                   for (start, key), record in self.buckets.items()]
+        for data in self._read_others():
+            if data.get("bounds") == [list(LATENCY_BOUNDS), list(TPS_BOUNDS)]:
+                buckets.extend(data.get("buckets", []))
+
+        merged = {}
+        for start, key, record in buckets:
+            if start + METRICS_BUCKET_SECONDS <= cutoff:
+                continue
+            total = merged.get(key)
+            if total is None:
+                total = merged[key] = self._new_record()
+            for field, value in record.items():
+                if isinstance(value, list):
+                    total[field] = [a + b for a, b in zip(total[field], value)]
+                else:
+                    total[field] += value
+
+        return {
+            key: {
+                "requests": total["n"],
+                "errors": total["e"],
+                "input_tokens": total["in"],
+                "output_tokens": total["out"],
+                "cache_read_tokens": total["cr"],
+                "cache_write_tokens": total["cw"],
+                "ttft_p50": histogram_quantile(total["ttft"], LATENCY_BOUNDS,
+                                               0.5),
+                "ttft_p95": histogram_quantile(total["ttft"], LATENCY_BOUNDS,
+                                               0.95),
+                "duration_p50": histogram_quantile(total["dur"],
+                                                   LATENCY_BOUNDS, 0.5),
+                "duration_p95": histogram_quantile(total["dur"],
+                                                   LATENCY_BOUNDS, 0.95),
+                "tps_p50": histogram_quantile(total["tps"], TPS_BOUNDS, 0.5)
+            }
+            for key, total in merged.items()
+        }
+
+    def total_usage_stats(self) -> Dict[str, Any]:
+        """汇总所有分片的请求计数（本分片使用内存中的最新计数）
+
+        Returns:
+            Dict: 与 usage_stats 结构相同的请求计数
+        """
+        total = json.loads(json.dumps(_state["usage_stats"]))
+        for data in self._read_others():
+            stats = data.get("usage_stats") or {}
+            total["total_requests"] = total.get("total_requests", 0) + \
+                stats.get("total_requests", 0)
+            for field in ("requests_by_provider", "requests_by_user"):
+                counts = total.setdefault(field, {})
+                for key, count in stats.get(field, {}).items():
+                    counts[key] = counts.get(key, 0) + count
+        return total
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            _interface.logger.error(f"读取用量统计 {path} 失败: {e}")
+            return None
+
+    def _read_others(self) -> List[Dict[str, Any]]:
+        """读取其他分片的统计文件"""
+        others = []
+        for path in shard_file_paths(self.shared_path):
+            if path != self.path:
+                data = self._read(path)
+                if data is not None:
+                    others.append(data)
+        return others
+
+    def load(self) -> int:
+        """从文件加载请求计数和未过期的时间桶
+
+        Returns:
+            int: 加载的记录数量
+        """
+        if not os.path.exists(self.path):
+            # 旧版本的请求计数保存在配置文件中，下次保存时写入统计文件；
+            # 只由主分片迁移，避免各分片重复计算
+            if self.shard_id:
+                _state["usage_stats"] = {
+                    "total_requests": 0,
+                    "requests_by_provider": {},
+                    "requests_by_user": {}
+                }
+            self.modified = True
+            return 0
+        data = self._read(self.path)
+        if data is None:
+            return 0
+
+        if data.get("usage_stats"):
+            _state["usage_stats"] = data["usage_stats"]
+
+        # 直方图的区间改变后旧数据无法合并，丢弃
+        if data.get("bounds") != [list(LATENCY_BOUNDS), list(TPS_BOUNDS)]:
+            return 0
+
+        cutoff = time.time() - METRICS_RETENTION
+        for start, key, record in data.get("buckets", []):
+            if start >= cutoff:
+                self.buckets[(start, key)] = record
+        self.modified = False
+        return len(self.buckets)
+
+    def _snapshot(self) -> Optional[Dict[str, Any]]:
+        """获取需要保存的数据，没有变化时返回 None"""
+        if not self.modified:
+            return None
+        self.modified = False
+        return {
+            "usage_stats": json.loads(json.dumps(_state["usage_stats"])),
+            "bounds": [list(LATENCY_BOUNDS), list(TPS_BOUNDS)],
+            "buckets": [[start, key, json.loads(json.dumps(record))]
+                        for (start, key), record in self.buckets.items()]
+        }
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        try:
+            atomic_write_json(self.path, data, ensure_ascii=False,
+                              separators=(",", ":"))
+        except Exception as e:
+            _interface.logger.error(f"保存用量统计失败: {e}")
+
+    async def save(self) -> None:
+        """保存统计（文件写入在线程中执行，多次保存依次进行）"""
+        async with self._save_lock:
+            data = self._snapshot()
+            if data is not None:
+                await asyncio.to_thread(self._write, data)
+
+
+def supports_prompt_caching(provider: Dict[str, Any]) -> bool:
+    """服务商是否可以设置提示缓存
+
+    只有 Anthropic 格式需要在请求中标记缓存断点；OpenAI 格式的服务商自动缓存相同前缀，没有开关
+
+    Args:
+        provider: 服务商配置
+
+    Returns:
+        bool: 是否为 Anthropic 格式
+    """
+    return provider.get("request_format", "openai") == "anthropic"
+
+
 class AIServiceProvider:
     """AI 服务提供商抽象基类"""
 
@@ -159,6 +1122,40 @@ class AIServiceProvider:
         else:
             raise ValueError(f"不支持的响应格式: {request_format}")
 
+    @staticmethod
+    def normalize_usage(provider: Dict[str, Any],
+                        usage: Optional[Dict[str, Any]]) -> Optional[Dict[str, int]]:
+        """把响应中的用量转换为统一格式
+
+        Args:
+            provider: 服务商配置
+            usage: 响应中的 usage 字段
+
+        Returns:
+            Optional[Dict]: {"input_tokens", "output_tokens", "cache_read_tokens",
+                "cache_write_tokens"}，其中 input_tokens 不含缓存部分；没有用量时返回 None
+        """
+        if not usage:
+            return None
+
+        if provider.get("request_format", "openai") == "anthropic":
+            return {
+                "input_tokens": usage.get("input_tokens") or 0,
+                "output_tokens": usage.get("output_tokens") or 0,
+                "cache_read_tokens": usage.get("cache_read_input_tokens") or 0,
+                "cache_write_tokens":
+                usage.get("cache_creation_input_tokens") or 0
+            }
+
+        cached = (usage.get("prompt_tokens_details") or {}).get(
+            "cached_tokens") or 0
+        return {
+            "input_tokens": (usage.get("prompt_tokens") or 0) - cached,
+            "output_tokens": usage.get("completion_tokens") or 0,
+            "cache_read_tokens": cached,
+            "cache_write_tokens": 0
+        }
+
     @staticmethod
     async def prepare_api_request(
             provider: Dict[str, Any],
@@ -215,7 +1212,7 @@ class OpenAIProvider:
                         content.append({
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{img['data']}",
+                                "url": f"data:{img.get('mime_type', 'image/jpeg')};base64,{img['data']}",
                                 "detail": "high"
                             }
                         })
@@ -228,7 +1225,7 @@ class OpenAIProvider:
                     # 保持其他消息不变
                     vision_messages.append(msg)
 
-            return {
+            request = {
                 "model": provider["model"],
                 "messages": vision_messages,
                 "temperature": provider["temperature"],
@@ -237,7 +1234,7 @@ class OpenAIProvider:
             }
         else:
             # 标准文本请求
-            return {
+            request = {
                 "model": provider["model"],
                 "messages": messages,
                 "temperature": provider["temperature"],
@@ -245,6 +1242,19 @@ class OpenAIProvider:
                 "max_tokens": 4096
             }
 
+        # 让流式响应在最后返回用量，用于统计 token 数量和缓存命中
+        # （OpenAI 自动缓存相同的前缀，系统提示在前，历史消息只在末尾增长）；
+        # 兼容服务不一定支持 stream_options，默认只对 OpenAI 官方接口开启，
+        # 其他服务可以把 stream_usage 设为 true
+        stream_usage = provider.get("stream_usage")
+        if stream_usage is None:
+            stream_usage = urlparse(provider.get("api_url",
+                                                 "")).hostname == "api.openai.com"
+        if stream and stream_usage:
+            request["stream_options"] = {"include_usage": True}
+
+        return request
+
     @staticmethod
     def parse_response(response_data: Dict[str, Any]) -> str:
         """解析 OpenAI 响应"""
@@ -255,9 +1265,11 @@ class OpenAIProvider:
             return None
 
     @staticmethod
-    async def process_stream(line: bytes, callback: Callable[[str], None],
-                             full_response: str) -> str:
-        """处理 OpenAI 流式响应"""
+    async def process_stream(line: bytes,
+                             callback: Callable[[str], None],
+                             full_response: str,
+                             usage: Optional[Dict[str, Any]] = None) -> str:
+        """处理 OpenAI 流式响应（最后一段的用量写入 usage）"""
         if not line or line == b'data: [DONE]':
             return full_response
 
@@ -266,6 +1278,9 @@ class OpenAIProvider:
             if line.startswith(b'data: '):
                 json_data = json.loads(line[6:])
 
+                if usage is not None and json_data.get('usage'):
+                    usage.update(json_data['usage'])
+
                 if 'choices' in json_data and json_data['choices']:
                     delta = json_data['choices'][0].get('delta', {})
                     if 'content' in delta and delta['content']:
@@ -290,12 +1305,9 @@ class AnthropicProvider:
                        images: Optional[List[Dict[str, Any]]] = None,
                        stream: bool = False) -> Dict[str, Any]:
         """格式化 Anthropic 请求"""
-        # 提取系统提示
-        system = ""
-        for msg in messages:
-            if msg["role"] == "system":
-                system = msg["content"]
-                break
+        # 提取系统提示（系统提示和对话摘要合并为一条）
+        system = "\n\n".join(msg["content"] for msg in messages
+                             if msg["role"] == "system")
 
         # 构建消息列表
         anthropic_messages = []
@@ -313,7 +1325,7 @@ class AnthropicProvider:
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": "image/jpeg",
+                                "media_type": img.get("mime_type", "image/jpeg"),
                                 "data": img["data"]
                             }
                         })
@@ -347,6 +1359,20 @@ class AnthropicProvider:
         if system:
             request["system"] = system
 
+        # 提示缓存：在系统提示和最后一条消息上设置断点，下一轮请求的相同前缀直接读取缓存
+        if provider.get("prompt_caching"):
+            if system:
+                request["system"] = [{
+                    "type": "text",
+                    "text": system,
+                    "cache_control": CACHE_CONTROL
+                }]
+            if anthropic_messages:
+                last = anthropic_messages[-1]
+                if isinstance(last["content"], str):
+                    last["content"] = [{"type": "text", "text": last["content"]}]
+                last["content"][-1]["cache_control"] = CACHE_CONTROL
+
         return request
 
     @staticmethod
@@ -365,9 +1391,11 @@ class AnthropicProvider:
             return None
 
     @staticmethod
-    async def process_stream(line: bytes, callback: Callable[[str], None],
-                             full_response: str) -> str:
-        """处理 Anthropic 流式响应"""
+    async def process_stream(line: bytes,
+                             callback: Callable[[str], None],
+                             full_response: str,
+                             usage: Optional[Dict[str, Any]] = None) -> str:
+        """处理 Anthropic 流式响应（message_start 和 message_delta 中的用量写入 usage）"""
         if not line or line == b'data: [DONE]':
             return full_response
 
@@ -376,6 +1404,18 @@ class AnthropicProvider:
             if line.startswith(b'data: '):
                 json_data = json.loads(line[6:])
 
+                if usage is not None:
+                    if json_data.get('type') == 'message_start':
+                        usage.update(
+                            json_data.get('message', {}).get('usage') or {})
+                    elif json_data.get('type') == 'message_delta':
+                        usage.update({
+                            key: value
+                            for key, value in (json_data.get('usage')
+                                               or {}).items()
+                            if value is not None
+                        })
+
                 if 'type' in json_data and json_data[
                         'type'] == 'content_block_delta':
                     delta = json_data.get('delta', {})
@@ -392,31 +1432,401 @@ class AnthropicProvider:
         return full_response
 
 
+class ConversationStore:
+    """按用户保存的对话记录
+
+    每个用户的对话保存在单独的文件中，只在该用户的对话变化时重写这一个文件，
+    并在 SAVE_DELAY 秒内合并多次修改；按最后活动时间排序的索引使清理过期对话
+    只需要访问已过期的用户
+
+    同一用户的私聊和群聊可能由不同的分片处理，保存时在文件锁内把本进程的修改
+    （新增和删除的消息）合并到文件中的最新记录，读取时发现文件被其他分片修改过
+    就重新加载
+    """
+
+    def __init__(self, storage_dir: str = CONVERSATIONS_DIR):
+        """初始化对话记录
+
+        Args:
+            storage_dir: 对话文件目录
+        """
+        self.storage_dir = storage_dir
+        self.conversations = {}  # 用户 ID -> [[角色, 内容, 时间戳]]（按需从文件加载）
+        self.last_activity = OrderedDict()  # 用户 ID -> 最后活动时间，从早到晚排序
+        self.dirty = set()  # 尚未保存的用户 ID
+        self.synced = {}  # 用户 ID -> (文件版本, 消息键集合)，上次读取或写入时的记录
+        self._saving = set()  # 正在写入文件的用户 ID
+        self._save_handle = None
+        self._save_lock = asyncio.Lock()
+
+    def _get_path(self, user_id: str) -> str:
+        return os.path.join(self.storage_dir, f"{user_id}.json")
+
+    @staticmethod
+    def _file_version(path: str) -> Optional[Tuple[int, int, int]]:
+        """文件版本（不存在时为 None），用于判断文件是否被其他分片修改过"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _message_key(msg: List[Any]) -> Tuple:
+        return msg[0], msg[2], msg[1]
+
+    def load_index(self) -> int:
+        """根据对话文件的修改时间建立活动索引（不读取文件内容）
+
+        Returns:
+            int: 有对话记录的用户数量
+        """
+        os.makedirs(self.storage_dir, exist_ok=True)
+        entries = []
+        with os.scandir(self.storage_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".json"):
+                    entries.append((entry.stat().st_mtime, entry.name[:-5]))
+        entries.sort()
+        self.last_activity = OrderedDict(
+            (user_id, mtime) for mtime, user_id in entries)
+        return len(entries)
+
+    def get(self, user_id: Union[int, str]) -> List[List[Any]]:
+        """获取用户的对话记录
+
+        Args:
+            user_id: 用户 ID
+
+        Returns:
+            List: 消息列表 [[角色, 内容, 时间戳]]
+        """
+        user_id = str(user_id)
+        messages = self.conversations.get(user_id)
+        if messages is None:
+            messages = self._load(user_id)
+            self.conversations[user_id] = messages
+        elif user_id not in self.dirty and user_id not in self._saving and \
+                self._file_version(self._get_path(user_id)) != \
+                self.synced.get(user_id, (None,))[0]:
+            # 其他分片修改了对话文件：重新加载，未变化的消息保留原对象
+            # （压缩和回滚按对象匹配消息）
+            current = {self._message_key(msg): msg for msg in messages}
+            messages = [
+                current.get(self._message_key(msg), msg)
+                for msg in self._load(user_id)
+            ]
+            self.conversations[user_id] = messages
+        return messages
+
+    def _load(self, user_id: str) -> List[List[Any]]:
+        """从文件读取用户的对话记录，并记录文件版本"""
+        path = self._get_path(user_id)
+        version = self._file_version(path)
+        messages = self._read(user_id)
+        self.synced[user_id] = (version,
+                                {self._message_key(msg) for msg in messages})
+        return messages
+
+    def _read(self, user_id: str) -> List[List[Any]]:
+        """读取对话文件"""
+        path = self._get_path(user_id)
+        if not os.path.exists(path):
+            return []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("messages", [])
+        except Exception as e:
+            _interface.logger.error(f"读取用户 {user_id} 的对话记录失败: {e}")
+            return []
+
+    def append(self, user_id: Union[int, str], role: str, content: str,
+               max_messages: int) -> List[List[Any]]:
+        """添加消息，超过长度时保留系统消息和最近的消息
+
+        Args:
+            user_id: 用户 ID
+            role: 消息角色
+            content: 消息内容
+            max_messages: 保留的非系统消息数量
+
+        Returns:
+            List: 更新后的消息列表
+        """
+        user_id = str(user_id)
+        now = time.time()
+        messages = self.get(user_id)
+        messages.append([ROLE_CODES[role], content, now])
+
+        if len(messages) > max_messages:
+            pinned = [msg for msg in messages if msg[0] in PINNED_ROLES]
+            history = [msg for msg in messages if msg[0] not in PINNED_ROLES]
+            messages = pinned + history[-max_messages:]
+            self.conversations[user_id] = messages
+
+        self.last_activity[user_id] = now
+        self.last_activity.move_to_end(user_id)
+        self.mark_dirty(user_id)
+        return messages
+
+    def clear(self, user_id: Union[int, str]) -> bool:
+        """清除用户的对话记录，保留系统消息
+
+        Args:
+            user_id: 用户 ID
+
+        Returns:
+            bool: 是否有对话记录
+        """
+        user_id = str(user_id)
+        if user_id not in self.conversations and \
+                user_id not in self.last_activity:
+            return False
+
+        self.conversations[user_id] = [
+            msg for msg in self.get(user_id)
+            if msg[0] == ROLE_CODES["system"]
+        ]
+        self.last_activity.pop(user_id, None)
+        self.mark_dirty(user_id)
+        return True
+
+    def replace_with_summary(self, user_id: Union[int, str],
+                             compacted: List[List[Any]], summary: str) -> bool:
+        """用摘要替换已压缩的消息，压缩期间新增的消息保持不变
+
+        Args:
+            user_id: 用户 ID
+            compacted: 被压缩的消息（包括旧摘要）
+            summary: 摘要文本
+
+        Returns:
+            bool: 是否已替换（对话在压缩期间被清除时返回 False）
+        """
+        user_id = str(user_id)
+        messages = self.conversations.get(user_id)
+        compacted_ids = {id(msg) for msg in compacted}
+        if not messages or not any(id(msg) in compacted_ids
+                                   for msg in messages):
+            return False
+
+        system_messages = [
+            msg for msg in messages if msg[0] == ROLE_CODES["system"]
+        ]
+        remaining = [
+            msg for msg in messages if msg[0] != ROLE_CODES["system"] and
+            id(msg) not in compacted_ids
+        ]
+        self.conversations[user_id] = system_messages + [[
+            ROLE_CODES["summary"], summary, compacted[-1][2]
+        ]] + remaining
+        self.mark_dirty(user_id)
+        return True
+
+    def remove_message(self, user_id: Union[int, str],
+                       message: List[Any]) -> bool:
+        """删除一条消息（按对象匹配，之后新增的消息不受影响）
+
+        Args:
+            user_id: 用户 ID
+            message: append 添加的消息
+
+        Returns:
+            bool: 是否已删除（消息已被截断或压缩时返回 False）
+        """
+        user_id = str(user_id)
+        messages = self.conversations.get(user_id) or []
+        for index, msg in enumerate(messages):
+            if msg is message:
+                del messages[index]
+                self.mark_dirty(user_id)
+                return True
+        return False
+
+    def pop_expired(self, before: float) -> List[str]:
+        """取出最后活动时间早于指定时间的用户
+
+        Args:
+            before: 时间戳
+
+        Returns:
+            List[str]: 用户 ID 列表
+        """
+        expired = []
+        while self.last_activity:
+            user_id, last_activity = next(iter(self.last_activity.items()))
+            if last_activity >= before:
+                break
+            self.last_activity.popitem(last=False)
+            expired.append(user_id)
+        return expired
+
+    def mark_dirty(self, user_id: str) -> None:
+        """标记用户的对话需要保存，并安排一次合并保存"""
+        self.dirty.add(user_id)
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(
+                SAVE_DELAY, self._schedule_save)
+
+    def _schedule_save(self) -> None:
+        # 模块卸载时 spawn 会忽略任务，剩余的修改由 cleanup 保存
+        self._save_handle = None
+        _interface.spawn(self.save(), name="save_conversations",
+                         group=AI_SAVE_GROUP)
+
+    async def save(self) -> None:
+        """保存所有有变化的对话（文件写入在线程中执行）"""
+        async with self._save_lock:
+            if not self.dirty:
+                return
+            records = {}
+            for user_id in self.dirty:
+                messages = self.conversations.get(user_id)
+                records[user_id] = list(messages) if messages else None
+            self.dirty.clear()
+            self._saving.update(records)
+            try:
+                await asyncio.to_thread(self._write_records, records)
+            finally:
+                self._saving.difference_update(records)
+
+    async def close(self) -> None:
+        """取消尚未开始的合并保存，等待进行中的保存完成后保存剩余的修改
+
+        模块卸载或重载时调用，避免线程中尚未完成的旧数据写入覆盖最新的对话
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        await self.save()
+
+    def save_now(self) -> None:
+        """立即保存所有有变化的对话（同步执行，只在没有进行中的保存时使用）"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        records = {
+            user_id: self.conversations.get(user_id) or None
+            for user_id in self.dirty
+        }
+        self.dirty.clear()
+        self._write_records(records)
+
+    def _write_records(self, records: Dict[str, Optional[List]]) -> None:
+        """写入用户对话文件，没有消息的用户删除文件
+
+        Args:
+            records: 用户 ID -> 消息列表（None 表示删除）
+        """
+        os.makedirs(self.storage_dir, exist_ok=True)
+        for user_id, messages in records.items():
+            path = self._get_path(user_id)
+            messages = messages or []
+            keys = {self._message_key(msg) for msg in messages}
+            try:
+                with file_lock(path):
+                    merged = self._merge_file(user_id, messages, keys)
+                    if merged:
+                        atomic_write_json(path, {"messages": merged},
+                                          ensure_ascii=False,
+                                          separators=(",", ":"))
+                    elif os.path.exists(path):
+                        os.remove(path)
+                    version = self._file_version(path)
+            except Exception as e:
+                _interface.logger.error(f"保存用户 {user_id} 的对话记录失败: {e}")
+                continue
+            # 合并了其他分片的消息时不记录文件版本，下次读取时重新加载
+            self.synced[user_id] = (version if merged is messages else None,
+                                    keys)
+
+    def _merge_file(self, user_id: str, messages: List[List[Any]],
+                    keys: set) -> List[List[Any]]:
+        """把本进程的修改合并到文件中的最新对话（在文件锁内调用）
+
+        Args:
+            user_id: 用户 ID
+            messages: 本进程的消息列表
+            keys: messages 的消息键集合
+
+        Returns:
+            List: 要写入的消息列表，文件没有被其他分片修改时返回 messages 本身
+        """
+        version, base = self.synced.get(user_id, (None, set()))
+        if self._file_version(self._get_path(user_id)) == version:
+            return messages
+
+        theirs = self._read(user_id)
+        their_keys = {self._message_key(msg) for msg in theirs}
+        # 去掉其他分片删除的消息，加上其他分片新增的消息
+        kept = [
+            msg for msg in messages
+            if self._message_key(msg) not in base or
+            self._message_key(msg) in their_keys
+        ]
+        added = [
+            msg for msg in theirs
+            if self._message_key(msg) not in base and
+            self._message_key(msg) not in keys
+        ]
+        if not added and len(kept) == len(messages):
+            return messages
+        merged = kept + added
+        merged.sort(key=lambda msg: (msg[0] != ROLE_CODES["system"], msg[2]))
+        return merged
+
+
+def estimate_tokens(text: str, request_format: str = "openai") -> int:
+    """快速估算文本的 token 数量
+
+    ASCII 文本按平均每个 token 的字符数估算，中文等非 ASCII 字符按每个字符的 token 数估算；
+    非 ASCII 字符的数量按文本的长度和哈希缓存，缓存不保留文本本身
+
+    Args:
+        text: 文本
+        request_format: 请求格式（不同服务商的分词方式不同）
+
+    Returns:
+        int: 估算的 token 数量
+    """
+    chars_per_token, tokens_per_wide_char = TOKEN_ESTIMATE_RATIOS.get(
+        request_format, TOKEN_ESTIMATE_RATIOS["openai"])
+    if text.isascii():
+        wide = 0
+    else:
+        counts = _state["wide_char_counts"]
+        key = (len(text), hash(text))
+        wide = counts.get(key)
+        if wide is None:
+            wide = sum(1 for char in text if ord(char) > 127)
+            counts[key] = wide
+            if len(counts) > WIDE_CHAR_CACHE_SIZE:
+                counts.popitem(last=False)
+        else:
+            counts.move_to_end(key)
+    narrow = len(text) - wide
+    return int(narrow / chars_per_token + wide * tokens_per_wide_char) + \
+        MESSAGE_TOKEN_OVERHEAD
+
+
 class ConversationManager:
     """用户对话管理"""
 
     @staticmethod
-    def get_user_context(user_id: Union[int, str]) -> List[Dict[str, Any]]:
+    def get_user_context(user_id: Union[int, str]) -> List[List[Any]]:
         """获取用户对话上下文
 
         Args:
             user_id: 用户 ID
 
         Returns:
-            List[Dict]: 用户对话上下文
+            List: 用户对话上下文 [[角色, 内容, 时间戳]]
         """
-        global _state
-        user_id_str = str(user_id)
-
-        if user_id_str not in _state["conversations"]:
-            # 初始化新用户的上下文
-            _state["conversations"][user_id_str] = []
-
-        return _state["conversations"][user_id_str]
+        return _state["conversations"].get(user_id)
 
     @staticmethod
     def add_message(user_id: Union[int, str], role: str,
-                    content: str) -> List[Dict[str, Any]]:
+                    content: str) -> List[List[Any]]:
         """添加消息到用户上下文
 
         Args:
@@ -425,229 +1835,661 @@ class ConversationManager:
             content: 消息内容
 
         Returns:
-            List[Dict]: 更新后的用户上下文
+            List: 更新后的用户上下文
         """
         global _state
         user_id_str = str(user_id)
-        context = ConversationManager.get_user_context(user_id_str)
 
-        # 添加新消息
-        context.append({
-            "role": role,
-            "content": content,
-            "timestamp": time.time()
-        })
-
-        # 限制上下文长度
-        if len(context) > MAX_CONTEXT_LENGTH * 2:  # 成对限制 (用户 + 助手)
-            # 保留系统消息 (如果有) 和最近的消息
-            system_messages = [
-                msg for msg in context if msg["role"] == "system"
-            ]
-            recent_messages = context[-MAX_CONTEXT_LENGTH * 2:]
-            context = system_messages + recent_messages
-            _state["conversations"][user_id_str] = context
+        # 添加新消息，成对限制长度 (用户 + 助手)，保存会被合并
+        context = _state["conversations"].append(user_id_str, role, content,
+                                                 MAX_CONTEXT_LENGTH * 2)
 
         # 更新用户统计
         if role == "user":
             _state["usage_stats"]["requests_by_user"][user_id_str] = \
                 _state["usage_stats"]["requests_by_user"].get(user_id_str, 0) + 1
 
-        # 保存上下文
-        save_contexts()
-
         return context
 
     @staticmethod
-    def clear_context(user_id: Union[int, str]) -> bool:
-        """清除用户对话上下文，保留系统提示
+    def remove_message(user_id: Union[int, str], message: List[Any]) -> bool:
+        """撤回已添加的消息（如请求未能开始处理时）
+
+        Args:
+            user_id: 用户 ID
+            message: add_message 返回的上下文中的最后一条消息
+
+        Returns:
+            bool: 是否已撤回
+        """
+        return _state["conversations"].remove_message(user_id, message)
+
+    @staticmethod
+    def clear_context(user_id: Union[int, str]) -> bool:
+        """清除用户对话上下文，保留系统提示
+
+        Args:
+            user_id: 用户 ID
+
+        Returns:
+            bool: 是否成功清除
+        """
+        return _state["conversations"].clear(user_id)
+
+    @staticmethod
+    def cleanup_expired() -> int:
+        """清理过期的对话
+
+        Returns:
+            int: 清理的对话数量
+        """
+        global _state
+        timeout = _state.get("conversation_timeout", 24 * 60 * 60)  # 默认 24 小时
+
+        # 如果设置为永不超时，直接返回
+        if timeout == float('inf'):
+            return 0
+
+        store = _state["conversations"]
+        expired = store.pop_expired(time.time() - timeout)
+        for user_id in expired:
+            # 清除对话（保留系统消息），并释放内存
+            system_messages = [
+                msg for msg in store.get(user_id)
+                if msg[0] == ROLE_CODES["system"]
+            ]
+            store.conversations[user_id] = system_messages
+            store.mark_dirty(user_id)
+            _state["compaction_times"].pop(user_id, None)
+            if not system_messages:
+                store.conversations.pop(user_id, None)
+
+        return len(expired)
+
+    @staticmethod
+    def format_for_api(provider_id: str,
+                       user_id: Union[int, str]) -> List[Dict[str, str]]:
+        """格式化用户上下文为 API 请求格式
+
+        Args:
+            provider_id: 服务商 ID
+            user_id: 用户 ID
+
+        Returns:
+            List[Dict]: 格式化的消息列表
+        """
+        global _state
+
+        provider_data = _state["providers"].get(provider_id)
+        if not provider_data:
+            return []
+
+        # 获取用户上下文
+        context = ConversationManager.get_user_context(user_id)
+
+        # 添加系统提示作为第一条消息 (如果不存在)
+        has_system = any(msg[0] == ROLE_CODES["system"] for msg in context)
+
+        messages = []
+        if not has_system and provider_data.get("system_prompt"):
+            messages.append({
+                "role": "system",
+                "content": provider_data["system_prompt"]
+            })
+
+        # 添加上下文消息 (去掉时间戳)，摘要作为系统消息
+        for role, content, _ in context:
+            if role == ROLE_CODES["summary"]:
+                messages.append({
+                    "role": "system",
+                    "content": SUMMARY_PREFIX + content
+                })
+            else:
+                messages.append({"role": ROLE_NAMES[role], "content": content})
+
+        return ConversationManager.trim_to_budget(
+            messages, provider_data.get("request_format", "openai"),
+            provider_data.get("max_context_tokens",
+                              DEFAULT_MAX_CONTEXT_TOKENS))
+
+    @staticmethod
+    def trim_to_budget(messages: List[Dict[str, str]], request_format: str,
+                       max_tokens: int) -> List[Dict[str, str]]:
+        """按 token 上限裁剪消息：保留系统提示和最新的消息
+
+        Args:
+            messages: 消息列表
+            request_format: 请求格式
+            max_tokens: token 上限
+
+        Returns:
+            List[Dict]: 裁剪后的消息列表
+        """
+        system_messages = [msg for msg in messages if msg["role"] == "system"]
+        history = [msg for msg in messages if msg["role"] != "system"]
+
+        budget = int(max_tokens) - sum(
+            estimate_tokens(msg["content"], request_format)
+            for msg in system_messages)
+
+        # 从最新的消息向前保留，最新一条（当前提问）始终保留
+        kept = []
+        for msg in reversed(history):
+            tokens = estimate_tokens(msg["content"], request_format)
+            if kept and tokens > budget:
+                break
+            kept.append(msg)
+            budget -= tokens
+        kept.reverse()
+
+        # 上下文需要以用户消息开始
+        while len(kept) > 1 and kept[0]["role"] != "user":
+            kept.pop(0)
+
+        if len(kept) < len(history):
+            _interface.logger.debug(
+                f"上下文超过 {max_tokens} tokens，丢弃了 {len(history) - len(kept)} 条较早的消息")
+
+        return system_messages + kept
+
+    @staticmethod
+    def maybe_compact(provider_id: str, user_id: Union[int, str]) -> bool:
+        """上下文超过阈值时在后台压缩较早的消息
+
+        Args:
+            provider_id: 用于生成摘要的服务商 ID
+            user_id: 用户 ID
+
+        Returns:
+            bool: 是否开始压缩
+        """
+        settings = _state["compaction"]
+        if not settings.get("enabled"):
+            return False
+
+        user_id = str(user_id)
+        if user_id in _state["compacting"]:
+            return False
+        last_run = _state["compaction_times"].get(user_id, 0)
+        if time.monotonic() - last_run < settings.get("cooldown", 0):
+            return False
+
+        provider = _state["providers"].get(provider_id)
+        if not provider:
+            return False
+        request_format = provider.get("request_format", "openai")
+
+        # 摘要和较早的消息一起压缩，最近的消息保持原样
+        context = ConversationManager.get_user_context(user_id)
+        history = [msg for msg in context if msg[0] != ROLE_CODES["system"]]
+        keep_recent = max(2, int(settings.get("keep_recent", 6)))
+        compacted = history[:-keep_recent]
+        if len(compacted) < 2:
+            return False
+
+        total = sum(estimate_tokens(msg[1], request_format) for msg in history)
+        if total < settings.get("threshold_tokens", 4000):
+            return False
+
+        _state["compacting"].add(user_id)
+        _state["compaction_times"][user_id] = time.monotonic()
+        task = _interface.spawn(ConversationManager._compact(
+            provider_id, user_id, compacted),
+                                name="compact_conversation",
+                                group=AI_COMPACT_GROUP)
+        if task is None:
+            _state["compacting"].discard(user_id)
+            return False
+        return True
+
+    @staticmethod
+    async def _compact(provider_id: str, user_id: str,
+                       compacted: List[List[Any]]) -> None:
+        """生成摘要并替换已压缩的消息
+
+        Args:
+            provider_id: 服务商 ID
+            user_id: 用户 ID
+            compacted: 需要压缩的消息
+        """
+        labels = {
+            ROLE_CODES["summary"]: "摘要",
+            ROLE_CODES["user"]: "用户",
+            ROLE_CODES["assistant"]: "助手"
+        }
+        transcript = "\n\n".join(f"{labels[role]}: {content}"
+                                 for role, content, _ in compacted)
+        messages = [{
+            "role": "system",
+            "content": COMPACTION_PROMPT
+        }, {
+            "role": "user",
+            "content": transcript
+        }]
+
+        try:
+            # 使用单独的调度键，不占用该用户自己的请求名额
+            summary = await AIManager.call_ai_api(provider_id,
+                                                  messages,
+                                                  raise_errors=True,
+                                                  user_id=f"compact:{user_id}")
+            summary = summary.strip()
+            if not summary:
+                return
+            if _state["conversations"].replace_with_summary(
+                    user_id, compacted, summary):
+                _interface.logger.debug(
+                    f"已将用户 {user_id} 的 {len(compacted)} 条消息压缩为摘要")
+        except AIRequestError as e:
+            _interface.logger.warning(f"压缩用户 {user_id} 的对话失败: {e}")
+        finally:
+            _state["compacting"].discard(user_id)
+
+
+class AIManager:
+    """AI 功能管理类"""
+
+    @staticmethod
+    async def call_ai_api(
+            provider_id: str,
+            messages: List[Dict[str, str]],
+            images: Optional[List[Dict[str, Any]]] = None,
+            stream: bool = False,
+            update_callback: Optional[Callable[[str], Any]] = None,
+            raise_errors: bool = False,
+            user_id: Union[int, str, None] = None,
+            queue_callback: Optional[Callable[[int], Any]] = None,
+            cacheable: bool = False) -> str:
+        """调用 AI API
+
+        Args:
+            provider_id: 服务商 ID
+            messages: 消息列表
+            images: 图像列表 (可选)
+            stream: 是否使用流式模式
+            update_callback: 流式更新回调函数
+            raise_errors: 失败时抛出 AIRequestError，而不是返回错误文本
+            user_id: 发起请求的用户 ID（用于公平排队）
+            queue_callback: 排队时的回调函数 (前面的请求数量)
+            cacheable: 是否可以使用响应缓存（开启缓存时生效）
+
+        Returns:
+            str: API 响应文本
+        """
+        global _state
+
+        cache = _state["cache"]
+        key = None
+        if cacheable and cache and cache.settings.get("enabled"):
+            key = cache.make_key(provider_id, messages, images)
+
+        try:
+            if key is None:
+                return await AIManager._call_scheduled(provider_id, messages,
+                                                       images, stream,
+                                                       update_callback, user_id,
+                                                       queue_callback)
+            return await AIManager._call_cached(key, provider_id, messages,
+                                                images, stream, update_callback,
+                                                user_id, queue_callback)
+        except AIRequestError as e:
+            if raise_errors:
+                raise
+            return str(e)
+
+    @staticmethod
+    async def _call_cached(key: str, provider_id: str,
+                           messages: List[Dict[str, str]],
+                           images: Optional[List[Dict[str, Any]]], stream: bool,
+                           update_callback: Optional[Callable[[str], Any]],
+                           user_id: Union[int, str, None],
+                           queue_callback: Optional[Callable[[int], Any]]) -> str:
+        """使用响应缓存的请求，相同的请求同时到达时只有第一个发送到服务商
+
+        Args:
+            key: 缓存键
+            其余参数同 call_ai_api
+
+        Returns:
+            str: API 响应文本
+        """
+        cache = _state["cache"]
+        while True:
+            response = cache.get(key)
+            if response is None and key in cache.inflight:
+                # 等待相同请求的结果，该请求被取消时自己发送
+                inflight = cache.inflight[key]
+                try:
+                    response = await asyncio.shield(inflight)
+                except asyncio.CancelledError:
+                    if not inflight.cancelled():
+                        raise
+                    continue
+                cache.stats["coalesced"] += 1
+
+            if response is not None:
+                if stream and update_callback:
+                    await update_callback(response)
+                return response
+            break
+
+        cache.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        cache.inflight[key] = future
+        try:
+            response = await AIManager._call_scheduled(provider_id, messages,
+                                                       images, stream,
+                                                       update_callback, user_id,
+                                                       queue_callback)
+        except AIRequestError as e:
+            future.set_exception(e)
+            # 没有其他请求等待时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            cache.inflight.pop(key, None)
+
+        if response.strip():
+            cache.put(key, response)
+        future.set_result(response)
+        return response
+
+    @staticmethod
+    async def _call_scheduled(provider_id: str, messages: List[Dict[str, str]],
+                              images: Optional[List[Dict[str, Any]]],
+                              stream: bool,
+                              update_callback: Optional[Callable[[str], Any]],
+                              user_id: Union[int, str, None],
+                              queue_callback: Optional[Callable[[int], Any]]
+                              ) -> str:
+        """获取请求名额后发送请求（高峰期排队等待）
 
         Args:
-            user_id: 用户 ID
+            参数同 call_ai_api
 
         Returns:
-            bool: 是否成功清除
+            str: API 响应文本
         """
-        global _state
-        user_id_str = str(user_id)
-
-        if user_id_str in _state["conversations"]:
-            # 保留系统提示
-            system_messages = [
-                msg for msg in _state["conversations"][user_id_str]
-                if msg["role"] == "system"
-            ]
-            _state["conversations"][user_id_str] = system_messages
-            save_contexts()
-            return True
+        scheduler = _state["scheduler"]
+        await scheduler.acquire(user_id, queue_callback)
+        try:
+            if provider_id not in _state["providers"]:
+                raise AIRequestError("错误：未找到指定的服务商配置")
 
-        return False
+            return await AIManager._call_with_failover(provider_id, messages,
+                                                       images, stream,
+                                                       update_callback)
+        finally:
+            # 归还请求名额，分配给下一个排队的用户
+            scheduler.release(user_id)
 
     @staticmethod
-    def cleanup_expired() -> int:
-        """清理过期的对话
+    def get_health(provider_id: str) -> ProviderHealth:
+        """获取服务商的健康状态
+
+        Args:
+            provider_id: 服务商 ID
 
         Returns:
-            int: 清理的对话数量
+            ProviderHealth: 健康状态
         """
-        global _state
-        now = time.time()
-        timeout = _state.get("conversation_timeout", 24 * 60 * 60)  # 默认 24 小时
-        expired_count = 0
+        health = _state["provider_health"].get(provider_id)
+        if health is None:
+            health = _state["provider_health"][provider_id] = ProviderHealth(
+                provider_id)
+        return health
 
-        # 如果设置为永不超时，直接返回
-        if timeout == float('inf'):
-            return 0
-
-        for user_id, context in list(_state["conversations"].items()):
-            if not context:
-                continue
-
-            # 获取最后一条消息的时间
-            last_message_time = max(
-                [msg.get("timestamp", 0) for msg in context]) if context else 0
+    @staticmethod
+    def _get_provider_chain(provider_id: str) -> List[str]:
+        """获取服务商及其备用服务商（按 fallback_provider 依次查找）
 
-            # 如果超过超时时间，清除对话（保留系统消息）
-            if now - last_message_time > timeout:
-                system_messages = [
-                    msg for msg in context if msg["role"] == "system"
-                ]
-                _state["conversations"][user_id] = system_messages
-                expired_count += 1
+        Args:
+            provider_id: 服务商 ID
 
-        return expired_count
+        Returns:
+            List[str]: 服务商 ID 列表
+        """
+        chain = [provider_id]
+        fallback = _state["providers"][provider_id].get("fallback_provider")
+        while fallback and fallback in _state["providers"] and \
+                fallback not in chain:
+            chain.append(fallback)
+            fallback = _state["providers"][fallback].get("fallback_provider")
+        return chain
 
     @staticmethod
-    def format_for_api(provider_id: str,
-                       user_id: Union[int, str]) -> List[Dict[str, str]]:
-        """格式化用户上下文为 API 请求格式
+    async def _call_with_failover(
+            provider_id: str, messages: List[Dict[str, str]],
+            images: Optional[List[Dict[str, Any]]], stream: bool,
+            update_callback: Optional[Callable[[str], Any]]) -> str:
+        """依次尝试服务商及其备用服务商，跳过熔断中的服务商
+
+        已经开始输出内容的流式请求失败时不再切换，避免用户看到两段不同的回复
 
         Args:
             provider_id: 服务商 ID
-            user_id: 用户 ID
+            messages: 消息列表
+            images: 图像列表
+            stream: 是否使用流式模式
+            update_callback: 流式更新回调函数
 
         Returns:
-            List[Dict]: 格式化的消息列表
+            str: API 响应文本
         """
-        global _state
+        stream = bool(stream and update_callback)
+        chain = AIManager._get_provider_chain(provider_id)
+        tried = set()
+        last_error = None
 
-        provider_data = _state["providers"].get(provider_id)
-        if not provider_data:
-            return []
-
-        # 获取用户上下文
-        context = ConversationManager.get_user_context(user_id)
+        for index, current in enumerate(chain):
+            if current in tried:
+                continue
+            if not AIManager.get_health(current).allow_request():
+                _interface.logger.debug(f"服务商 {current} 已熔断，跳过")
+                continue
+            tried.add(current)
 
-        # 添加系统提示作为第一条消息 (如果不存在)
-        has_system = any(msg["role"] == "system" for msg in context)
+            # 开启对冲时，首字延迟超过 P95 后同时请求下一个可用的服务商
+            secondary = None
+            if stream and _state["providers"][current].get("hedge"):
+                secondary = next(
+                    (p for p in chain[index + 1:]
+                     if p not in tried and AIManager.get_health(p).state != "open"),
+                    None)
 
-        messages = []
-        if not has_system and provider_data.get("system_prompt"):
-            messages.append({
-                "role": "system",
-                "content": provider_data["system_prompt"]
-            })
+            started = []
+            try:
+                if secondary:
+                    return await AIManager._hedged_request(
+                        current, secondary, messages, images, update_callback,
+                        tried, lambda: started.append(True))
+                return await AIManager._attempt(
+                    current, messages, images, stream, update_callback,
+                    lambda: started.append(True))
+            except AIRequestError as e:
+                if not e.retryable or started:
+                    raise
+                last_error = e
+                if index < len(chain) - 1:
+                    _interface.logger.warning(f"服务商 {current} 请求失败，尝试备用服务商: {e}")
+
+        if last_error:
+            raise last_error
+        raise AIRequestError("⚠️ AI 服务暂时不可用，请稍后再试")
 
-        # 添加上下文消息 (去掉时间戳)
-        for msg in context:
-            if msg["role"] in ["user", "assistant", "system"]:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
+    @staticmethod
+    async def _hedged_request(primary: str, secondary: str,
+                              messages: List[Dict[str, str]],
+                              images: Optional[List[Dict[str, Any]]],
+                              update_callback: Callable[[str], Any],
+                              tried: set,
+                              first_token_callback: Callable[[], None]) -> str:
+        """对冲的流式请求
 
-        return messages
+        首字延迟超过主服务商的 P95 时，同时向备用服务商发送相同的请求，
+        先输出内容的请求胜出，另一个被取消
 
+        Args:
+            primary: 主服务商 ID
+            secondary: 备用服务商 ID
+            messages: 消息列表
+            images: 图像列表
+            update_callback: 流式更新回调函数
+            tried: 已尝试的服务商 ID（发出对冲请求时加入备用服务商）
+            first_token_callback: 任一请求收到第一段内容时的回调函数
 
-class AIManager:
-    """AI 功能管理类"""
+        Returns:
+            str: API 响应文本
+        """
+        winner = None
+        decided = asyncio.Event()
+
+        def start(provider_id):
+            def on_first_token():
+                nonlocal winner
+                if winner is None:
+                    winner = provider_id
+                    decided.set()
+                    first_token_callback()
+
+            async def gated_callback(text):
+                if winner == provider_id:
+                    await update_callback(text)
+
+            return asyncio.create_task(
+                AIManager._attempt(provider_id, messages, images, True,
+                                   gated_callback, on_first_token))
+
+        primary_task = start(primary)
+        tasks = {primary_task: primary}
+        decided_task = asyncio.create_task(decided.wait())
+        try:
+            delay = AIManager.get_health(primary).ttft_p95()
+            if delay is not None:
+                await asyncio.wait([primary_task, decided_task],
+                                   timeout=delay,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if winner is None and not primary_task.done() and \
+                        AIManager.get_health(secondary).allow_request():
+                    _interface.logger.info(
+                        f"服务商 {primary} 超过 {delay:.2f} 秒未响应，同时请求 {secondary}")
+                    tried.add(secondary)
+                    tasks[start(secondary)] = secondary
+
+            pending = set(tasks)
+            error = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending | {decided_task},
+                    return_when=asyncio.FIRST_COMPLETED)
+                pending.discard(decided_task)
+                for task in done:
+                    if task is decided_task:
+                        continue
+                    if task.exception() is None:
+                        # 没有输出内容就完成的请求（如非流式返回）直接采用
+                        return task.result()
+                    error = task.exception()
+
+            if winner is None:
+                raise error
+            winner_task = next(t for t, p in tasks.items() if p == winner)
+            return await winner_task
+        finally:
+            decided_task.cancel()
+            for task, provider_id in tasks.items():
+                if provider_id != winner and not task.done():
+                    task.cancel()
 
     @staticmethod
-    async def call_ai_api(
+    async def _attempt(
             provider_id: str,
             messages: List[Dict[str, str]],
-            images: Optional[List[Dict[str, Any]]] = None,
-            stream: bool = False,
-            update_callback: Optional[Callable[[str], Any]] = None) -> str:
-        """调用 AI API
+            images: Optional[List[Dict[str, Any]]],
+            stream: bool,
+            update_callback: Optional[Callable[[str], Any]],
+            first_token_callback: Optional[Callable[[], None]] = None) -> str:
+        """向单个服务商发送请求并记录健康状态
 
         Args:
             provider_id: 服务商 ID
             messages: 消息列表
-            images: 图像列表 (可选)
+            images: 图像列表
             stream: 是否使用流式模式
             update_callback: 流式更新回调函数
+            first_token_callback: 收到第一段内容时的回调函数
 
         Returns:
             str: API 响应文本
         """
-        global _state
-
-        # 检查并初始化请求锁
-        if _state["request_lock"] is None:
-            _state["request_lock"] = asyncio.Lock()
-
-        # 检查并发请求数
-        async with _state["request_lock"]:
-            if _state["concurrent_requests"] >= MAX_CONCURRENT_REQUESTS:
-                return "⚠️ 系统正在处理过多请求，请稍后再试"
+        provider = _state["providers"][provider_id]
+        health = AIManager.get_health(provider_id)
 
-            _state["concurrent_requests"] += 1
+        # 检查 API 密钥
+        if not provider.get("api_key"):
+            health.trial = False
+            raise AIRequestError("错误：未配置 API 密钥")
 
+        # 准备请求数据
         try:
-            # 检查服务商
-            if provider_id not in _state["providers"]:
-                return "错误：未找到指定的服务商配置"
-
-            provider = _state["providers"][provider_id]
+            request_data = await AIServiceProvider.format_request(
+                provider, messages, images, stream)
+            api_url, headers = await AIServiceProvider.prepare_api_request(
+                provider, request_data)
+        except Exception as e:
+            health.trial = False
+            _interface.logger.error(f"格式化请求失败: {e}")
+            raise AIRequestError(f"格式化请求失败: {str(e)}")
 
-            # 检查 API 密钥
-            if not provider.get("api_key"):
-                return "错误：未配置 API 密钥"
+        started = time.monotonic()
+        ttft = None
+        usage = {}
 
-            # 准备请求数据
-            try:
-                request_data = await AIServiceProvider.format_request(
-                    provider, messages, images, stream)
-            except Exception as e:
-                _interface.logger.error(f"格式化请求失败: {e}")
-                return f"格式化请求失败: {str(e)}"
+        def on_first_token():
+            nonlocal ttft
+            ttft = time.monotonic() - started
+            if first_token_callback:
+                first_token_callback()
 
-            # 准备 API 请求
-            try:
-                api_url, headers = await AIServiceProvider.prepare_api_request(
-                    provider, request_data)
-            except Exception as e:
-                _interface.logger.error(f"准备 API 请求失败: {e}")
-                return f"准备 API 请求失败: {str(e)}"
-
-            # 创建一个任务来处理 API 请求，这样不会阻塞其他操作
-            if stream and update_callback:
-                # 流式模式
-                api_task = asyncio.create_task(
-                    AIManager._stream_request(provider, api_url, headers,
-                                              request_data, update_callback,
-                                              provider_id))
+        try:
+            if stream:
+                result = await AIManager._stream_request(
+                    provider, api_url, headers, request_data, update_callback,
+                    provider_id, on_first_token, usage)
             else:
-                # 非流式模式
-                api_task = asyncio.create_task(
-                    AIManager._standard_request(provider, api_url, headers,
-                                                request_data, provider_id))
-
-            # 等待任务完成并获取结果
-            return await api_task
-
-        finally:
-            # 减少并发请求计数
-            async with _state["request_lock"]:
-                _state["concurrent_requests"] -= 1
+                result = await AIManager._standard_request(
+                    provider, api_url, headers, request_data, provider_id,
+                    usage)
+        except AIRequestError as e:
+            if e.retryable:
+                health.record_failure(time.monotonic() - started)
+            else:
+                health.trial = False
+            _state["metrics"].record_error(provider_id, provider.get("model"))
+            raise
+        except asyncio.CancelledError:
+            # 对冲请求中落败的一方被取消，不计入统计
+            health.trial = False
+            raise
+
+        duration = time.monotonic() - started
+        health.record_success(duration, ttft)
+        _state["metrics"].record(provider_id, provider.get("model"), duration,
+                                 ttft, usage, result,
+                                 provider.get("request_format", "openai"))
+        return result
 
     @staticmethod
     async def _stream_request(provider: Dict[str, Any], api_url: str,
                               headers: Dict[str, str], request_data: Dict[str,
                                                                           Any],
                               update_callback: Callable[[str], Any],
-                              provider_id: str) -> str:
+                              provider_id: str,
+                              first_token_callback: Optional[Callable[[], None]] = None,
+                              usage: Optional[Dict[str, int]] = None) -> str:
         """处理流式 API 请求
 
         Args:
@@ -657,6 +2499,8 @@ class AIManager:
             request_data: 请求数据
             update_callback: 更新回调函数
             provider_id: 服务商 ID
+            first_token_callback: 收到第一段内容时的回调函数
+            usage: 用于返回 token 用量的字典（normalize_usage 的格式）
 
         Returns:
             str: 完整响应文本
@@ -665,7 +2509,17 @@ class AIManager:
 
         request_format = provider.get("request_format", "openai")
         full_response = ""
-        last_update_time = time.time()
+        got_first_token = False
+        raw_usage = {}  # 流式响应中返回的用量
+
+        async def on_text(text):
+            # 包装回调以记录首字时间，更新频率由回调方控制
+            nonlocal got_first_token
+            if not got_first_token:
+                got_first_token = True
+                if first_token_callback:
+                    first_token_callback()
+            await update_callback(text)
 
         try:
 
@@ -679,7 +2533,10 @@ class AIManager:
                         error_text = await response.text()
                         _interface.logger.error(
                             f"API 请求失败: {response.status} - {error_text}")
-                        return f"API 请求失败: HTTP {response.status}"
+                        raise AIRequestError(
+                            f"API 请求失败: HTTP {response.status}",
+                            retryable=response.status not in
+                            NON_RETRYABLE_STATUS)
 
                     # 根据不同服务商处理流式响应
                     if request_format == "openai":
@@ -689,16 +2546,7 @@ class AIManager:
 
                             # 处理流式响应行
                             full_response = await OpenAIProvider.process_stream(
-                                line,
-                                # 包装回调以控制更新频率
-                                lambda text: AIManager._throttled_update(
-                                    text, update_callback, last_update_time),
-                                full_response)
-
-                            # 更新最后更新时间
-                            current_time = time.time()
-                            if current_time - last_update_time >= MIN_UPDATE_INTERVAL:
-                                last_update_time = current_time
+                                line, on_text, full_response, raw_usage)
 
                     elif request_format == "anthropic":
                         # Anthropic 流式响应处理
@@ -707,44 +2555,37 @@ class AIManager:
 
                             # 处理流式响应行
                             full_response = await AnthropicProvider.process_stream(
-                                line,
-                                # 包装回调以控制更新频率
-                                lambda text: AIManager._throttled_update(
-                                    text, update_callback, last_update_time),
-                                full_response)
-
-                            # 更新最后更新时间
-                            current_time = time.time()
-                            if current_time - last_update_time >= MIN_UPDATE_INTERVAL:
-                                last_update_time = current_time
+                                line, on_text, full_response, raw_usage)
 
             # 更新使用统计
             _state["usage_stats"]["total_requests"] += 1
             _state["usage_stats"]["requests_by_provider"][provider_id] = \
                 _state["usage_stats"]["requests_by_provider"].get(provider_id, 0) + 1
-
-            # 确保回调一个最终内容
-            if full_response:
-                await update_callback(full_response)
+            if usage is not None:
+                usage.update(
+                    AIServiceProvider.normalize_usage(provider, raw_usage) or {})
 
             return full_response
 
+        except AIRequestError:
+            raise
         except aiohttp.ClientError as e:
             _interface.logger.error(f"API 请求错误: {str(e)}")
-            return f"API 请求错误: {str(e)}"
+            raise AIRequestError(f"API 请求错误: {str(e)}")
         except asyncio.TimeoutError:
             _interface.logger.error("API 请求超时")
-            return "API 请求超时，请稍后再试"
+            raise AIRequestError("API 请求超时，请稍后再试")
         except Exception as e:
             _interface.logger.error(f"调用 AI API 时发生错误: {str(e)}")
-            return f"发生错误: {str(e)}"
+            raise AIRequestError(f"发生错误: {str(e)}")
 
     @staticmethod
     async def _standard_request(provider: Dict[str, Any], api_url: str,
                                 headers: Dict[str,
                                               str], request_data: Dict[str,
                                                                        Any],
-                                provider_id: str) -> str:
+                                provider_id: str,
+                                usage: Optional[Dict[str, int]] = None) -> str:
         """处理标准 API 请求
 
         Args:
@@ -753,6 +2594,7 @@ class AIManager:
             headers: 请求头
             request_data: 请求数据
             provider_id: 服务商 ID
+            usage: 用于返回 token 用量的字典（normalize_usage 的格式）
 
         Returns:
             str: 响应文本
@@ -771,7 +2613,10 @@ class AIManager:
                         error_text = await response.text()
                         _interface.logger.error(
                             f"API 请求失败: {response.status} - {error_text}")
-                        return f"API 请求失败: HTTP {response.status}"
+                        raise AIRequestError(
+                            f"API 请求失败: HTTP {response.status}",
+                            retryable=response.status not in
+                            NON_RETRYABLE_STATUS)
 
                     response_json = await response.json()
 
@@ -781,38 +2626,30 @@ class AIManager:
                     if result is None:
                         _interface.logger.error(
                             f"解析 API 响应失败: {response_json}")
-                        return "解析 API 响应失败"
+                        raise AIRequestError("解析 API 响应失败")
 
                     # 更新使用统计
                     _state["usage_stats"]["total_requests"] += 1
                     _state["usage_stats"]["requests_by_provider"][provider_id] = \
                         _state["usage_stats"]["requests_by_provider"].get(provider_id, 0) + 1
+                    if usage is not None:
+                        usage.update(
+                            AIServiceProvider.normalize_usage(
+                                provider, response_json.get("usage")) or {})
 
                     return result
 
+        except AIRequestError:
+            raise
         except aiohttp.ClientError as e:
             _interface.logger.error(f"API 请求错误: {str(e)}")
-            return f"API 请求错误: {str(e)}"
+            raise AIRequestError(f"API 请求错误: {str(e)}")
         except asyncio.TimeoutError:
             _interface.logger.error("API 请求超时")
-            return "API 请求超时，请稍后再试"
+            raise AIRequestError("API 请求超时，请稍后再试")
         except Exception as e:
             _interface.logger.error(f"调用 AI API 时发生错误: {str(e)}")
-            return f"发生错误: {str(e)}"
-
-    @staticmethod
-    async def _throttled_update(text: str, callback: Callable[[str], Any],
-                                last_update_time: float) -> None:
-        """限制更新频率的回调包装器
-
-        Args:
-            text: 更新文本
-            callback: 原始回调函数
-            last_update_time: 上次更新时间
-        """
-        current_time = time.time()
-        if current_time - last_update_time >= MIN_UPDATE_INTERVAL:
-            await callback(text)
+            raise AIRequestError(f"发生错误: {str(e)}")
 
     @staticmethod
     def is_user_authorized(user_id: int) -> bool:
@@ -871,78 +2708,47 @@ class AIManager:
             user_id: 用户 ID
         """
         try:
-            # 完整响应变量
-            full_response = ""
+            # 流式内容合并后更新到消息，超长时分割为多条消息
+            live = LiveMessage(thinking_message,
+                               min_interval=MIN_UPDATE_INTERVAL,
+                               max_length=MAX_MESSAGE_LENGTH,
+                               logger=_interface.logger)
 
-            # 创建流式更新回调函数
             async def update_message_callback(text):
-                nonlocal full_response
-                try:
-                    # 确保文本不为空
-                    if not text.strip():
-                        return
+                # 确保文本不为空
+                if text.strip():
+                    await live.update(text)
 
-                    full_response = text
-
-                    # 如果文本太长，只显示最后部分
-                    if len(text) <= MAX_MESSAGE_LENGTH:
-                        await thinking_message.edit_text(text)
-                    else:
-                        # 如果消息超长，只更新最后部分
-                        await thinking_message.edit_text(
-                            text[-MAX_MESSAGE_LENGTH:])
-
-                except Exception as e:
-                    # 忽略"消息未修改"错误
-                    if "Message is not modified" not in str(e):
-                        _interface.logger.error(f"更新消息失败: {e}")
+            # 排队时显示前面的请求数量
+            async def queue_callback(position):
+                await thinking_message.edit_text(
+                    f"⏳ 正在排队，前面还有 {position} 个请求...")
 
             # 调用流式 AI API
-            response = await AIManager.call_ai_api(provider_id, messages,
-                                                   images, True,
-                                                   update_message_callback)
-
-            # 添加 AI 回复到上下文
+            response = await AIManager.call_ai_api(
+                provider_id,
+                messages,
+                images,
+                True,
+                update_message_callback,
+                user_id=user_id,
+                queue_callback=queue_callback,
+                cacheable=True)
+
+            # 添加 AI 回复到上下文，上下文过长时在后台压缩
             ConversationManager.add_message(user_id, "assistant", response)
-
-            # 流式传输完成后，尝试将最终消息转换为 HTML 格式
-            try:
-                # 转换为 HTML 格式
-                html_response = TextFormatter.markdown_to_html(response)
-
-                # 检查长度
-                if len(html_response) <= MAX_MESSAGE_LENGTH:
-                    try:
-                        # 直接更新原消息为 HTML 格式
-                        await thinking_message.edit_text(html_response,
-                                                         parse_mode="HTML")
-                    except telegram.error.BadRequest as e:
-                        # 忽略"消息未修改"错误
-                        if "Message is not modified" not in str(e):
-                            _interface.logger.error(f"转换为 HTML 格式失败: {str(e)}")
-                else:
-                    # 如果 HTML 太长，需要分段发送
-                    # 先删除原消息
-                    await thinking_message.delete()
-
-                    # 分段发送 HTML
-                    parts = []
-                    for i in range(0, len(html_response), MAX_MESSAGE_LENGTH):
-                        parts.append(html_response[i:i + MAX_MESSAGE_LENGTH])
-
-                    _interface.logger.info(f"消息过长，将分为 {len(parts)} 段发送")
-
-                    # 发送第一段
-                    first_message = await thinking_message.reply_text(
-                        parts[0], parse_mode="HTML")
-
-                    # 发送剩余段落
-                    for part in parts[1:]:
-                        await first_message.reply_text(part, parse_mode="HTML")
-
-            except Exception as e:
-                _interface.logger.error(f"转换为 HTML 格式失败: {e}")
-                # 如果转换失败，保留原始纯文本消息
+            ConversationManager.maybe_compact(provider_id, user_id)
+
+            # 流式传输完成后，将最终内容转换为 HTML 格式
+            await live.finish(response,
+                              formatter=TextFormatter.markdown_to_html,
+                              parse_mode="HTML")
+            stats = live.get_stats()
+            if stats["messages"] > 1:
+                _interface.logger.info(f"消息过长，已分为 {stats['messages']} 段发送")
+            _interface.logger.debug(
+                f"流式更新 {stats['updates']} 次，编辑 {stats['edits']} 次，"
+                f"发送 {stats['sends']} 条消息，限流 {stats['retry_after']} 次")
         except Exception as e:
             _interface.logger.error(f"AI 响应处理错误: {e}")
             # 尝试发送错误消息
@@ -952,32 +2758,112 @@ class AIManager:
                 pass
 
     @staticmethod
-    async def process_image(photo_file: File) -> Optional[Dict[str, str]]:
-        """处理图像文件
+    async def process_image(bot: telegram.Bot, photo: PhotoSize,
+                            provider: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """下载并预处理图像，按 file_unique_id 缓存处理结果
 
         Args:
-            photo_file: Telegram 图像文件
+            bot: Bot 实例
+            photo: Telegram 图像（通常为最大尺寸的 photo[-1]）
+            provider: 服务商配置（决定最长边）
 
         Returns:
-            Dict: 处理后的图像数据，包含 base64 编码
+            Dict: 处理后的图像数据，包含 base64 编码、MIME 类型和哈希
         """
+        max_edge = int(provider.get("image_max_edge") or DEFAULT_IMAGE_MAX_EDGE)
+        key = (photo.file_unique_id, max_edge)
+        cache = _state["image_cache"]
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
         try:
             # 下载图像
-            image_data = await photo_file.download_as_bytearray()
-
-            # 转换为 base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
+            photo_file = await bot.get_file(photo.file_id)
+            image_data = bytes(await photo_file.download_as_bytearray())
 
-            # 返回包含 MIME 类型的图像数据
-            return {
-                "data": image_base64,
-                "mime_type": "image/jpeg",
-                "size": len(image_data)
-            }
+            # 缩放、编码和 base64 在线程中执行，不阻塞事件循环
+            result = await asyncio.to_thread(AIManager._encode_image,
+                                             image_data, max_edge)
         except Exception as e:
             _interface.logger.error(f"处理图像失败: {e}")
             return None
 
+        _interface.logger.debug(
+            f"已处理图像: {len(image_data)} 字节 -> {result['size']} 字节 "
+            f"({result['width']}x{result['height']}, {result['mime_type']})")
+
+        # 缓存处理结果，超过数量或大小上限时淘汰最久未使用的
+        cache[key] = result
+        _state["image_cache_bytes"] += len(result["data"])
+        while len(cache) > IMAGE_CACHE_SIZE or \
+                _state["image_cache_bytes"] > IMAGE_CACHE_BYTES:
+            _, evicted = cache.popitem(last=False)
+            _state["image_cache_bytes"] -= len(evicted["data"])
+        return result
+
+    @staticmethod
+    def _encode_image(image_data: bytes, max_edge: int) -> Dict[str, Any]:
+        """缩小并重新编码图像（在工作线程中运行）
+
+        已经足够小的 JPEG、PNG、WebP 和 GIF 保持原样，其他图像缩小到最长边和
+        像素上限以内，不透明的编码为 JPEG，带透明通道的编码为 PNG
+
+        Args:
+            image_data: 原始图像数据
+            max_edge: 最长边（像素）
+
+        Returns:
+            Dict: 处理后的图像数据
+        """
+        with Image.open(io.BytesIO(image_data)) as image:
+            source_format = image.format
+            # 按 EXIF 方向旋转后的显示尺寸（方向 5-8 需要交换宽高）
+            width, height = image.size
+            orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+            scale = min(1.0, max_edge / max(width, height),
+                        (IMAGE_MAX_PIXELS / (width * height))**0.5)
+
+            if scale == 1.0 and source_format in ("JPEG", "PNG", "WEBP",
+                                                  "GIF"):
+                data = image_data
+                mime_type = Image.MIME[source_format]
+            else:
+                # 先旋转再缩放，缩放尺寸按旋转后的宽高计算
+                image = ImageOps.exif_transpose(image)
+                width, height = image.size
+                if scale < 1.0:
+                    image = image.resize((max(1, round(width * scale)),
+                                          max(1, round(height * scale))),
+                                         Image.Resampling.LANCZOS)
+                width, height = image.size
+
+                output = io.BytesIO()
+                if image.mode in ("RGBA", "LA") or \
+                        (image.mode == "P" and "transparency" in image.info):
+                    image.save(output, format="PNG", optimize=True)
+                    mime_type = "image/png"
+                else:
+                    image.convert("RGB").save(output,
+                                              format="JPEG",
+                                              quality=IMAGE_QUALITY,
+                                              optimize=True,
+                                              progressive=True)
+                    mime_type = "image/jpeg"
+                data = output.getvalue()
+
+        encoded = base64.b64encode(data).decode("ascii")
+        return {
+            "data": encoded,
+            "mime_type": mime_type,
+            "size": len(data),
+            "width": width,
+            "height": height,
+            "sha256": hashlib.sha256(encoded.encode()).hexdigest()
+        }
+
 
 # 配置菜单和回调处理
 
@@ -1011,7 +2897,17 @@ async def show_config_main_menu(update: Update,
         ],
         [
             InlineKeyboardButton("Set Timeout",
-                                 callback_data=f"{CALLBACK_PREFIX}_timeout")
+                                 callback_data=f"{CALLBACK_PREFIX}_timeout"),
+            InlineKeyboardButton(
+                "Compaction: On"
+                if _state["compaction"].get("enabled") else "Compaction: Off",
+                callback_data=f"{CALLBACK_PREFIX}_compaction")
+        ],
+        [
+            InlineKeyboardButton(
+                "Cache: On"
+                if _state["response_cache"].get("enabled") else "Cache: Off",
+                callback_data=f"{CALLBACK_PREFIX}_cache")
         ]
     ]
 
@@ -1217,13 +3113,48 @@ async def show_usage_stats(update: Update,
     global _state
     query = update.callback_query
 
-    stats = _state["usage_stats"]
+    stats = _state["metrics"].total_usage_stats()
 
     stats_text = "<b>📊 AI 使用统计</b>\n\n"
 
     # 总请求数
     stats_text += f"<b>总请求数:</b> <code>{stats.get('total_requests', 0)}</code>\n\n"
 
+    # 请求排队
+    queue_stats = _state["scheduler"].get_stats()
+    stats_text += "<b>请求排队:</b>\n"
+    stats_text += f"• 进行中: <code>{queue_stats['running']}</code>/<code>{MAX_CONCURRENT_REQUESTS}</code>，"
+    stats_text += f"排队: <code>{queue_stats['waiting']}</code> (<code>{queue_stats['waiting_users']}</code> 位用户)\n"
+    stats_text += f"• 排队过的请求: <code>{queue_stats['queued']}</code>/<code>{queue_stats['granted']}</code>，"
+    stats_text += f"拒绝: <code>{queue_stats['rejected']}</code>\n"
+    stats_text += f"• 等待时间: 平均 <code>{queue_stats['wait_avg']:.1f}s</code>，"
+    stats_text += f"P95 <code>{queue_stats['wait_p95']:.1f}s</code>，"
+    stats_text += f"最长 <code>{queue_stats['wait_max']:.1f}s</code>\n\n"
+
+    # 响应缓存
+    if _state["response_cache"].get("enabled"):
+        cache_stats = _state["cache"].get_stats()
+        stats_text += "<b>响应缓存:</b>\n"
+        stats_text += f"• 命中率: <code>{cache_stats['hit_rate']:.1%}</code> "
+        stats_text += f"(命中 <code>{cache_stats['hits']}</code>，合并 <code>{cache_stats['coalesced']}</code>，"
+        stats_text += f"未命中 <code>{cache_stats['misses']}</code>，跳过 <code>{cache_stats['bypassed']}</code>)\n"
+        stats_text += f"• 缓存: <code>{cache_stats['entries']}</code> 条，"
+        stats_text += f"<code>{cache_stats['size'] / 1024:.1f}</code> KiB\n\n"
+
+    # 服务商健康状态
+    if _state["provider_health"]:
+        state_names = {"closed": "正常", "open": "熔断", "half_open": "试探"}
+        stats_text += "<b>服务商状态 (最近请求):</b>\n"
+        for provider, health in _state["provider_health"].items():
+            health_stats = health.get_stats()
+            latency = health_stats["latency_p95"]
+            ttft = health_stats["ttft_p95"]
+            stats_text += f"• <code>{provider}</code>: {state_names[health_stats['state']]}，"
+            stats_text += f"错误率 <code>{health_stats['error_rate']:.0%}</code>，"
+            stats_text += f"P95 <code>{f'{latency:.1f}s' if latency is not None else '-'}</code>，"
+            stats_text += f"首字 P95 <code>{f'{ttft:.1f}s' if ttft is not None else '-'}</code>\n"
+        stats_text += "\n"
+
     # 按服务商统计
     stats_text += "<b>按服务商统计:</b>\n"
     if not stats.get('requests_by_provider'):
@@ -1235,6 +3166,33 @@ async def show_usage_stats(update: Update,
                 provider) if provider in _state["providers"] else provider
             stats_text += f"• <code>{provider}</code> ({provider_name}): <code>{count}</code>\n"
 
+    # 各服务商和模型的速度和 token 用量（最近 24 小时）
+    summary = _state["metrics"].summarize()
+    if summary:
+
+        def fmt(seconds):
+            return f"{seconds:.1f}s" if seconds is not None else "-"
+
+        stats_text += f"\n<b>速度和用量 (最近 {METRICS_WINDOW // 3600} 小时):</b>\n"
+        for key, item in sorted(summary.items(),
+                                key=lambda x: x[1]["requests"],
+                                reverse=True):
+            cache_read = item["cache_read_tokens"]
+            prompt_total = item["input_tokens"] + cache_read + \
+                item["cache_write_tokens"]
+            tps = item["tps_p50"]
+            stats_text += f"• <code>{key}</code>: <code>{item['requests']}</code> 次"
+            if item["errors"]:
+                stats_text += f"，失败 <code>{item['errors']}</code> 次"
+            stats_text += "\n"
+            stats_text += f"  首字 P50/P95 <code>{fmt(item['ttft_p50'])}</code>/<code>{fmt(item['ttft_p95'])}</code>，"
+            stats_text += f"耗时 P50/P95 <code>{fmt(item['duration_p50'])}</code>/<code>{fmt(item['duration_p95'])}</code>，"
+            stats_text += f"速度 <code>{f'{tps:.0f}' if tps is not None else '-'}</code> token/s\n"
+            stats_text += f"  Token: 输入 <code>{prompt_total}</code>，输出 <code>{item['output_tokens']}</code>"
+            if cache_read:
+                stats_text += f"，缓存读取 <code>{cache_read}</code> (<code>{cache_read / prompt_total:.0%}</code>)"
+            stats_text += "\n"
+
     # 按用户统计 (仅显示前 10 位活跃用户)
     stats_text += "\n<b>按用户统计 (前 10 位):</b>\n"
     if not stats.get('requests_by_user'):
@@ -1575,6 +3533,11 @@ async def handle_specific_actions(update: Update,
             await show_config_main_menu(update, context)
             return
 
+        if param == "prompt_caching" and not supports_prompt_caching(
+                _state["providers"][provider_id]):
+            await query.answer("提示缓存只适用于 Anthropic 格式的服务商")
+            return
+
         # 提示用户输入新值
         current_value = _state["providers"][provider_id].get(param, "")
 
@@ -1586,8 +3549,18 @@ async def handle_specific_actions(update: Update,
 
         if param == "temperature":
             prompt_text += "请输入新的温度值 (0.0-1.0):"
+        elif param == "max_context_tokens":
+            prompt_text += "请输入请求上下文的 token 上限 (正整数):"
         elif param == "supports_image":
             prompt_text += "请输入是否支持图像 (yes/no):"
+        elif param == "fallback_provider":
+            prompt_text += "请输入备用服务商 ID (输入 none 取消备用):"
+        elif param == "hedge":
+            prompt_text += "请输入是否在响应缓慢时同时请求备用服务商 (yes/no):"
+        elif param == "prompt_caching":
+            prompt_text += "请输入是否启用提示缓存 (yes/no):"
+        elif param == "image_max_edge":
+            prompt_text += "请输入发送图像的最长边像素 (256-8192):"
         else:
             prompt_text += "请输入新的值:"
 
@@ -1618,6 +3591,7 @@ async def handle_specific_actions(update: Update,
 
             # 删除服务商
             del _state["providers"][provider_id]
+            _state["provider_health"].pop(provider_id, None)
 
             # 如果删除的是默认服务商，重置默认服务商
             if _state["default_provider"] == provider_id:
@@ -1841,6 +3815,27 @@ async def show_provider_edit_menu(update: Update,
                 callback_data=
                 f"{CALLBACK_PREFIX}_edit_param_{provider_id}_supports_image")
         ],
+        [
+            InlineKeyboardButton(
+                "Context Tokens",
+                callback_data=
+                f"{CALLBACK_PREFIX}_edit_param_{provider_id}_max_context_tokens"
+            ),
+            InlineKeyboardButton(
+                "Fallback",
+                callback_data=
+                f"{CALLBACK_PREFIX}_edit_param_{provider_id}_fallback_provider")
+        ],
+        [
+            InlineKeyboardButton(
+                "Hedge",
+                callback_data=f"{CALLBACK_PREFIX}_edit_param_{provider_id}_hedge"
+            ),
+            InlineKeyboardButton(
+                "Image Size",
+                callback_data=
+                f"{CALLBACK_PREFIX}_edit_param_{provider_id}_image_max_edge")
+        ],
         [
             InlineKeyboardButton(
                 "Test Provider",
@@ -1851,6 +3846,15 @@ async def show_provider_edit_menu(update: Update,
         ]
     ]
 
+    # 提示缓存只适用于 Anthropic 格式
+    if supports_prompt_caching(provider):
+        keyboard.insert(-1, [
+            InlineKeyboardButton(
+                "Prompt Cache",
+                callback_data=
+                f"{CALLBACK_PREFIX}_edit_param_{provider_id}_prompt_caching")
+        ])
+
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # 检查是否是回调查询或文本消息
@@ -2080,6 +4084,7 @@ async def handle_config_callback(update: Update,
 
             # 删除服务商
             del _state["providers"][provider_id]
+            _state["provider_health"].pop(provider_id, None)
 
             # 如果删除的是默认服务商，重置默认服务商
             if _state["default_provider"] == provider_id:
@@ -2125,6 +4130,28 @@ async def handle_config_callback(update: Update,
         # 设置超时时间
         await show_timeout_options(update, context)
 
+    elif action == "compaction":
+        # 切换对话压缩
+        enabled = not _state["compaction"].get("enabled")
+        _state["compaction"]["enabled"] = enabled
+        save_config()
+        _interface.logger.info(
+            f"用户 {user_id} {'开启' if enabled else '关闭'}了对话压缩")
+        await query.answer(f"已{'开启' if enabled else '关闭'}对话压缩")
+        await show_config_main_menu(update, context)
+
+    elif action == "cache":
+        # 切换响应缓存，关闭时清空已缓存的回复
+        enabled = not _state["response_cache"].get("enabled")
+        _state["response_cache"]["enabled"] = enabled
+        if not enabled:
+            _state["cache"].clear()
+        save_config()
+        _interface.logger.info(
+            f"用户 {user_id} {'开启' if enabled else '关闭'}了响应缓存")
+        await query.answer(f"已{'开启' if enabled else '关闭'}响应缓存")
+        await show_config_main_menu(update, context)
+
     elif action == "stats":
         # 查看使用统计
         await show_usage_stats(update, context)
@@ -2146,6 +4173,11 @@ async def handle_config_callback(update: Update,
                 await show_config_main_menu(update, context)
                 return
 
+            if param_name == "prompt_caching" and not supports_prompt_caching(
+                    _state["providers"][provider_id]):
+                await query.answer("提示缓存只适用于 Anthropic 格式的服务商")
+                return
+
             # 检查是否有其他模块的活跃会话
             has_other_session = await session_manager.has_other_module_session(
                 user_id, MODULE_NAME, chat_id=chat_id)
@@ -2167,8 +4199,18 @@ async def handle_config_callback(update: Update,
 
             if param_name == "temperature":
                 prompt_text += "请输入新的温度值 (0.0-1.0):"
+            elif param_name == "max_context_tokens":
+                prompt_text += "请输入请求上下文的 token 上限 (正整数):"
             elif param_name == "supports_image":
                 prompt_text += "请输入是否支持图像 (yes/no):"
+            elif param_name == "fallback_provider":
+                prompt_text += "请输入备用服务商 ID (输入 none 取消备用):"
+            elif param_name == "hedge":
+                prompt_text += "请输入是否在响应缓慢时同时请求备用服务商 (yes/no):"
+            elif param_name == "prompt_caching":
+                prompt_text += "请输入是否启用提示缓存 (yes/no):"
+            elif param_name == "image_max_edge":
+                prompt_text += "请输入发送图像的最长边像素 (256-8192):"
             else:
                 prompt_text += "请输入新的值:"
 
@@ -2349,7 +4391,23 @@ async def show_current_config(update: Update,
 
     # 对话超时设置
     timeout_hours = _state.get("conversation_timeout", 24 * 60 * 60) // 3600
-    config_text += f"<b>对话超时时间:</b> <code>{timeout_hours}</code> 小时\n\n"
+    config_text += f"<b>对话超时时间:</b> <code>{timeout_hours}</code> 小时\n"
+
+    # 对话压缩设置
+    compaction = _state["compaction"]
+    if compaction.get("enabled"):
+        config_text += (f"<b>对话压缩:</b> 超过 <code>{compaction['threshold_tokens']}</code> tokens 时压缩，"
+                        f"保留最近 <code>{compaction['keep_recent']}</code> 条消息\n\n")
+    else:
+        config_text += "<b>对话压缩:</b> 已关闭\n"
+
+    # 响应缓存设置
+    response_cache = _state["response_cache"]
+    if response_cache.get("enabled"):
+        config_text += (f"<b>响应缓存:</b> 有效期 <code>{response_cache['ttl']}</code> 秒，"
+                        f"最多 <code>{response_cache['max_entries']}</code> 条\n\n")
+    else:
+        config_text += "<b>响应缓存:</b> 已关闭\n\n"
 
     # 服务商列表
 
@@ -2408,6 +4466,7 @@ async def show_current_config(update: Update,
                 config_text += "  🔑 API Key: <code>未设置</code> ⚠️\n"
 
             config_text += f"  🌡️ 温度: <code>{provider.get('temperature', 0.7)}</code>\n"
+            config_text += f"  📏 上下文上限: <code>{provider.get('max_context_tokens', DEFAULT_MAX_CONTEXT_TOKENS)}</code> tokens\n"
 
             # 系统提示 (可能很长，截断显示)
             system_prompt = provider.get('system_prompt', '未设置')
@@ -2420,7 +4479,19 @@ async def show_current_config(update: Update,
             # 图像支持
             supports_image = "✅" if provider.get("supports_image",
                                                  False) else "❌"
-            config_text += f"  🖼️ 图像支持: {supports_image}\n\n"
+            config_text += f"  🖼️ 图像支持: {supports_image} (最长边 <code>{provider.get('image_max_edge', DEFAULT_IMAGE_MAX_EDGE)}</code>)\n"
+
+            # 备用服务商和对冲请求
+            fallback = provider.get("fallback_provider") or "未设置"
+            hedge = "✅" if provider.get("hedge", False) else "❌"
+            config_text += f"  🔁 备用服务商: <code>{fallback}</code> (对冲: {hedge})\n"
+
+            # 提示缓存（只适用于 Anthropic 格式）
+            if supports_prompt_caching(provider):
+                prompt_caching = "✅" if provider.get("prompt_caching",
+                                                     False) else "❌"
+                config_text += f"  ⚡ 提示缓存: {prompt_caching}\n"
+            config_text += "\n"
 
         # 在文本中添加页码信息
         config_text += f"第 {page + 1}/{total_pages} 页"
@@ -2572,6 +4643,43 @@ async def ai_clear_command(update: Update,
         await message.reply_text("您还没有任何对话历史")
 
 
+async def start_ai_response(provider_id: str, user_id: int, message_text: str,
+                            images: List[Dict[str, Any]],
+                            thinking_message) -> None:
+    """把用户消息加入上下文并在后台处理 AI 请求
+
+    后台任务已满被拒绝时撤回这条用户消息，并把"正在思考"消息改为提示
+
+    Args:
+        provider_id: 服务商 ID
+        user_id: 用户 ID
+        message_text: 用户消息
+        images: 图像列表
+        thinking_message: "正在思考"消息
+    """
+    # 添加用户消息到上下文
+    user_message = ConversationManager.add_message(user_id, "user",
+                                                   message_text)[-1]
+
+    # 准备 API 请求
+    messages = ConversationManager.format_for_api(provider_id, user_id)
+
+    # 创建一个后台任务来处理 AI 请求，不会阻塞其他命令
+    task = _interface.spawn(AIManager.process_ai_response(
+        provider_id, messages, images, thinking_message, user_id),
+                            name="ai_response",
+                            group=AI_RESPONSE_GROUP)
+    if task is not None:
+        return
+
+    ConversationManager.remove_message(user_id, user_message)
+    _interface.logger.warning(f"后台任务已满，拒绝了用户 {user_id} 的 AI 请求")
+    try:
+        await thinking_message.edit_text("⚠️ 系统正在处理过多请求，请稍后再试")
+    except telegram.error.TelegramError as e:
+        _interface.logger.error(f"更新消息失败: {e}")
+
+
 async def ai_command(update: Update,
                      context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理 /ai 命令 - 向 AI 发送消息"""
@@ -2624,10 +4732,10 @@ async def ai_command(update: Update,
             if provider.get("supports_image", False):
                 # 获取最大尺寸的图像
                 photo = replied_message.photo[-1]
-                photo_file = await context.bot.get_file(photo.file_id)
 
                 # 处理图像
-                image_data = await AIManager.process_image(photo_file)
+                image_data = await AIManager.process_image(
+                    context.bot, photo, provider)
                 if image_data:
                     images.append(image_data)
             else:
@@ -2656,16 +4764,9 @@ async def ai_command(update: Update,
     # 发送"正在思考"消息
     thinking_message = await message.reply_text("🤔 正在思考中...")
 
-    # 添加用户消息到上下文
-    ConversationManager.add_message(user_id, "user", message_text)
-
-    # 准备 API 请求
-    messages = ConversationManager.format_for_api(provider_id, user_id)
-
-    # 创建一个异步任务来处理 AI 请求，不会阻塞其他命令
-    asyncio.create_task(
-        AIManager.process_ai_response(provider_id, messages, images,
-                                      thinking_message, user_id))
+    # 在后台处理 AI 请求，不会阻塞其他命令
+    await start_ai_response(provider_id, user_id, message_text, images,
+                            thinking_message)
 
 
 async def handle_config_input(update: Update,
@@ -2779,12 +4880,46 @@ async def handle_config_input(update: Update,
                     await message.reply_text("⚠️ 温度值必须是有效的浮点数，请重新输入：")
                     return
 
-            elif param_name == "supports_image":
+            elif param_name == "max_context_tokens":
+                # 验证 token 上限
+                try:
+                    value = int(message_text)
+                    if value <= 0:
+                        raise ValueError
+                except ValueError:
+                    await message.reply_text("⚠️ token 上限必须是正整数，请重新输入：")
+                    return
+
+            elif param_name == "image_max_edge":
+                # 验证图像最长边
+                try:
+                    value = int(message_text)
+                    if not (256 <= value <= 8192):
+                        raise ValueError
+                except ValueError:
+                    await message.reply_text("⚠️ 最长边必须是 256 到 8192 之间的整数，请重新输入：")
+                    return
+
+            elif param_name in ("supports_image", "hedge", "prompt_caching"):
                 # 转换为布尔值
                 value = message_text.lower() in [
                     "true", "yes", "1", "y", "t", "是", "支持"
                 ]
 
+            elif param_name == "fallback_provider":
+                # 验证备用服务商
+                if message_text.lower() in ("none", "无", "-"):
+                    value = None
+                elif message_text == provider_id:
+                    await message.reply_text("⚠️ 备用服务商不能是自身，请重新输入：")
+                    return
+                elif message_text not in _state["providers"]:
+                    await message.reply_text(
+                        f"⚠️ 服务商 {message_text} 不存在，请重新输入：")
+                    return
+                else:
+                    value = message_text
+
             else:
                 # 其他参数直接使用输入值
                 value = message_text
@@ -2995,10 +5130,10 @@ async def handle_private_message(update: Update,
             if provider.get("supports_image", False):
                 # 获取最大尺寸的图像
                 photo = replied_message.photo[-1]
-                photo_file = await context.bot.get_file(photo.file_id)
 
                 # 处理图像
-                image_data = await AIManager.process_image(photo_file)
+                image_data = await AIManager.process_image(
+                    context.bot, photo, provider)
                 if image_data:
                     images.append(image_data)
             else:
@@ -3016,10 +5151,10 @@ async def handle_private_message(update: Update,
         if provider.get("supports_image", False):
             # 获取最大尺寸的图像
             photo = message.photo[-1]
-            photo_file = await context.bot.get_file(photo.file_id)
 
             # 处理图像
-            image_data = await AIManager.process_image(photo_file)
+            image_data = await AIManager.process_image(
+                context.bot, photo, provider)
             if image_data:
                 images.append(image_data)
         else:
@@ -3029,16 +5164,9 @@ async def handle_private_message(update: Update,
     # 发送"正在思考"消息
     thinking_message = await message.reply_text("🤔 正在思考中...")
 
-    # 添加用户消息到上下文
-    ConversationManager.add_message(user_id, "user", message_text)
-
-    # 准备 API 请求
-    messages = ConversationManager.format_for_api(provider_id, user_id)
-
-    # 创建一个异步任务来处理 AI 请求，不等待它完成
-    asyncio.create_task(
-        AIManager.process_ai_response(provider_id, messages, images,
-                                      thinking_message, user_id))
+    # 在后台处理 AI 请求，不等待它完成
+    await start_ai_response(provider_id, user_id, message_text, images,
+                            thinking_message)
 
 
 async def handle_private_photo(update: Update,
@@ -3097,10 +5225,9 @@ async def handle_private_photo(update: Update,
 
     # 获取图像
     photo = update.message.photo[-1]  # 最大尺寸的图像
-    photo_file = await context.bot.get_file(photo.file_id)
 
-    # 处理图像
-    image_data = await AIManager.process_image(photo_file)
+    # 处理图像（缩小后重新编码，相同的图像使用缓存）
+    image_data = await AIManager.process_image(context.bot, photo, provider)
     if not image_data:
         await update.message.reply_text("❌ 处理图像失败")
         return
@@ -3125,16 +5252,9 @@ async def handle_private_photo(update: Update,
     # 发送"正在思考"消息
     thinking_message = await update.message.reply_text("🖼️ 正在分析图像...")
 
-    # 添加用户消息到上下文
-    ConversationManager.add_message(user_id, "user", message_text)
-
-    # 准备 API 请求
-    messages = ConversationManager.format_for_api(provider_id, user_id)
-
-    # 创建一个异步任务来处理 AI 请求，不等待它完成
-    asyncio.create_task(
-        AIManager.process_ai_response(provider_id, messages, [image_data],
-                                      thinking_message, user_id))
+    # 在后台处理 AI 请求，不等待它完成
+    await start_ai_response(provider_id, user_id, message_text, [image_data],
+                            thinking_message)
 
 
 async def handle_group_config_message(
@@ -3176,25 +5296,37 @@ async def handle_group_config_message(
 
 
 def save_config() -> None:
-    """保存 AI 配置"""
+    """保存 AI 配置
+
+    与文件中的最新配置合并后写入并通知其他分片，分片模式下不会覆盖其他分片的修改
+    """
     global _state
 
     config_to_save = {
         "providers": _state["providers"],
         "whitelist": _state["whitelist"],
         "default_provider": _state["default_provider"],
-        "usage_stats": _state["usage_stats"],
         "conversation_timeout": _state.get("conversation_timeout",
-                                           24 * 60 * 60)
+                                           24 * 60 * 60),
+        "compaction": _state["compaction"],
+        "response_cache": _state["response_cache"]
     }
 
     os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
 
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config_to_save, f, ensure_ascii=False, indent=2)
+        saved = _state["config_file"].save(config_to_save,
+                                           ensure_ascii=False,
+                                           indent=2)
     except Exception as e:
         _interface.logger.error(f"保存 AI 配置失败: {e}")
+        return
+
+    # 合并后的配置可能包含其他分片的修改
+    for key, value in saved.items():
+        if key in config_to_save:
+            _state[key] = value
+    _interface.notify_state_changed()
 
 
 def load_config() -> None:
@@ -3212,67 +5344,95 @@ def load_config() -> None:
             "requests_by_user": {}
         }
         _state["conversation_timeout"] = 24 * 60 * 60  # 默认 24 小时
+        _state["compaction"] = dict(DEFAULT_COMPACTION)
+        _state["response_cache"] = dict(DEFAULT_RESPONSE_CACHE)
 
         # 创建配置文件
         save_config()
         return
 
     try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        config = _state["config_file"].load(default={})
 
-            # 加载提供商配置
-            if "providers" in config:
-                _state["providers"] = config["providers"]
+        # 加载提供商配置
+        if "providers" in config:
+            _state["providers"] = config["providers"]
 
-            # 加载白名单（确保是字典格式）
-            if "whitelist" in config:
-                if isinstance(config["whitelist"], dict):
-                    _state["whitelist"] = config["whitelist"]
-                else:
-                    # 如果不是字典格式，初始化为空字典
-                    _state["whitelist"] = {}
-                    # 保存新格式
-                    save_config()
+        # 加载白名单（确保是字典格式）
+        if "whitelist" in config:
+            if isinstance(config["whitelist"], dict):
+                _state["whitelist"] = config["whitelist"]
             else:
-                # 如果配置中没有白名单，初始化为空字典
+                # 如果不是字典格式，初始化为空字典
                 _state["whitelist"] = {}
+                # 保存新格式
+                save_config()
+        else:
+            # 如果配置中没有白名单，初始化为空字典
+            _state["whitelist"] = {}
 
-            # 加载默认提供商
-            if "default_provider" in config:
-                _state["default_provider"] = config["default_provider"]
-
-            # 加载使用统计
-            if "usage_stats" in config:
-                _state["usage_stats"] = config["usage_stats"]
+        # 加载默认提供商
+        if "default_provider" in config:
+            _state["default_provider"] = config["default_provider"]
 
-            # 加载对话超时设置
-            if "conversation_timeout" in config:
-                _state["conversation_timeout"] = config["conversation_timeout"]
-    except Exception as e:
-        _interface.logger.error(f"加载 AI 配置失败: {e}")
+        # 加载旧版本保存在配置文件中的使用统计（只在启动时，之后以统计文件为准）
+        if "usage_stats" in config and _state["metrics"] is None:
+            _state["usage_stats"] = config["usage_stats"]
 
+        # 加载对话超时设置
+        if "conversation_timeout" in config:
+            _state["conversation_timeout"] = config["conversation_timeout"]
 
-def save_contexts() -> None:
-    """保存所有用户的对话上下文"""
-    try:
-        _interface.save_state({"conversations": _state["conversations"]})
+        # 加载对话压缩设置（补全缺少的项）
+        _state["compaction"] = dict(DEFAULT_COMPACTION)
+        if isinstance(config.get("compaction"), dict):
+            _state["compaction"].update(config["compaction"])
 
-        # 更新保存时间
-        _state["last_save_time"] = time.time()
+        # 加载响应缓存设置
+        _state["response_cache"] = dict(DEFAULT_RESPONSE_CACHE)
+        if isinstance(config.get("response_cache"), dict):
+            _state["response_cache"].update(config["response_cache"])
     except Exception as e:
-        _interface.logger.error(f"保存对话上下文失败: {e}")
+        _interface.logger.error(f"加载 AI 配置失败: {e}")
 
 
 def load_contexts() -> None:
-    """加载所有用户的对话上下文"""
+    """建立对话记录索引，并迁移旧版本保存在模块状态中的对话"""
     global _state
 
+    store = ConversationStore()
+    _state["conversations"] = store
     try:
-        state = _interface.load_state(default={"conversations": {}})
-        _state["conversations"] = state.get("conversations", {})
+        count = store.load_index()
     except Exception as e:
-        _interface.logger.error(f"加载对话上下文失败: {e}")
+        _interface.logger.error(f"读取对话记录目录失败: {e}")
+        return
+
+    # 旧版本把所有用户的对话保存在一个状态文件中
+    state = _interface.load_state(default={})
+    legacy = state.get("conversations") if isinstance(state, dict) else None
+    if not legacy:
+        return
+
+    for user_id, context in legacy.items():
+        messages = [[
+            ROLE_CODES.get(msg.get("role"), ROLE_CODES["user"]),
+            msg.get("content", ""),
+            msg.get("timestamp", 0)
+        ] for msg in context]
+        if not messages:
+            continue
+        store.conversations[user_id] = messages
+        store.dirty.add(user_id)
+        store.last_activity[user_id] = max(msg[2] for msg in messages)
+    store.last_activity = OrderedDict(
+        sorted(store.last_activity.items(), key=lambda x: x[1]))
+    store.save_now()
+    _interface.save_state({})
+    _interface.logger.info(f"已将 {len(legacy)} 个用户的对话迁移到 {store.storage_dir}")
+    count = len(store.last_activity)
+
+    _interface.logger.debug(f"已加载 {count} 个用户的对话索引")
 
 
 # 模块状态管理函数
@@ -3283,13 +5443,26 @@ async def setup(module_interface):
     global _interface, _state
     _interface = module_interface
 
-    # 初始化请求锁
-    _state["request_lock"] = asyncio.Lock()
+    # 初始化请求调度器
+    _state["scheduler"] = RequestScheduler()
+
+    # AI 回复直接进入调度器排队，由调度器按用户轮流分配
+    module_interface.set_task_limit(AI_RESPONSE_GROUP, AI_RESPONSE_TASK_LIMIT)
 
     # 加载配置文件（从 config 目录）和用户对话上下文
     load_config()
     load_contexts()
 
+    # 加载响应缓存
+    _state["cache"] = ResponseCache(shard_id=module_interface.shard_id)
+    if _state["response_cache"].get("enabled"):
+        _state["cache"].load()
+
+    # 加载用量统计（覆盖配置文件中旧版本的请求计数）
+    _state["metrics"] = UsageMetrics(shard_id=module_interface.shard_id)
+    _state["metrics"].load()
+    await _state["metrics"].save()
+
     # 注册命令
     await module_interface.register_command("aiconfig",
                                             ai_config_command,
@@ -3345,17 +5518,44 @@ async def setup(module_interface):
                 if expired_count > 0:
                     _interface.logger.info(f"已清理 {expired_count} 个过期对话")
 
-                # 保存用户对话上下文
-                save_contexts()
+                # 清除过期的缓存回复
+                _state["cache"].purge_expired()
+                await _state["cache"].save()
+
+                # 清除过期的用量统计并保存
+                _state["metrics"].purge_expired()
+                await _state["metrics"].save()
             except Exception as e:
                 _interface.logger.error(f"定期任务执行失败: {str(e)}")
 
     # 启动定期任务
-    module_interface.periodic_task = asyncio.create_task(_periodic_tasks())
+    module_interface.set_task_limit(AI_PERIODIC_GROUP, 0)
+    module_interface.periodic_task = module_interface.spawn(
+        _periodic_tasks(), name="periodic_tasks", group=AI_PERIODIC_GROUP)
 
     _interface.logger.info(f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化")
 
 
+async def on_state_changed(module_interface):
+    """其他分片修改了配置（如白名单、服务商），重新加载"""
+    load_config()
+    # 其他分片关闭了响应缓存时，本分片也清空自己的缓存
+    if _state["cache"] and not _state["response_cache"].get("enabled"):
+        _state["cache"].clear()
+        await _state["cache"].save()
+    module_interface.logger.debug("已重新加载 AI 配置")
+
+
+async def flush(module_interface):
+    """保存尚未写入的对话记录、响应缓存和用量统计（停止前调用）"""
+    if _state["conversations"]:
+        await _state["conversations"].save()
+    if _state["cache"]:
+        await _state["cache"].save()
+    if _state["metrics"]:
+        await _state["metrics"].save()
+
+
 async def cleanup(module_interface):
     """模块清理"""
     # 取消定期任务
@@ -3363,7 +5563,12 @@ async def cleanup(module_interface):
                'periodic_task') and module_interface.periodic_task:
         module_interface.periodic_task.cancel()
 
-    # 保存用户对话上下文
-    save_contexts()
+    # 等待进行中的保存完成，再保存尚未写入的对话记录、响应缓存和用量统计
+    if _state["conversations"]:
+        await _state["conversations"].close()
+    if _state["cache"]:
+        await _state["cache"].save()
+    if _state["metrics"]:
+        await _state["metrics"].save()
 
     module_interface.logger.info(f"模块 {MODULE_NAME} 已清理")
@@ -1,13 +1,13 @@
 # modules/alias.py - 命令别名模块
 
 import asyncio
-import json
 import os
 import random
 from typing import Dict, Optional, Any
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, MessageHandler, filters
 from utils.pagination import PaginationHelper
+from utils.atomic_file import SharedJsonFile
 
 # 模块元数据
 MODULE_NAME = "alias"
@@ -15,12 +15,14 @@ MODULE_VERSION = "3.2.0"
 MODULE_DESCRIPTION = "命令别名，支持中文命令和动作"
 MODULE_COMMANDS = ["alias"]  # 只包含英文命令
 MODULE_CHAT_TYPES = ["private", "group"]  # 在私聊和群组中都允许使用别名功能
+MODULE_LAZY = False  # 需要拦截所有别名命令，不能按需加载
 
 # 按钮回调前缀
 CALLBACK_PREFIX = "alias_"
 
 # 存储别名数据的文件路径
 CONFIG_FILE = "config/aliases.json"
+_config_file = SharedJsonFile(CONFIG_FILE)  # 分片之间合并写入
 
 # 内置动作模板（不会被保存到配置文件中）
 ACTION_TEMPLATES = {
@@ -105,19 +107,21 @@ def _load_aliases() -> Dict[str, Any]:
         return _state  # 返回默认状态
 
     try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # 确保有 permissions 字段
-            if "permissions" not in data:
-                data["permissions"] = {"alias": "super_admin"}
-            return data
+        data = _config_file.load()
+        # 确保有 permissions 字段
+        if "permissions" not in data:
+            data["permissions"] = {"alias": "super_admin"}
+        return data
     except Exception as e:
         _interface.logger.error(f"加载别名数据失败: {e}")
         return _state  # 返回默认状态
 
 
 async def _save_aliases():
-    """保存别名数据到文件和框架状态（异步安全）"""
+    """保存别名数据到文件和框架状态（异步安全）
+
+    与文件中的最新数据合并后写入，分片模式下不会覆盖其他分片添加或删除的别名
+    """
     global _state
 
     async with _state_lock:
@@ -131,11 +135,14 @@ async def _save_aliases():
                 "permissions": _state["permissions"]
             }
 
-            # 保存到配置文件
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(save_state, f, ensure_ascii=False, indent=2)
+            # 保存到配置文件，合并后的数据可能包含其他分片的修改
+            saved = _config_file.save(save_state, ensure_ascii=False,
+                                      indent=2)
+            _state["aliases"] = saved["aliases"]
+            _state["permissions"] = saved["permissions"]
+            _update_reverse_aliases()
 
-            # 同时保存到框架的状态管理中
+            # 同时保存到框架的状态管理中（通知其他分片重新加载）
             _interface.save_state(_state)
         except Exception as e:
             _interface.logger.error(f"保存别名数据失败: {e}")
@@ -744,20 +751,14 @@ async def setup(interface):
     global _interface, _state
     _interface = interface
 
-    # 从文件加载别名数据
-    loaded_state = _load_aliases()
-
     # 使用框架的状态管理加载之前保存的状态
     saved_state = interface.load_state(default=None)
 
-    # 如果有保存的状态，优先使用保存的状态
-    if saved_state:
+    # 配置文件是各分片合并写入的数据，存在时优先使用
+    if os.path.exists(CONFIG_FILE):
+        _state.update(_load_aliases())
+    elif saved_state:
         _state.update(saved_state)
-    # 否则使用从配置文件加载的状态
-    elif loaded_state:
-        _state.update(loaded_state)
-        # 将状态保存到框架的状态管理中
-        interface.save_state(_state)
 
     # 更新反向映射表
     _update_reverse_aliases()
@@ -787,6 +788,13 @@ async def setup(interface):
     interface.logger.info(f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化")
 
 
+async def on_state_changed(interface):
+    """其他分片修改了别名，重新加载"""
+    _state.update(_load_aliases())
+    _update_reverse_aliases()
+    interface.logger.debug("已重新加载别名数据")
+
+
 async def cleanup(interface):
     """模块清理"""
     # 保存别名数据到文件和框架状态
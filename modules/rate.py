@@ -7,6 +7,7 @@ import aiohttp
 import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, MessageHandler, filters
+from utils.atomic_file import atomic_write_json, file_lock
 
 # 模块元数据
 MODULE_NAME = "rate"
@@ -14,10 +15,14 @@ MODULE_VERSION = "3.2.0"
 MODULE_DESCRIPTION = "汇率转换，支持法币/虚拟货币"
 MODULE_COMMANDS = ["rate", "setrate"]
 MODULE_CHAT_TYPES = ["private", "group"]
+MODULE_LAZY = False  # 后台定时更新汇率，不能按需加载
 
 # 按钮回调前缀
 CALLBACK_PREFIX = "rate_"
 
+# 定时更新任务分组（长期运行，不占用默认分组的并发名额）
+RATE_TASK_GROUP = "rate_update"
+
 # 模块状态
 _state = {
     "last_update": 0,
@@ -57,8 +62,8 @@ def load_config():
     # 保存默认配置
     try:
         os.makedirs(os.path.dirname(_config_file), exist_ok=True)
-        with open(_config_file, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, indent=2, ensure_ascii=False)
+        atomic_write_json(_config_file, default_config, indent=2,
+                          ensure_ascii=False)
     except Exception as e:
         _module_interface.logger.error(f"保存默认配置失败: {e}")
 
@@ -76,14 +81,33 @@ def save_config(config):
     """
     try:
         os.makedirs(os.path.dirname(_config_file), exist_ok=True)
-        with open(_config_file, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        atomic_write_json(_config_file, config, indent=2, ensure_ascii=False)
+        # 通知其他分片重新加载配置
+        _module_interface.notify_state_changed()
         return True
     except Exception as e:
         _module_interface.logger.error(f"保存配置失败: {e}")
         return False
 
 
+def update_config(key, value):
+    """修改配置文件中的一项
+
+    在文件锁内重新读取配置后写入，分片模式下不会覆盖其他分片的修改
+
+    Args:
+        key: 配置项
+        value: 新的值
+
+    Returns:
+        bool: 保存是否成功
+    """
+    with file_lock(_config_file):
+        config = load_config()
+        config[key] = value
+        return save_config(config)
+
+
 async def update_exchange_rates():
     """更新汇率数据"""
     global _state
@@ -111,8 +135,10 @@ async def update_exchange_rates():
             _state["data_loaded"] = True
             _module_interface.logger.debug("汇率数据初始加载完成")
 
-        # 保存状态到框架的状态管理中
-        _module_interface.save_state(_state)
+        # 保存状态到框架的状态管理中（状态文件只由主分片写入，
+        # 其他分片查询时获取的汇率只保留在内存中）
+        if _module_interface.is_primary_shard:
+            _module_interface.save_state(_state)
     except Exception as e:
         _module_interface.logger.error(f"更新汇率数据失败: {e}")
 
@@ -464,6 +490,17 @@ async def periodic_update():
         raise
 
 
+def restart_periodic_update():
+    """重启定期更新任务"""
+    global _update_task
+    if _update_task and not _update_task.done():
+        _update_task.cancel()
+
+    _update_task = _module_interface.spawn(periodic_update(),
+                                           name="periodic_update",
+                                           group=RATE_TASK_GROUP)
+
+
 async def handle_callback_query(update: Update,
                                 context: ContextTypes.DEFAULT_TYPE):
     """处理按钮回调查询
@@ -620,10 +657,7 @@ async def handle_rate_input(update: Update,
                                               chat_id=chat_id)
 
         # 更新配置
-        config = load_config()
-        config["api_key"] = api_key
-
-        if save_config(config):
+        if update_config("api_key", api_key):
             # 更新全局变量
             global EXCHANGERATE_API_KEY
             EXCHANGERATE_API_KEY = api_key
@@ -661,22 +695,15 @@ async def handle_rate_input(update: Update,
                 await message.reply_text("⚠️ 更新间隔不能小于 600 秒（10 分钟）")
                 return
 
-            config = load_config()
-            config["update_interval"] = interval
-
-            if save_config(config):
+            if update_config("update_interval", interval):
                 # 更新状态
                 _state["update_interval"] = interval
 
-                # 保存状态到框架的状态管理中
-                _module_interface.save_state(_state)
-
-                # 重启定期更新任务
-                global _update_task
-                if _update_task and not _update_task.done():
-                    _update_task.cancel()
-
-                _update_task = asyncio.create_task(periodic_update())
+                # 汇率状态文件只由主分片写入，其他分片只修改配置文件，
+                # 由主分片收到通知后更新间隔、保存状态并重启定期更新任务
+                if _module_interface.is_primary_shard:
+                    _module_interface.save_state(_state)
+                    restart_periodic_update()
 
                 await message.reply_text(f"✅ 更新间隔已设置为 {interval} 秒")
             else:
@@ -747,17 +774,46 @@ async def setup(interface):
     if saved_state:
         _state.update(saved_state)
 
-    # 启动更新任务
-    _update_task = asyncio.create_task(periodic_update())
+    # 启动更新任务，分片模式下只在主分片上更新，其他分片通过状态通知获取汇率
+    if interface.is_primary_shard:
+        interface.set_task_limit(RATE_TASK_GROUP, 0)
+        _update_task = interface.spawn(periodic_update(),
+                                       name="periodic_update",
+                                       group=RATE_TASK_GROUP)
 
-    # 立即更新汇率数据
-    asyncio.create_task(update_exchange_rates())
+        # 立即更新汇率数据
+        interface.spawn(update_exchange_rates(), name="update_exchange_rates")
 
     interface.logger.info(
         f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化，更新间隔: {_state['update_interval']} 秒"
     )
 
 
+async def on_state_changed(interface):
+    """其他分片更新了汇率数据或配置，重新加载
+
+    Args:
+        interface: 模块接口
+    """
+    old_interval = _state["update_interval"]
+
+    # 汇率数据以主分片保存的状态为准，主分片自身不需要重新加载
+    if not interface.is_primary_shard:
+        saved_state = interface.load_state(default={})
+        if saved_state:
+            _state.update(saved_state)
+
+    # 更新间隔以配置文件为准（任何分片都可能修改）
+    config = load_config()
+    _state["update_interval"] = config.get("update_interval",
+                                           _state["update_interval"])
+
+    # 更新间隔变化时由主分片保存状态并重启定期更新任务
+    if interface.is_primary_shard and _state["update_interval"] != old_interval:
+        interface.save_state(_state)
+        restart_periodic_update()
+
+
 async def cleanup(interface):
     """模块清理
 
@@ -773,7 +829,8 @@ async def cleanup(interface):
         except asyncio.CancelledError:
             pass
 
-    # 保存状态到框架的状态管理中
-    interface.save_state(_state)
+    # 保存状态到框架的状态管理中（汇率数据只由主分片维护）
+    if interface.is_primary_shard:
+        interface.save_state(_state)
 
     interface.logger.info(f"模块 {MODULE_NAME} 已清理")
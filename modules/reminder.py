@@ -9,6 +9,7 @@ import pytz
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, MessageHandler, filters
+from utils.atomic_file import atomic_write_json
 
 # 模块元数据
 MODULE_NAME = "reminder"
@@ -16,10 +17,14 @@ MODULE_VERSION = "3.2.0"
 MODULE_DESCRIPTION = "周期性和一次性提醒功能"
 MODULE_COMMANDS = ["remind"]
 MODULE_CHAT_TYPES = ["private", "group"]  # 支持所有聊天类型
+MODULE_LAZY = False  # 后台定时发送提醒，不能按需加载
 
 # 按钮回调前缀
 CALLBACK_PREFIX = "reminder_"
 
+# 提醒任务的分组
+REMINDER_TASK_GROUP = "reminders"
+
 # 模块接口引用
 _module_interface = None
 
@@ -451,7 +456,7 @@ def get_all_reminders_dict():
 
 
 def save_reminders(interface, save_to_config=True):
-    """保存提醒数据（使用框架提供的 save_state 方法）
+    """保存提醒数据（使用框架提供的 update_state 方法）
 
     Args:
         interface: 模块接口
@@ -459,19 +464,32 @@ def save_reminders(interface, save_to_config=True):
     """
     try:
         # 获取所有提醒数据
-        reminders_data = get_all_reminders_dict()
-
-        # 使用框架提供的 save_state 方法保存数据
-        interface.save_state(reminders_data)
-
-        # 如果需要，同时保存到配置文件
-        if save_to_config:
-            config_file = "config/reminders.json"
-            os.makedirs(os.path.dirname(config_file), exist_ok=True)
-            with open(config_file, 'w', encoding='utf-8') as f:
-                json.dump(reminders_data, f, indent=2, ensure_ascii=False)
-
-        return True
+        local_data = get_all_reminders_dict()
+
+        def merge(saved_data):
+            # 分片模式下每个聊天的提醒只由负责该聊天的分片修改，
+            # 其他聊天以文件中的最新内容为准（未启用分片时全部使用内存中的数据）
+            reminders_data = {
+                chat_id: reminders
+                for chat_id, reminders in (saved_data or {}).items()
+                if not interface.owns_chat(chat_id)
+            }
+            reminders_data.update({
+                chat_id: reminders
+                for chat_id, reminders in local_data.items()
+                if interface.owns_chat(chat_id)
+            })
+
+            # 如果需要，同时保存到配置文件（在文件锁内写入，与状态文件保持一致）
+            if save_to_config:
+                config_file = "config/reminders.json"
+                os.makedirs(os.path.dirname(config_file), exist_ok=True)
+                atomic_write_json(config_file, reminders_data, indent=2,
+                                  ensure_ascii=False)
+            return reminders_data
+
+        # 在文件锁内读取、合并并保存
+        return interface.update_state(merge, default={}) is not None
     except Exception as e:
         interface.logger.error(f"保存提醒数据失败: {e}")
         return False
@@ -1049,13 +1067,17 @@ async def start_reminder_tasks(context, interface):
             if chat_id_str not in _tasks:
                 _tasks[chat_id_str] = {}
 
-            # 启动任务
-            task = asyncio.create_task(reminder.start_task(context, interface))
+            # 分片模式下只为本分片负责的聊天启动任务，其他聊天的提醒仅保留数据
+            task = None
+            if interface.owns_chat(chat_id_str):
+                task = interface.spawn(reminder.start_task(context, interface),
+                                       name=f"reminder_{reminder_id}",
+                                       group=REMINDER_TASK_GROUP)
+                task_count += 1
             _tasks[chat_id_str][reminder_id] = {
                 "reminder": reminder,
                 "task": task
             }
-            task_count += 1
 
     if task_count > 0:
         interface.logger.info(f"已启动 {task_count} 个提醒任务")
@@ -1066,6 +1088,39 @@ async def start_reminder_tasks(context, interface):
     save_reminders(interface)
 
 
+async def on_state_changed(interface):
+    """其他分片修改了提醒数据，更新不由本分片负责的聊天
+
+    Args:
+        interface: 模块接口
+    """
+    reminders_data = interface.load_state(default={}) or {}
+
+    # 移除其他分片已删除的聊天
+    for chat_id_str in list(_tasks.keys()):
+        if not interface.owns_chat(chat_id_str) and \
+                chat_id_str not in reminders_data:
+            del _tasks[chat_id_str]
+
+    for chat_id_str, chat_reminders in reminders_data.items():
+        if interface.owns_chat(chat_id_str):
+            continue
+
+        _tasks[chat_id_str] = {}
+        for reminder_id, reminder_data in chat_reminders.items():
+            if reminder_data.get("type", "periodic") == "one_time":
+                reminder = OneTimeReminder.from_dict(reminder_data)
+            else:
+                reminder = PeriodicReminder.from_dict(reminder_data)
+            _tasks[chat_id_str][reminder_id] = {
+                "reminder": reminder,
+                "task": None
+            }
+
+        if not _tasks[chat_id_str]:
+            del _tasks[chat_id_str]
+
+
 def stop_reminder_tasks(interface):
     """停止所有提醒任务"""
     interface.logger.debug("正在停止所有提醒任务...")
@@ -1266,7 +1321,9 @@ async def handle_reminder_input(update: Update,
                 _tasks[chat_id_str] = {}
 
             # 启动任务
-            task = asyncio.create_task(reminder.start_task(context, interface))
+            task = interface.spawn(reminder.start_task(context, interface),
+                                   name=f"reminder_{reminder_id}",
+                                   group=REMINDER_TASK_GROUP)
             _tasks[chat_id_str][reminder_id] = {
                 "reminder": reminder,
                 "task": task
@@ -1426,7 +1483,9 @@ async def handle_reminder_input(update: Update,
                 _tasks[chat_id_str] = {}
 
             # 启动任务
-            task = asyncio.create_task(reminder.start_task(context, interface))
+            task = interface.spawn(reminder.start_task(context, interface),
+                                   name=f"reminder_{reminder_id}",
+                                   group=REMINDER_TASK_GROUP)
             _tasks[chat_id_str][reminder_id] = {
                 "reminder": reminder,
                 "task": task
@@ -1813,6 +1872,9 @@ async def setup(interface):
     _tasks = {}
     _module_interface = interface
 
+    # 提醒任务会一直等待到提醒时间，不能限制并发数量
+    interface.set_task_limit(REMINDER_TASK_GROUP, 0)
+
     # 注册命令
     await interface.register_command("remind",
                                      remind_command,
@@ -12,6 +12,7 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, filters, MessageHandler
 from utils.formatter import TextFormatter
 from utils.pagination import PaginationHelper
+from utils.atomic_file import atomic_write_json, file_lock
 
 # 模块元数据
 MODULE_NAME = "rss"
@@ -19,6 +20,7 @@ MODULE_VERSION = "3.1.0"
 MODULE_DESCRIPTION = "RSS 订阅，智能间隔和健康监控"
 MODULE_COMMANDS = ["rss"]
 MODULE_CHAT_TYPES = ["private", "group"]  # 支持私聊和群组
+MODULE_LAZY = False  # 后台定时检查订阅，不能按需加载
 
 # 默认检查间隔配置
 DEFAULT_MIN_INTERVAL = 60  # 最小检查间隔（秒）
@@ -31,6 +33,9 @@ MAX_ENTRY_IDS = 100  # 每个源保存的最大条目 ID 数量
 # 按钮回调前缀
 CALLBACK_PREFIX = "rss_"
 
+# 定时检查任务分组（长期运行，不占用默认分组的并发名额）
+RSS_TASK_GROUP = "rss_check"
+
 # 会话状态
 SESSION_ADD_URL = "add_url"
 SESSION_ADD_TITLE = "add_title"
@@ -81,12 +86,69 @@ def load_config():
 
 
 # 保存配置
+def merge_config(saved_config, local_config):
+    """合并文件中的配置和内存中的配置
+
+    每个聊天的订阅只由负责该聊天的分片修改：本分片负责的聊天使用内存中的订阅，
+    其他聊天以文件为准；源信息只保留仍被订阅的源（未启用分片时结果与内存中的配置相同）
+
+    Args:
+        saved_config: 文件中的配置
+        local_config: 内存中的配置
+
+    Returns:
+        dict: 合并后的配置
+    """
+    subscriptions = {}
+    for chat_type in ("private", "group"):
+        merged = {
+            chat_id: urls
+            for chat_id, urls in saved_config.get("subscriptions", {}).get(
+                chat_type, {}).items()
+            if not _module_interface.owns_chat(chat_id)
+        }
+        merged.update({
+            chat_id: urls
+            for chat_id, urls in local_config["subscriptions"][chat_type].items()
+            if _module_interface.owns_chat(chat_id)
+        })
+        subscriptions[chat_type] = merged
+
+    subscribed = {
+        url
+        for chats in subscriptions.values() for urls in chats.values()
+        for url in urls
+    }
+    sources = {**saved_config.get("sources", {}), **local_config["sources"]}
+    return {
+        **local_config, "subscriptions": subscriptions,
+        "sources": {
+            url: info
+            for url, info in sources.items() if url in subscribed
+        }
+    }
+
+
 def save_config():
-    """保存 RSS 配置"""
+    """保存 RSS 配置
+
+    在文件锁内与文件中的最新配置合并后写入，分片模式下不会覆盖其他分片的修改
+    """
+    global _config
     try:
         os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(_config, f, ensure_ascii=False, indent=2)
+        with file_lock(CONFIG_FILE):
+            if _module_interface and os.path.exists(CONFIG_FILE):
+                try:
+                    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                        _config = merge_config(json.load(f), _config)
+                except json.JSONDecodeError as e:
+                    _module_interface.logger.warning(f"RSS 配置文件格式错误，将被覆盖: {e}")
+            atomic_write_json(CONFIG_FILE, _config, ensure_ascii=False,
+                              indent=2)
+        # 通知其他分片重新加载订阅
+        if _module_interface:
+            _module_interface.notify_state_changed()
         return True
     except Exception as e:
         _module_interface.logger.error(f"保存 RSS 配置失败: {e}")
@@ -623,8 +685,10 @@ async def handle_add_title(update: Update,
                                  reply_markup=reply_markup,
                                  parse_mode="HTML")
 
-    # 异步获取 feed 内容并初始化条目 ID
-    asyncio.create_task(initialize_feed_entries(url, _module_interface))
+    # 异步获取 feed 内容并初始化条目 ID（其他分片由主分片在收到通知后初始化）
+    if _module_interface.is_primary_shard:
+        _module_interface.spawn(initialize_feed_entries(url, _module_interface),
+                                name="initialize_feed_entries")
 
 
 async def initialize_feed_entries(url, interface):
@@ -736,9 +800,11 @@ async def check_updates(module_interface):
                         continue
 
                     # 创建检查任务
-                    task = asyncio.create_task(
-                        check_feed(url, source_info, module_interface))
-                    tasks.append(task)
+                    task = module_interface.spawn(
+                        check_feed(url, source_info, module_interface),
+                        name="check_feed")
+                    if task:
+                        tasks.append(task)
 
                 # 等待所有任务完成
                 if tasks:
@@ -1512,13 +1578,30 @@ async def setup(interface):
         handle_message)
     await interface.register_handler(message_handler, group=6)
 
-    # 创建启动任务，先初始化再启动检查
-    await initialize_entry_ids(interface)
-    _check_task = asyncio.create_task(check_updates(interface))
+    # 创建启动任务，先初始化再启动检查（分片模式下只在主分片上检查）
+    if interface.is_primary_shard:
+        await initialize_entry_ids(interface)
+        interface.set_task_limit(RSS_TASK_GROUP, 0)
+        _check_task = interface.spawn(check_updates(interface),
+                                      name="check_updates",
+                                      group=RSS_TASK_GROUP)
 
     interface.logger.info(f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化")
 
 
+async def on_state_changed(interface):
+    """其他分片修改了订阅，重新加载配置"""
+    load_config()
+    interface.logger.debug("已重新加载 RSS 订阅配置")
+
+    # 主分片为新增的源初始化条目 ID，之后才会开始检查
+    if interface.is_primary_shard:
+        for url in _config["sources"]:
+            if not _state["last_entry_ids"].get(url):
+                interface.spawn(initialize_feed_entries(url, interface),
+                                name="initialize_feed_entries")
+
+
 async def cleanup(interface):
     """模块清理"""
     global _check_task
@@ -1534,7 +1617,8 @@ async def cleanup(interface):
         except Exception as e:
             interface.logger.error(f"RSS 检查任务取消时出错: {e}")
 
-    # 保存状态到框架的状态管理中
-    interface.save_state(_state)
+    # 保存状态到框架的状态管理中（状态只由主分片维护）
+    if interface.is_primary_shard:
+        interface.save_state(_state)
 
     interface.logger.info(f"模块 {MODULE_NAME} 已清理完成")
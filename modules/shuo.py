@@ -9,6 +9,7 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, MessageHandler, filters
 from utils.formatter import TextFormatter
 from utils.pagination import PaginationHelper
+from utils.atomic_file import SharedJsonFile
 
 # 模块元数据
 MODULE_NAME = "shuo"
@@ -19,6 +20,7 @@ MODULE_CHAT_TYPES = ["private"]  # 仅限私聊使用
 
 # 模块配置文件路径
 CONFIG_FILE = "config/shuo_config.json"
+_config_file = SharedJsonFile(CONFIG_FILE)  # 分片之间合并写入
 
 # 按钮回调前缀
 CALLBACK_PREFIX = "shuo_"
@@ -50,8 +52,7 @@ def load_config():
     global _config
     try:
         if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                _config = json.load(f)
+            _config = _config_file.load()
         else:
             _config = DEFAULT_CONFIG.copy()
             save_config()
@@ -61,17 +62,42 @@ def load_config():
 
 
 def save_config():
-    """保存说说模块配置"""
+    """保存说说模块配置
+
+    与文件中的最新配置合并后写入并通知其他分片，分片模式下不会覆盖其他分片的修改
+    """
+    global _config
     try:
         os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(_config, f, ensure_ascii=False, indent=2)
+        _config = _config_file.save(_config, ensure_ascii=False, indent=2)
+        _module_interface.notify_state_changed()
         return True
     except Exception as e:
         _module_interface.logger.error(f"保存说说模块配置失败: {e}")
         return False
 
 
+def next_key():
+    """递增并保存 last_key
+
+    Returns:
+        int: 新的 key
+    """
+    global _config
+
+    def increment(config):
+        config["last_key"] = config.get("last_key", 0) + 1
+        return config
+
+    os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
+    _config = _config_file.update(increment,
+                                  default=dict(_config),
+                                  ensure_ascii=False,
+                                  indent=2)
+    _module_interface.notify_state_changed()
+    return _config["last_key"]
+
+
 # 命令处理函数
 async def shuo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """发布说说命令处理函数"""
@@ -137,9 +163,9 @@ async def publish_shuo(update: Update, _: ContextTypes.DEFAULT_TYPE,
         if json_data is None:
             json_data = []
 
-        # 递增 key (使用配置中的 last_key)
-        _config["last_key"] += 1
-        save_config()  # 保存配置，确保 key 持久化
+        # 递增 key (使用配置中的 last_key)，在文件锁内基于文件中的值递增，
+        # 分片模式下不会生成重复的 key
+        next_key()
 
         # 创建新的说说对象
         new_post = {
@@ -875,6 +901,11 @@ async def setup(interface):
     interface.logger.info(f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化")
 
 
+async def on_state_changed(interface):
+    """其他分片修改了配置，重新加载"""
+    load_config()
+
+
 async def cleanup(interface):
     """模块清理"""
     # 保存状态
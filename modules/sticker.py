@@ -1,7 +1,6 @@
 # modules/sticker.py - 贴纸管理模块
 
 import os
-import json
 import uuid
 import asyncio
 import tempfile
@@ -10,6 +9,7 @@ from telegram.ext import ContextTypes, MessageHandler, filters
 
 # 导入图像处理库
 from PIL import Image
+from utils.atomic_file import SharedJsonFile
 
 try:
     from lottie.parsers.tgs import parse_tgs
@@ -23,9 +23,11 @@ MODULE_VERSION = "2.1.0"
 MODULE_DESCRIPTION = "下载贴纸，支持自建贴纸包"
 MODULE_COMMANDS = ["sticker"]
 MODULE_CHAT_TYPES = ["private"]  # 仅限私聊使用
+MODULE_LAZY_TRIGGERS = ["sticker"]  # 私聊中收到贴纸时也会加载模块
 
 # 配置和状态管理
 CONFIG_FILE = "config/stickers.json"
+_config_file = SharedJsonFile(CONFIG_FILE)  # 分片之间合并写入
 DEFAULT_CONFIG = {
     "image_format": "PNG",
     "gif_quality": "high",
@@ -57,8 +59,8 @@ def _store_sticker_id(file_id):
     _sticker_id_map[short_id] = file_id
     _id_map_modified = True
 
-    # 创建保存配置的异步任务
-    asyncio.create_task(_save_config())
+    # 在后台保存配置
+    _interface.spawn(_save_config(), name="save_config")
     return short_id
 
 
@@ -108,6 +110,17 @@ async def setup(interface):
     interface.logger.info(f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化")
 
 
+async def flush(interface):
+    """保存尚未写入的贴纸 ID 映射（停止前调用）"""
+    if _id_map_modified:
+        await _save_config()
+
+
+async def on_state_changed(interface):
+    """其他分片修改了配置，重新加载"""
+    _load_config()
+
+
 async def cleanup(interface):
     """模块清理函数"""
     global _interface
@@ -127,15 +140,13 @@ def _load_config():
     """从文件加载配置"""
     global user_configs, user_sticker_sets, _sticker_id_map
 
-    if not os.path.exists(CONFIG_FILE):
-        return
-
     try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            user_configs = data.get("configs", {})
-            user_sticker_sets = data.get("sticker_sets", {})
-            _sticker_id_map = data.get("sticker_id_map", {})
+        data = _config_file.load()
+        if data is None:
+            return
+        user_configs = data.get("configs", {})
+        user_sticker_sets = data.get("sticker_sets", {})
+        _sticker_id_map = data.get("sticker_id_map", {})
 
         _interface.logger.debug(f"贴纸配置已从 {CONFIG_FILE} 加载")
     except Exception as e:
@@ -143,7 +154,10 @@ def _load_config():
 
 
 async def _save_config():
-    """保存配置到文件"""
+    """保存配置到文件
+
+    与文件中的最新配置合并后写入，分片模式下不会覆盖其他分片的修改
+    """
     global user_configs, user_sticker_sets, _sticker_id_map, _id_map_modified
 
     async with _state_lock:
@@ -151,24 +165,26 @@ async def _save_config():
             # 确保目录存在
             os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
 
-            # 准备保存数据
-            data = {"configs": user_configs, "sticker_sets": user_sticker_sets}
+            # 只保留最近 500 个映射
+            if _id_map_modified and len(_sticker_id_map) > 500:
+                items = list(_sticker_id_map.items())[-500:]
+                _sticker_id_map = dict(items)
+            _id_map_modified = False
 
-            # 只在必要时保存映射表
-            if _id_map_modified:
-                # 只保留最近 500 个映射
-                if len(_sticker_id_map) > 500:
-                    items = list(_sticker_id_map.items())[-500:]
-                    _sticker_id_map = dict(items)
-
-                data["sticker_id_map"] = _sticker_id_map
-                _id_map_modified = False
+            # 准备保存数据（映射表始终写入，缺少时合并会当作删除）
+            data = {
+                "configs": user_configs,
+                "sticker_sets": user_sticker_sets,
+                "sticker_id_map": _sticker_id_map
+            }
 
-            # 保存到文件
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # 保存到文件，合并后的数据可能包含其他分片的修改
+            saved = _config_file.save(data, ensure_ascii=False, indent=2)
+            user_configs = saved.get("configs", {})
+            user_sticker_sets = saved.get("sticker_sets", {})
+            _sticker_id_map = saved.get("sticker_id_map", {})
 
-            # 同时保存到框架的状态管理中
+            # 同时保存到框架的状态管理中（通知其他分片重新加载）
             _interface.save_state({
                 "configs": user_configs,
                 "sticker_sets": user_sticker_sets
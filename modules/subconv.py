@@ -1,12 +1,13 @@
 # modules/subconv.py - 订阅转换模块
 
-import json
+import copy
 import os
 import subprocess
 import urllib.parse
 from io import BytesIO
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import ContextTypes, MessageHandler, filters
+from utils.atomic_file import SharedJsonFile
 
 # 模块元数据
 MODULE_NAME = "subconv"
@@ -17,6 +18,7 @@ MODULE_CHAT_TYPES = ["private"]
 
 # 模块配置文件
 CONFIG_FILE = "config/subconv.json"
+_config_file = SharedJsonFile(CONFIG_FILE)  # 分片之间合并写入
 
 # 按钮回调前缀
 CALLBACK_PREFIX = "subconv_"
@@ -105,6 +107,7 @@ _config = DEFAULT_CONFIG.copy()
 _state = {
     "user_configs": {}  # 用户配置，格式: {user_id: {配置项}}
 }
+_saved_state = None  # 上次加载或保存的状态（合并保存时使用）
 
 
 def load_config():
@@ -112,14 +115,13 @@ def load_config():
     global _config
     try:
         if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                loaded_config = json.load(f)
-                # 合并配置，确保所有默认配置项都存在
-                for key in DEFAULT_CONFIG:
-                    if key not in loaded_config:
-                        loaded_config[key] = DEFAULT_CONFIG[key]
-                _config = loaded_config
-                _module_interface.logger.debug(f"已加载配置文件: {CONFIG_FILE}")
+            loaded_config = _config_file.load()
+            # 合并配置，确保所有默认配置项都存在
+            for key in DEFAULT_CONFIG:
+                if key not in loaded_config:
+                    loaded_config[key] = DEFAULT_CONFIG[key]
+            _config = loaded_config
+            _module_interface.logger.debug(f"已加载配置文件: {CONFIG_FILE}")
         else:
             # 配置文件不存在，创建默认配置
             save_config()
@@ -129,18 +131,34 @@ def load_config():
 
 
 def save_config():
-    """保存配置文件"""
+    """保存配置文件
+
+    与文件中的最新配置合并后写入并通知其他分片，分片模式下不会覆盖其他分片的修改
+    """
+    global _config
     try:
         # 确保配置目录存在
         os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(_config, f, ensure_ascii=False, indent=2)
+        _config = _config_file.save(_config, ensure_ascii=False, indent=2)
+        _module_interface.notify_state_changed()
         return True
     except Exception as e:
         _module_interface.logger.error(f"保存配置文件失败: {e}")
         return False
 
 
+def save_state():
+    """保存非超级管理员的用户配置到框架状态
+
+    与文件中的最新状态合并后写入，分片模式下不会覆盖其他分片的修改
+    """
+    global _saved_state
+    saved = _module_interface.merge_state(_state, _saved_state)
+    if saved is not None:
+        _state["user_configs"] = saved.get("user_configs", {})
+        _saved_state = copy.deepcopy(saved)
+
+
 def get_user_config(user_id):
     """获取用户配置，如果是超级管理员则从永久配置获取，否则从框架状态获取"""
     user_id_str = str(user_id)
@@ -171,7 +189,7 @@ def save_user_config(user_id, config_data):
         # 保存到框架状态
         _state["user_configs"][user_id_str] = config_data
         # 保存状态到框架
-        _module_interface.save_state(_state)
+        save_state()
 
 
 def generate_subscription_link(backend_url,
@@ -1331,7 +1349,7 @@ async def show_target_selection(update: Update,
 
 async def setup(interface):
     """模块初始化"""
-    global _module_interface, _state
+    global _module_interface, _state, _saved_state
     _module_interface = interface
 
     # 加载配置
@@ -1341,6 +1359,7 @@ async def setup(interface):
     saved_state = interface.load_state(default={"user_configs": {}})
     if saved_state:
         _state.update(saved_state)
+    _saved_state = copy.deepcopy(saved_state)
 
     # 注册命令
     await interface.register_command(
@@ -1365,8 +1384,17 @@ async def setup(interface):
     interface.logger.info(f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化")
 
 
+async def on_state_changed(interface):
+    """其他分片修改了配置或用户配置，重新加载"""
+    global _saved_state
+    load_config()
+    saved_state = interface.load_state(default={"user_configs": {}})
+    _state["user_configs"] = saved_state.get("user_configs", {})
+    _saved_state = copy.deepcopy(saved_state)
+
+
 async def cleanup(interface):
     """模块清理，在卸载模块前调用"""
     # 保存状态到框架
-    interface.save_state(_state)
+    save_state()
     interface.logger.info(f"模块 {MODULE_NAME} 已清理")
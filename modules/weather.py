@@ -1,13 +1,14 @@
 # modules/weather.py - 天气查询模块
 
 import aiohttp
-import json
+import copy
 import os
 import asyncio
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from utils.weather_icons import get_weather_icon, get_wind_direction, get_caiyun_description, WIND_ICONS
+from utils.atomic_file import SharedJsonFile
 
 # 模块元数据
 MODULE_NAME = "weather"
@@ -25,6 +26,9 @@ _state = {
     "cache_time": {}  # 缓存时间
 }
 
+# 上次加载或保存的用户位置状态（合并保存时使用）
+_saved_state = None
+
 # 模块接口
 _module_interface = None
 
@@ -70,9 +74,13 @@ WEATHER_SOURCES = {
 
 # 配置文件路径
 CONFIG_FILE = "config/weather_config.json"
+_config_file = SharedJsonFile(CONFIG_FILE)  # 分片之间合并写入
 # 缓存过期时间（分钟）
 CACHE_EXPIRY = 30
 
+# 定期清理缓存的任务分组（长期运行，不占用默认分组的并发名额）
+WEATHER_TASK_GROUP = "weather_cleanup"
+
 # 回调前缀
 CALLBACK_PREFIX = "weather_"
 
@@ -524,6 +532,7 @@ async def set_weather_source(update: Update,
 
     # 设置默认天气源
     _state["active_source"] = source
+    save_config()
 
     _module_interface.logger.info(
         f"用户 {update.effective_user.id} 将默认天气源设置为 {WEATHER_SOURCES[source]['name']}"
@@ -636,6 +645,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # 设置 API 密钥
         _state["api_keys"][source] = api_key
+        save_config()
 
         # 记录设置操作，但不记录 API 密钥
         _module_interface.logger.info(
@@ -1211,30 +1221,59 @@ def cleanup_cache():
 
 
 # 模块接口函数
+def load_config():
+    """从文件加载天气源和 API 密钥"""
+    try:
+        config_data = _config_file.load()
+        if config_data is None:
+            return
+
+        if "active_source" in config_data:
+            _state["active_source"] = config_data["active_source"]
+
+        if "api_keys" in config_data:
+            _state["api_keys"] = config_data["api_keys"]
+
+        _module_interface.logger.debug("已从文件加载天气模块配置")
+    except Exception as e:
+        _module_interface.logger.error(f"加载天气配置失败: {e}")
+
+
+def save_config():
+    """保存天气源和 API 密钥
+
+    与文件中的最新配置合并后写入并通知其他分片，分片模式下不会覆盖其他分片的修改
+    """
+    try:
+        os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
+
+        config_data = {
+            "active_source": _state["active_source"],
+            "api_keys": _state["api_keys"]
+        }
+
+        saved = _config_file.save(config_data, indent=2)
+        _state["active_source"] = saved.get("active_source",
+                                            _state["active_source"])
+        _state["api_keys"] = saved.get("api_keys", {})
+        _module_interface.notify_state_changed()
+
+        _module_interface.logger.debug("天气模块配置已保存")
+    except Exception as e:
+        _module_interface.logger.error(f"保存天气配置失败: {e}")
+
+
 async def setup(interface):
     """模块初始化
 
     Args:
         interface: 模块接口
     """
-    global _module_interface
+    global _module_interface, _saved_state
     _module_interface = interface
 
     # 加载配置文件
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                config_data = json.load(f)
-
-                if "active_source" in config_data:
-                    _state["active_source"] = config_data["active_source"]
-
-                if "api_keys" in config_data:
-                    _state["api_keys"] = config_data["api_keys"]
-
-            interface.logger.debug("已从文件加载天气模块配置")
-    except Exception as e:
-        interface.logger.error(f"加载天气配置失败: {e}")
+    load_config()
 
     # 注册命令
     await interface.register_command("weather",
@@ -1264,8 +1303,10 @@ async def setup(interface):
         & ~filters.Regex(r'^/'), handle_message)
     await interface.register_handler(message_handler, group=9)
 
-    # 加载状态
-    interface.load_state(default={})
+    # 加载用户位置
+    saved_state = interface.load_state(default={})
+    _state["user_locations"].update(saved_state.get("user_locations", {}))
+    _saved_state = copy.deepcopy(saved_state)
 
     # 启动定期清理缓存的任务
     async def cleanup_task():
@@ -1276,11 +1317,19 @@ async def setup(interface):
                 interface.logger.debug(f"已清理 {cleaned} 条过期天气缓存")
 
     # 创建清理任务
-    interface.cleanup_task = asyncio.create_task(cleanup_task())
+    interface.set_task_limit(WEATHER_TASK_GROUP, 0)
+    interface.cleanup_task = interface.spawn(cleanup_task(),
+                                             name="cleanup_cache",
+                                             group=WEATHER_TASK_GROUP)
 
     interface.logger.info(f"模块 {MODULE_NAME} v{MODULE_VERSION} 已初始化")
 
 
+async def on_state_changed(interface):
+    """其他分片修改了天气源或 API 密钥，重新加载"""
+    load_config()
+
+
 async def cleanup(interface):
     """模块清理
 
@@ -1296,28 +1345,9 @@ async def cleanup(interface):
             pass
 
     # 保存配置文件
-    try:
-        os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-
-        config_data = {
-            "active_source": _state["active_source"],
-            "api_keys": _state["api_keys"]
-        }
-
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, indent=2)
-
-        interface.logger.debug("天气模块配置已保存")
-    except Exception as e:
-        interface.logger.error(f"保存天气配置失败: {e}")
-
-    # 保存用户位置
-    state_copy = _state.copy()
-    # 移除缓存相关数据，避免存储大量临时数据
-    if "cache" in state_copy:
-        del state_copy["cache"]
-    if "cache_time" in state_copy:
-        del state_copy["cache_time"]
+    save_config()
 
-    interface.save_state(state_copy)
+    # 保存用户位置（与其他分片保存的位置合并）
+    interface.merge_state({"user_locations": _state["user_locations"]},
+                          _saved_state)
     interface.logger.info(f"模块 {MODULE_NAME} 已清理")
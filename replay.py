@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# replay.py - 录制流量回放工具
+
+import sys
+import time
+import json
+import argparse
+import asyncio
+from collections import defaultdict
+from telegram import Update
+from telegram.request import BaseRequest
+from core.bot_engine import BotEngine
+from utils.logger import setup_logger
+from utils import event_loop
+from utils.traffic_recorder import iter_capture
+
+
+class FakeRequest(BaseRequest):
+    """假的 Bot API 请求对象，不访问网络，返回最小可用的响应"""
+
+    def __init__(self, bot_id, api_calls):
+        """初始化假请求
+
+        Args:
+            bot_id: 假 Bot 的用户 ID
+            api_calls: 按方法统计调用次数的字典（多个实例共享）
+        """
+        self.bot_id = bot_id
+        self.api_calls = api_calls
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self,
+                         url,
+                         method,
+                         request_data=None,
+                         read_timeout=None,
+                         write_timeout=None,
+                         connect_timeout=None,
+                         pool_timeout=None):
+        """返回伪造的 API 响应"""
+        # 文件下载直接返回空内容
+        if "/file/bot" in url:
+            self.api_calls["downloadFile"] += 1
+            return 200, b""
+
+        api_method = url.rsplit("/", 1)[-1]
+        self.api_calls[api_method] += 1
+        params = request_data.parameters if request_data else {}
+
+        payload = {"ok": True, "result": self._fake_result(api_method, params)}
+        return 200, json.dumps(payload).encode("utf-8")
+
+    def _bot_user(self):
+        return {
+            "id": self.bot_id,
+            "is_bot": True,
+            "first_name": "Replay",
+            "username": "replay_bot",
+            "can_join_groups": True,
+            "can_read_all_group_messages": True,
+            "supports_inline_queries": False
+        }
+
+    @staticmethod
+    def _chat(chat_id):
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = 0
+        chat_type = "supergroup" if chat_id < 0 else "private"
+        chat = {"id": chat_id, "type": chat_type}
+        if chat_type == "supergroup":
+            chat["title"] = "Replay"
+        else:
+            chat["first_name"] = "Replay"
+        return chat
+
+    def _message(self, params):
+        self._message_id += 1
+        return {
+            "message_id": params.get("message_id", self._message_id),
+            "date": int(time.time()),
+            "chat": self._chat(params.get("chat_id", 0)),
+            "from": self._bot_user(),
+            "text": params.get("text") or params.get("caption") or ""
+        }
+
+    def _fake_result(self, api_method, params):
+        """根据 API 方法构造返回结果"""
+        if api_method == "getMe":
+            return self._bot_user()
+        if api_method == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media", [])]
+        if api_method.startswith(("send", "copyMessage", "forwardMessage")):
+            return self._message(params)
+        if api_method.startswith("edit"):
+            return True if "inline_message_id" in params else self._message(
+                params)
+        if api_method == "getFile":
+            return {
+                "file_id": params.get("file_id", ""),
+                "file_unique_id": "replay",
+                "file_size": 0,
+                "file_path": "replay/file"
+            }
+        if api_method == "getChat":
+            chat = self._chat(params.get("chat_id", 0))
+            chat["accent_color_id"] = 0
+            chat["max_reaction_count"] = 0
+            return chat
+        if api_method == "getChatMember":
+            return {
+                "status": "member",
+                "user": {
+                    "id": int(params.get("user_id", 0)),
+                    "is_bot": False,
+                    "first_name": "Replay"
+                }
+            }
+        if api_method == "getUpdates":
+            return []
+        return True
+
+
+def percentile(values, pct):
+    """计算百分位数
+
+    Args:
+        values: 已排序的数值列表
+        pct: 百分位（0-100）
+
+    Returns:
+        float: 百分位数值
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * pct / 100))
+    return values[index]
+
+
+def get_update_type(update_data):
+    """获取更新类型（除 update_id 外的第一个字段）"""
+    for key in update_data:
+        if key != "update_id":
+            return key
+    return "unknown"
+
+
+async def replay_async(args):
+    """回放主函数"""
+    logger = setup_logger("Replay", args.log_level)
+
+    api_calls = defaultdict(int)
+
+    # 使用假请求创建 Bot 引擎，不会访问 Telegram，也不录制回放的更新
+    bot = BotEngine(config_dir=args.config, record_traffic=False)
+    bot_id = int(bot.token.split(":")[0]) if bot.token.split(
+        ":")[0].isdigit() else 1
+    bot.request = FakeRequest(bot_id, api_calls)
+    bot.get_updates_request = FakeRequest(bot_id, api_calls)
+
+    await bot.initialize()
+    await bot.start(fetch_updates=False)
+
+    application = bot.application
+    latencies = defaultdict(list)
+    count = 0
+    errors = 0
+
+    speed = None if args.speed == "max" else float(args.speed)
+    first_ts = None
+    start = time.perf_counter()
+
+    try:
+        for ts, update_data in iter_capture(args.captures):
+            # 按原始时间间隔（或加速后的间隔）调度
+            if speed:
+                if first_ts is None:
+                    first_ts = ts
+                target = start + (ts - first_ts) / speed
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            try:
+                update = Update.de_json(update_data, application.bot)
+            except Exception as e:
+                errors += 1
+                logger.warning(f"无法解析更新: {e}")
+                continue
+
+            t0 = time.perf_counter()
+            await application.process_update(update)
+            latencies[get_update_type(update_data)].append(
+                time.perf_counter() - t0)
+            count += 1
+
+            if args.limit and count >= args.limit:
+                break
+    finally:
+        elapsed = time.perf_counter() - start
+        await bot.stop()
+
+    # 输出报告
+    print(f"\n回放完成: {count} 个更新，耗时 {elapsed:.2f} 秒，"
+          f"吞吐 {count / elapsed if elapsed else 0:.1f} 更新/秒，解析失败 {errors} 个")
+    print(f"事件循环: {event_loop.get_loop_name()}")
+    print("\n处理延迟 (毫秒):")
+    print(f"{'类型':<24}{'数量':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    all_values = []
+    for update_type, values in sorted(latencies.items()):
+        values.sort()
+        all_values.extend(values)
+        print(f"{update_type:<24}{len(values):>8}"
+              f"{percentile(values, 50) * 1000:>10.2f}"
+              f"{percentile(values, 95) * 1000:>10.2f}"
+              f"{percentile(values, 99) * 1000:>10.2f}"
+              f"{values[-1] * 1000:>10.2f}")
+    all_values.sort()
+    if all_values:
+        print(f"{'total':<24}{len(all_values):>8}"
+              f"{percentile(all_values, 50) * 1000:>10.2f}"
+              f"{percentile(all_values, 95) * 1000:>10.2f}"
+              f"{percentile(all_values, 99) * 1000:>10.2f}"
+              f"{all_values[-1] * 1000:>10.2f}")
+
+    print("\nBot API 调用:")
+    for api_method, calls in sorted(api_calls.items(),
+                                    key=lambda x: x[1],
+                                    reverse=True):
+        print(f"  {api_method:<28}{calls:>8}")
+
+    return 0
+
+
+def main():
+    """入口点函数"""
+    parser = argparse.ArgumentParser(
+        description="回放录制的更新流量（使用假 Bot，不会访问 Telegram）")
+    parser.add_argument("captures", nargs="+", help="录制文件路径（按顺序回放）")
+    parser.add_argument("--config",
+                        help="配置目录路径（建议使用单独的副本）",
+                        default="config")
+    parser.add_argument("--speed",
+                        help="回放速度: 1 为原始速度，10 为十倍速，max 为不等待",
+                        default="max")
+    parser.add_argument("--limit", type=int, help="最多回放的更新数量", default=0)
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        help="日志级别",
+        default="WARNING")
+    parser.add_argument("--loop",
+                        choices=event_loop.LOOP_CHOICES,
+                        help="事件循环实现，用于比较 uvloop 和 asyncio 的性能",
+                        default="asyncio")
+    args = parser.parse_args()
+
+    if args.speed != "max":
+        try:
+            if float(args.speed) <= 0:
+                raise ValueError
+        except ValueError:
+            parser.error("--speed 必须是正数或 max")
+
+    return event_loop.run(replay_async(args), args.loop)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
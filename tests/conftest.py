@@ -0,0 +1,7 @@
+# tests/conftest.py - 测试配置
+
+import os
+import sys
+
+# 让测试可以直接导入项目中的 core、utils 和 modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,73 @@
+# tests/test_ai_cache.py - AI 响应缓存键测试
+
+import asyncio
+
+import pytest
+
+import modules.ai as ai
+from modules.ai import SUMMARY_PREFIX, ResponseCache
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setitem(ai._state, "response_cache", {})
+    monkeypatch.setitem(ai._state, "providers", {
+        "a": {"model": "model-a"},
+        "b": {"model": "model-b"}
+    })
+    return ResponseCache(str(tmp_path / "cache.json"))
+
+
+def _messages(*contents):
+    messages = [{"role": "system", "content": "prompt"}]
+    for index, content in enumerate(contents):
+        role = "user" if index % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": content})
+    return messages
+
+
+def test_make_key_normalizes_whitespace(cache):
+    assert cache.make_key("a", _messages("hello  world\n"), None) == \
+        cache.make_key("a", _messages(" hello world"), None)
+
+
+def test_make_key_depends_on_provider_content_and_images(cache):
+    key = cache.make_key("a", _messages("hello"), None)
+    assert key != cache.make_key("b", _messages("hello"), None)
+    assert key != cache.make_key("a", _messages("hello!"), None)
+
+    image = {"data": "aGVsbG8=", "sha256": "abc"}
+    with_image = cache.make_key("a", _messages("hello"), [image])
+    assert with_image != key
+    assert with_image == cache.make_key("a", _messages("hello"), [dict(image)])
+
+
+def test_make_key_bypasses_conversation_context(cache):
+    assert cache.make_key("a", _messages("q", "a", "q2"), None) is None
+
+    summary = [{"role": "system", "content": SUMMARY_PREFIX + "..."}]
+    assert cache.make_key("a", summary + _messages("q"), None) is None
+    assert cache.stats["bypassed"] == 2
+
+
+def test_make_key_with_context_enabled(cache):
+    cache.settings["include_context"] = True
+    assert cache.make_key("a", _messages("q", "a", "q2"), None) is not None
+
+
+def test_shards_write_own_files_and_load_all(cache, tmp_path):
+    cache.settings.update({"ttl": 3600, "max_entries": 10,
+                           "max_bytes": 1024})
+    primary = ResponseCache(str(tmp_path / "cache.json"), 0)
+    worker = ResponseCache(str(tmp_path / "cache.json"), 1)
+    primary.put("a", "answer a")
+    worker.put("b", "answer b")
+    asyncio.run(primary.save())
+    asyncio.run(worker.save())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cache.1.json",
+                                                          "cache.json"]
+
+    restarted = ResponseCache(str(tmp_path / "cache.json"), 1)
+    assert restarted.load() == 2
+    assert restarted.get("a") == "answer a"
+    assert restarted.get("b") == "answer b"
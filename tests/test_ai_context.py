@@ -0,0 +1,72 @@
+# tests/test_ai_context.py - AI 上下文裁剪测试
+
+import logging
+import types
+
+import pytest
+
+import modules.ai as ai
+from modules.ai import ConversationManager, estimate_tokens
+
+
+@pytest.fixture(autouse=True)
+def interface(monkeypatch):
+    monkeypatch.setattr(ai, "_interface",
+                        types.SimpleNamespace(logger=logging.getLogger("ai")))
+
+
+def _msg(role, content):
+    return {"role": role, "content": content}
+
+
+def _cost(*messages):
+    return sum(estimate_tokens(msg["content"], "openai") for msg in messages)
+
+
+def test_trim_keeps_everything_within_budget():
+    messages = [_msg("system", "prompt"), _msg("user", "hi"),
+                _msg("assistant", "hello"), _msg("user", "how are you")]
+    assert ConversationManager.trim_to_budget(messages, "openai",
+                                              10_000) == messages
+
+
+def test_trim_drops_oldest_messages_and_keeps_system():
+    system = _msg("system", "prompt")
+    old = [_msg("user", "old question " * 50),
+           _msg("assistant", "old answer " * 50)]
+    recent = [_msg("user", "question"), _msg("assistant", "answer"),
+              _msg("user", "latest")]
+    budget = _cost(system, *recent) + 1
+
+    trimmed = ConversationManager.trim_to_budget([system] + old + recent,
+                                                 "openai", budget)
+    assert trimmed == [system] + recent
+
+
+def test_trim_starts_context_with_user_message():
+    system = _msg("system", "prompt")
+    messages = [system, _msg("user", "first " * 50),
+                _msg("assistant", "reply"), _msg("user", "latest")]
+    # 预算只够保留助手回复和最新提问，开头的助手回复也要去掉
+    budget = _cost(system, *messages[2:]) + 1
+
+    trimmed = ConversationManager.trim_to_budget(messages, "openai", budget)
+    assert trimmed == [system, messages[-1]]
+
+
+def test_trim_always_keeps_latest_message():
+    messages = [_msg("system", "prompt"), _msg("user", "long " * 1000)]
+    assert ConversationManager.trim_to_budget(messages, "openai",
+                                              10) == messages
+
+
+def test_estimate_cache_does_not_keep_text(monkeypatch):
+    monkeypatch.setitem(ai._state, "wide_char_counts", ai.OrderedDict())
+    text = "你好 hello " * 10
+    first = estimate_tokens(text, "openai")
+    assert estimate_tokens(text, "openai") == first
+    assert estimate_tokens(text, "anthropic") != first
+
+    counts = ai._state["wide_char_counts"]
+    assert len(counts) == 1
+    assert not any(isinstance(part, str) for key in counts for part in key)
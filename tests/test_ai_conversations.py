@@ -0,0 +1,75 @@
+# tests/test_ai_conversations.py - AI 对话记录跨分片保存测试
+
+import asyncio
+import logging
+import types
+
+import pytest
+
+import modules.ai as ai
+from modules.ai import ConversationStore
+
+
+@pytest.fixture(autouse=True)
+def interface(monkeypatch):
+    monkeypatch.setattr(ai, "_interface",
+                        types.SimpleNamespace(logger=logging.getLogger("ai")))
+
+
+def _contents(messages):
+    return [content for _, content, _ in messages]
+
+
+def test_shards_keep_each_others_messages(tmp_path):
+    async def main():
+        # 同一用户的私聊和群聊由两个分片处理
+        private = ConversationStore(str(tmp_path))
+        group = ConversationStore(str(tmp_path))
+        private.append("1", "user", "private question", 10)
+        group.append("1", "user", "group question", 10)
+        await private.close()
+        await group.close()
+
+        assert _contents(private.get("1")) == ["private question",
+                                               "group question"]
+        assert _contents(ConversationStore(str(tmp_path)).get("1")) == \
+            ["private question", "group question"]
+
+    asyncio.run(main())
+
+
+def test_clear_on_other_shard_keeps_new_messages(tmp_path):
+    async def main():
+        private = ConversationStore(str(tmp_path))
+        group = ConversationStore(str(tmp_path))
+        private.append("1", "user", "old", 10)
+        await private.close()
+
+        group.get("1")
+        group.append("1", "user", "new", 10)
+        # 群聊的新消息保存之前，私聊中清除了对话
+        private.clear("1")
+        await private.close()
+        await group.close()
+
+        assert _contents(group.get("1")) == ["new"]
+        assert _contents(private.get("1")) == ["new"]
+
+    asyncio.run(main())
+
+
+def test_reload_keeps_message_objects(tmp_path):
+    async def main():
+        private = ConversationStore(str(tmp_path))
+        group = ConversationStore(str(tmp_path))
+        message = private.append("1", "user", "question", 10)[-1]
+        await private.close()
+
+        group.append("1", "assistant", "answer", 10)
+        await group.close()
+
+        # 回滚按对象匹配消息，重新加载后仍然可以删除
+        assert _contents(private.get("1")) == ["question", "answer"]
+        assert private.remove_message("1", message)
+
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+# tests/test_ai_image.py - AI 图像缩放和编码测试
+
+import base64
+import io
+
+from PIL import ExifTags, Image
+
+from modules.ai import AIManager
+
+
+def _jpeg(width, height, orientation=None):
+    image = Image.new("RGB", (width, height), (200, 100, 50))
+    output = io.BytesIO()
+    if orientation is None:
+        image.save(output, format="JPEG")
+    else:
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = orientation
+        image.save(output, format="JPEG", exif=exif)
+    return output.getvalue()
+
+
+def _decode(result):
+    return Image.open(io.BytesIO(base64.b64decode(result["data"])))
+
+
+def test_small_image_is_kept():
+    data = _jpeg(100, 50)
+    result = AIManager._encode_image(data, 1568)
+    assert base64.b64decode(result["data"]) == data
+    assert result["mime_type"] == "image/jpeg"
+    assert (result["width"], result["height"]) == (100, 50)
+
+
+def test_large_image_is_scaled():
+    result = AIManager._encode_image(_jpeg(4000, 2000), 1568)
+    assert (result["width"], result["height"]) == (1549, 775)
+    assert _decode(result).size == (1549, 775)
+
+
+def test_exif_rotated_image_keeps_aspect_ratio():
+    # 方向 6：存储为横向，显示时顺时针旋转 90 度为纵向
+    result = AIManager._encode_image(_jpeg(4000, 2000, orientation=6), 1568)
+    assert (result["width"], result["height"]) == (775, 1549)
+    assert _decode(result).size == (775, 1549)
+
+
+def test_small_rotated_image_reports_display_size():
+    result = AIManager._encode_image(_jpeg(100, 50, orientation=6), 1568)
+    assert (result["width"], result["height"]) == (50, 100)
+
+
+def test_transparent_image_is_encoded_as_png():
+    image = Image.new("RGBA", (3000, 3000), (0, 0, 0, 0))
+    output = io.BytesIO()
+    image.save(output, format="TIFF")
+    result = AIManager._encode_image(output.getvalue(), 1000)
+    assert result["mime_type"] == "image/png"
+    assert (result["width"], result["height"]) == (1000, 1000)
@@ -0,0 +1,84 @@
+# tests/test_ai_usage.py - AI 用量统计测试
+
+import asyncio
+
+import modules.ai as ai
+from modules.ai import OpenAIProvider, UsageMetrics, histogram_quantile
+
+BOUNDS = (1, 2, 4)
+
+
+def test_histogram_quantile_empty():
+    assert histogram_quantile([0, 0, 0, 0], BOUNDS, 0.5) is None
+
+
+def test_histogram_quantile_interpolates_within_bucket():
+    # 10 个样本都在 (1, 2] 区间
+    assert histogram_quantile([0, 10, 0, 0], BOUNDS, 0.5) == 1.5
+    assert histogram_quantile([0, 10, 0, 0], BOUNDS, 1.0) == 2
+    # 第一个区间的下界为 0
+    assert histogram_quantile([4, 0, 0, 0], BOUNDS, 0.25) == 0.25
+
+
+def test_histogram_quantile_across_buckets():
+    counts = [5, 5, 10, 0]
+    assert histogram_quantile(counts, BOUNDS, 0.25) == 1
+    assert histogram_quantile(counts, BOUNDS, 0.75) == 3
+
+
+def test_histogram_quantile_overflow_returns_last_bound():
+    assert histogram_quantile([0, 0, 1, 9], BOUNDS, 0.95) == 4.0
+
+
+def _request(provider):
+    provider = dict({"model": "m", "temperature": 0.7}, **provider)
+    return OpenAIProvider.format_request(provider, [], stream=True)
+
+
+def test_stream_usage_only_for_openai_by_default():
+    assert _request({"api_url": "https://api.openai.com/v1/chat/completions"
+                     })["stream_options"] == {"include_usage": True}
+    assert "stream_options" not in _request(
+        {"api_url": "https://example.com/v1/chat/completions"})
+    assert "stream_options" not in _request({})
+
+
+def test_stream_usage_can_be_configured():
+    assert "stream_options" in _request(
+        {"api_url": "https://example.com/v1", "stream_usage": True})
+    assert "stream_options" not in _request(
+        {"api_url": "https://api.openai.com/v1", "stream_usage": False})
+    assert "stream_options" not in OpenAIProvider.format_request(
+        {"model": "m", "temperature": 0.7,
+         "api_url": "https://api.openai.com/v1"}, [], stream=False)
+
+
+def _usage_stats(total, provider):
+    return {"total_requests": total,
+            "requests_by_provider": {provider: total},
+            "requests_by_user": {}}
+
+
+def test_shards_write_own_files_and_summarize_all(monkeypatch, tmp_path):
+    path = str(tmp_path / "usage_metrics.json")
+
+    async def save(shard_id, total, provider):
+        monkeypatch.setitem(ai._state, "usage_stats",
+                            _usage_stats(total, provider))
+        metrics = UsageMetrics(path, shard_id)
+        metrics.record(provider, "m", 1.0, usage={"output_tokens": 10})
+        await metrics.save()
+        return metrics
+
+    asyncio.run(save(0, 2, "a"))
+    metrics = asyncio.run(save(1, 3, "b"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "usage_metrics.1.json", "usage_metrics.json"]
+
+    # 本分片使用内存中的计数，其他分片从文件读取
+    total = metrics.total_usage_stats()
+    assert total["total_requests"] == 5
+    assert total["requests_by_provider"] == {"a": 2, "b": 3}
+    assert {key: item["requests"]
+            for key, item in metrics.summarize().items()} == {"a/m": 1,
+                                                              "b/m": 1}
@@ -0,0 +1,99 @@
+# tests/test_atomic_file.py - 原子文件写入测试
+
+import json
+import os
+
+from utils.atomic_file import (SharedJsonFile, atomic_write_json, is_own_write,
+                               merge_changes)
+
+
+def test_atomic_write_json(tmp_path):
+    path = tmp_path / "config" / "data.json"
+    atomic_write_json(str(path), {"a": 1})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"a": 1}
+    # 不留下临时文件
+    assert os.listdir(path.parent) == ["data.json"]
+
+
+def test_fsync_can_be_skipped(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(os, "fsync", calls.append)
+    path = str(tmp_path / "data.json")
+
+    atomic_write_json(path, {"a": 1})
+    assert len(calls) == 1
+
+    atomic_write_json(path, {"a": 2}, fsync=False, indent=2)
+    assert len(calls) == 1
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"a": 2}
+
+
+def test_own_write_is_recognized(tmp_path):
+    path = str(tmp_path / "data.json")
+    atomic_write_json(path, {"a": 1})
+    assert is_own_write(path)
+
+
+def test_external_write_is_not_own(tmp_path):
+    path = str(tmp_path / "data.json")
+    atomic_write_json(path, {"a": 1})
+
+    # 其他进程通过重命名替换文件（新的 inode）
+    other = str(tmp_path / "other.json")
+    with open(other, "w", encoding="utf-8") as f:
+        json.dump({"a": 2}, f)
+    os.replace(other, path)
+    assert not is_own_write(path)
+
+
+def test_unknown_file_is_not_own(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("{}", encoding="utf-8")
+    assert not is_own_write(str(path))
+    assert not is_own_write(str(tmp_path / "missing.json"))
+
+
+def test_merge_changes():
+    base = {"keep": 1, "ours": 1, "theirs": 1, "deleted": 1,
+            "nested": {"a": 1, "b": 1}}
+    ours = {"keep": 1, "ours": 2, "theirs": 1, "added": 1,
+            "nested": {"a": 2, "b": 1}}
+    theirs = {"keep": 1, "ours": 1, "theirs": 3, "deleted": 1,
+              "nested": {"a": 1, "b": 3}, "other": 1}
+    assert merge_changes(base, ours, theirs) == {
+        "keep": 1, "ours": 2, "theirs": 3, "nested": {"a": 2, "b": 3},
+        "other": 1, "added": 1}
+
+
+def test_merge_changes_conflict_prefers_ours():
+    assert merge_changes({"a": 1}, {"a": 2}, {"a": 3}) == {"a": 2}
+    # 列表整体替换
+    assert merge_changes({"a": [1]}, {"a": [1, 2]}, {"a": [1, 3]}) == {
+        "a": [1, 2]}
+
+
+def test_shared_json_file_keeps_other_writers_changes(tmp_path):
+    path = str(tmp_path / "config.json")
+    first, second = SharedJsonFile(path), SharedJsonFile(path)
+    first.save({"whitelist": {}, "providers": {}})
+
+    a = first.load()
+    b = second.load()
+    a["whitelist"]["1"] = {"name": "a"}
+    first.save(a)
+    b["providers"]["p"] = {"model": "m"}
+    saved = second.save(b)
+
+    assert saved == {"whitelist": {"1": {"name": "a"}},
+                     "providers": {"p": {"model": "m"}}}
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == saved
+
+
+def test_shared_json_file_update(tmp_path):
+    path = str(tmp_path / "config.json")
+    shared = SharedJsonFile(path)
+    increment = lambda data: {**data, "last_key": data["last_key"] + 1}
+    assert shared.update(increment, default={"last_key": 0}) == {"last_key": 1}
+    assert shared.update(increment, default={"last_key": 0}) == {"last_key": 2}
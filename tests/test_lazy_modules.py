@@ -0,0 +1,61 @@
+# tests/test_lazy_modules.py - 懒加载模块元数据解析测试
+
+import logging
+
+import pytest
+
+from core.module_manager import ModuleManager
+
+MODULE_SOURCE = '''
+MODULE_NAME = "demo"
+MODULE_COMMANDS = ["demo", "democonfig"]
+MODULE_CHAT_TYPES = ["private"]
+CALLBACK_PREFIX = "demo_"
+
+
+async def setup(interface):
+    await interface.register_command("demo", demo_command)
+    await interface.register_command("democonfig", config_command,
+                                     "super_admin")
+    await interface.register_callback_handler(config_callback,
+                                              pattern="^demo_config",
+                                              admin_level="super_admin")
+    await interface.register_callback_handler(page_callback,
+                                              pattern="^demo_page",
+                                              admin_level="group_admin")
+'''
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ModuleManager.__new__(ModuleManager)
+    manager.logger = logging.getLogger("ModuleManager")
+    manager.modules_dir = str(tmp_path)
+    return manager
+
+
+def test_metadata_includes_admin_levels(manager, tmp_path):
+    (tmp_path / "demo.py").write_text(MODULE_SOURCE, encoding="utf-8")
+    metadata = manager._parse_module_metadata("demo")
+
+    assert metadata["command_admin_levels"] == {
+        "demo": False,
+        "democonfig": "super_admin"
+    }
+    # 占位回调使用模块回调处理器中最低的权限级别
+    assert metadata["callback_admin_level"] == "group_admin"
+    assert metadata["chat_types"] == ["private"]
+
+
+def test_non_literal_admin_level_loads_module_eagerly(manager, tmp_path):
+    (tmp_path / "demo.py").write_text(
+        MODULE_SOURCE.replace('"super_admin")\n', "LEVEL)\n", 1),
+        encoding="utf-8")
+    assert manager._parse_module_metadata("demo") is None
+
+
+def test_unregistered_command_loads_module_eagerly(manager, tmp_path):
+    (tmp_path / "demo.py").write_text(
+        MODULE_SOURCE.replace('"democonfig"]', '"democonfig", "other"]'),
+        encoding="utf-8")
+    assert manager._parse_module_metadata("demo") is None
@@ -0,0 +1,125 @@
+# tests/test_live_message.py - 流式消息的分割和编辑测试
+
+import asyncio
+
+import pytest
+import telegram
+
+from utils.live_message import LiveMessage, find_split, utf16_length
+
+
+class FakeMessage:
+    """记录编辑和回复的消息，errors 中的异常按顺序在编辑时抛出"""
+
+    def __init__(self, errors=None):
+        self.errors = list(errors or [])
+        self.edits = []
+        self.replies = []
+
+    async def edit_text(self, text, parse_mode=None):
+        self.edits.append((text, parse_mode))
+        if self.errors:
+            raise self.errors.pop(0)
+
+    async def reply_text(self, text, parse_mode=None):
+        reply = FakeMessage()
+        reply.edits.append((text, parse_mode))
+        self.replies.append(reply)
+        return reply
+
+
+def test_find_split_short_text():
+    assert find_split("abc", 3) is None
+    assert find_split("", 10) is None
+
+
+def test_find_split_hard_cut():
+    assert find_split("abcdefghij", 4) == 4
+
+
+def test_find_split_keeps_surrogate_pairs():
+    # 表情占两个 UTF-16 码元，不能从中间分开
+    text = "abc\U0001F600d"
+    cut = find_split(text, 4)
+    assert cut == 3
+    assert utf16_length(text[:cut]) <= 4
+    assert find_split("\U0001F600" * 3, 3) == 1
+
+
+def test_find_split_prefers_newline_then_space():
+    assert find_split("aaaa\nbbbbbbb", 8) == 5
+    assert find_split("aa bb\ncccccccc", 8) == 6
+    assert find_split("aaaa bbbbbbb", 8) == 5
+
+
+def test_find_split_ignores_separator_in_first_half():
+    assert find_split("a\nbbbbbbbbbb", 8) == 8
+
+
+def test_flush_backs_off_on_retry_after():
+    async def main():
+        message = FakeMessage([telegram.error.RetryAfter(5)])
+        live = LiveMessage(message, min_interval=1.0, max_interval=10.0)
+
+        assert not await live._flush("hello")
+        assert live.stats["retry_after"] == 1
+        assert live.interval == 5
+        assert live.shown == [None]
+
+        # 限流结束后重试成功
+        assert await live._flush("hello")
+        assert live.shown == ["hello"]
+
+    asyncio.run(main())
+
+
+def test_flush_falls_back_to_plain_text():
+    async def main():
+        message = FakeMessage(
+            [telegram.error.BadRequest("Can't parse entities")])
+        live = LiveMessage(message)
+
+        assert await live._flush("x", lambda text: f"<b>{text}</b>", "HTML")
+        assert message.edits == [("<b>x</b>", "HTML"), ("x", None)]
+        assert live.shown == ["x"]
+
+    asyncio.run(main())
+
+
+def test_flush_treats_not_modified_as_shown():
+    async def main():
+        message = FakeMessage(
+            [telegram.error.BadRequest("Message is not modified")])
+        live = LiveMessage(message)
+
+        assert await live._flush("x")
+        assert live.shown == ["x"]
+        # 内容相同时不再编辑
+        assert await live._flush("x")
+        assert len(message.edits) == 1
+
+    asyncio.run(main())
+
+
+def test_flush_raises_bad_request_for_plain_text():
+    async def main():
+        message = FakeMessage([telegram.error.BadRequest("Chat not found")])
+        live = LiveMessage(message)
+
+        with pytest.raises(telegram.error.BadRequest):
+            await live._flush("x")
+
+    asyncio.run(main())
+
+
+def test_flush_splits_long_text_into_replies():
+    async def main():
+        message = FakeMessage()
+        live = LiveMessage(message, max_length=10)
+
+        assert await live._flush("aaaa bbbb cccc dddd eeee")
+        assert [m.edits for m in live.messages] == [
+            [("aaaa bbbb ", None)], [("cccc dddd ", None)], [("eeee", None)]]
+        assert live.stats["sends"] == 2
+
+    asyncio.run(main())
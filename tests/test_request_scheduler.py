@@ -0,0 +1,154 @@
+# tests/test_request_scheduler.py - AI 请求调度器测试
+
+import asyncio
+
+import pytest
+
+from modules.ai import AIRequestError, RequestScheduler
+
+
+async def _queue(scheduler, user_id):
+    """开始排队获取名额"""
+    task = asyncio.create_task(scheduler.acquire(user_id))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_round_robin_between_users():
+    async def main():
+        scheduler = RequestScheduler(max_concurrent=1, max_per_user=1)
+        await scheduler.acquire("a")
+        tasks = [await _queue(scheduler, user_id)
+                 for user_id in ("a", "a", "b")]
+
+        # 名额在 release 中同步分配，用户 a 的第二个请求排到用户 b 之后
+        granted = []
+        for user_id in ("a", "a", "b"):
+            scheduler.release(user_id)
+            granted.extend(scheduler.active)
+        assert granted == ["a", "b", "a"]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def test_queue_position():
+    async def main():
+        scheduler = RequestScheduler(max_concurrent=1, max_per_user=1)
+        await scheduler.acquire("a")
+        tasks = [await _queue(scheduler, user_id)
+                 for user_id in ("a", "a", "b")]
+
+        first, second = scheduler.queues["a"]
+        (other,) = scheduler.queues["b"]
+        assert scheduler.get_position("a", first) == 0
+        assert scheduler.get_position("b", other) == 1
+        assert scheduler.get_position("a", second) == 2
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_cancel_while_queued():
+    async def main():
+        scheduler = RequestScheduler(max_concurrent=1, max_per_user=1)
+        await scheduler.acquire("a")
+        task = await _queue(scheduler, "b")
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.queued == 0
+        assert not scheduler.queues
+
+        scheduler.release("a")
+        assert scheduler.running == 0
+        assert not scheduler.active
+
+    asyncio.run(main())
+
+
+def test_cancel_after_grant_returns_slot():
+    async def main():
+        scheduler = RequestScheduler(max_concurrent=1, max_per_user=1)
+        await scheduler.acquire("a")
+        task = await _queue(scheduler, "b")
+
+        # 名额已分配给 b，但 b 在恢复运行前被取消
+        scheduler.release("a")
+        assert scheduler.active == {"b": 1}
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.running == 0
+        assert not scheduler.active
+
+    asyncio.run(main())
+
+
+def test_requests_without_user_skip_per_user_limit():
+    async def main():
+        scheduler = RequestScheduler(max_concurrent=3, max_per_user=1)
+        for _ in range(3):
+            await asyncio.wait_for(scheduler.acquire(None), timeout=1)
+        assert scheduler.running == 3
+        for _ in range(3):
+            scheduler.release(None)
+        assert scheduler.running == 0
+        assert not scheduler.active
+
+    asyncio.run(main())
+
+
+def test_queue_limit_rejects():
+    async def main():
+        scheduler = RequestScheduler(max_concurrent=1, max_per_user=1,
+                                     max_queued=1)
+        await scheduler.acquire("a")
+        task = await _queue(scheduler, "b")
+        with pytest.raises(AIRequestError):
+            await scheduler.acquire("c")
+        assert scheduler.stats["rejected"] == 1
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_supervisor_group_does_not_block_other_users():
+    from core.task_supervisor import TaskSupervisor
+    from modules.ai import AI_RESPONSE_GROUP, AI_RESPONSE_TASK_LIMIT
+
+    async def main():
+        supervisor = TaskSupervisor("ai", max_concurrent=16)
+        supervisor.set_limit(AI_RESPONSE_GROUP, AI_RESPONSE_TASK_LIMIT)
+        scheduler = RequestScheduler(max_concurrent=5, max_per_user=1)
+        done = asyncio.Event()
+
+        async def request(user_id):
+            await scheduler.acquire(user_id)
+            try:
+                await done.wait()
+            finally:
+                scheduler.release(user_id)
+
+        # 用户 a 连续发送 20 条消息，之后用户 b 发送一条
+        tasks = [supervisor.spawn(request("a"), group=AI_RESPONSE_GROUP)
+                 for _ in range(20)]
+        tasks.append(supervisor.spawn(request("b"), group=AI_RESPONSE_GROUP))
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+        # b 不需要等待 a 的请求完成
+        assert scheduler.active == {"a": 1, "b": 1}
+        assert scheduler.queued == 19
+
+        done.set()
+        await asyncio.gather(*tasks)
+        assert scheduler.running == 0
+
+    asyncio.run(main())
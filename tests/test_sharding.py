@@ -0,0 +1,66 @@
+# tests/test_sharding.py - 分片路由和共享状态文件测试
+
+from core.sharding import shard_for
+from utils.state_manager import StateManager
+
+
+def test_shard_for_single_shard():
+    assert shard_for(12345, 1) == 0
+    assert shard_for(-100123, 0) == 0
+
+
+def test_shard_for_none_key_goes_to_primary():
+    assert shard_for(None, 4) == 0
+
+
+def test_shard_for_is_stable_and_in_range():
+    for key in (1, 2, 12345, -1001234567890, 2**40):
+        shard = shard_for(key, 4)
+        assert 0 <= shard < 4
+        assert shard_for(key, 4) == shard
+        # 字符串形式的 ID（如状态文件中的键）与整数归属同一分片
+        assert shard_for(str(key), 4) == shard
+
+
+def test_shard_for_spreads_keys():
+    shards = {shard_for(key, 4) for key in range(100)}
+    assert shards == {0, 1, 2, 3}
+
+
+def test_update_state_merges_with_file(tmp_path):
+    manager = StateManager(str(tmp_path))
+    manager.save_state("reminder", {"1": {"a": 1}, "2": {"b": 2}})
+
+    # 另一个分片只修改自己负责的聊天，其他聊天以文件为准
+    local = {"1": {"a": 1, "c": 3}, "2": {"stale": True}}
+
+    def merge(saved):
+        saved = dict(saved)
+        saved["1"] = local["1"]
+        return saved
+
+    result = manager.update_state("reminder", merge, default={})
+    assert result == {"1": {"a": 1, "c": 3}, "2": {"b": 2}}
+    assert manager.load_state("reminder") == result
+
+
+def test_update_state_uses_default(tmp_path):
+    manager = StateManager(str(tmp_path))
+    result = manager.update_state("missing", lambda state: state + [1],
+                                  default=[])
+    assert result == [1]
+
+
+def test_merge_state_keeps_other_shards_changes(tmp_path):
+    manager = StateManager(str(tmp_path))
+    manager.save_state("subconv", {"user_configs": {"1": {"a": 1}}})
+    base = manager.load_state("subconv")
+
+    # 另一个分片在此期间添加了用户 2
+    manager.save_state("subconv",
+                       {"user_configs": {"1": {"a": 1}, "2": {"b": 2}}})
+
+    local = {"user_configs": {"1": {"a": 5}}}
+    result = manager.merge_state("subconv", local, base)
+    assert result == {"user_configs": {"1": {"a": 5}, "2": {"b": 2}}}
+    assert manager.load_state("subconv") == result
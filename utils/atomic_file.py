@@ -0,0 +1,231 @@
+# utils/atomic_file.py - 原子文件写入
+
+import os
+import copy
+import json
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 本进程最近一次写入的文件签名: 绝对路径 -> (inode, mtime_ns, size)，
+# 文件监控据此忽略由自身写入引起的变化
+_own_writes = {}
+
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def is_own_write(file_path):
+    """判断文件的当前内容是否为本进程最近一次通过 atomic_write 写入的内容
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        bool: 文件未被其他进程或外部编辑修改过时返回 True
+    """
+    signature = _own_writes.get(os.path.abspath(file_path))
+    if signature is None:
+        return False
+    try:
+        return _file_signature(file_path) == signature
+    except OSError:
+        return False
+
+
+@contextlib.contextmanager
+def atomic_write(file_path, mode="w", encoding="utf-8", fsync=True):
+    """原子写入文件
+
+    先写入同目录下的临时文件并同步到磁盘，成功后再替换目标文件。
+    写入过程中进程退出时，目标文件保持原样，不会出现写了一半的文件
+
+    fsync 会阻塞到数据落盘，在事件循环中频繁保存的小状态文件可以传入
+    fsync=False：进程崩溃时替换仍然是原子的，只是系统断电时可能丢失最近一次写入
+
+    Args:
+        file_path: 目标文件路径
+        mode: 写入模式，"w" 或 "wb"
+        encoding: 文本模式的编码
+        fsync: 替换前是否将临时文件同步到磁盘
+
+    Yields:
+        file: 临时文件对象
+    """
+    directory = os.path.dirname(file_path) or "."
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else encoding) as f:
+            yield f
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+        # 保留原文件的权限
+        if os.path.exists(file_path):
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o777)
+        else:
+            os.chmod(temp_path, 0o644)
+
+        os.replace(temp_path, file_path)
+        _own_writes[os.path.abspath(file_path)] = _file_signature(file_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+        raise
+
+
+def atomic_write_json(file_path, data, fsync=True, **kwargs):
+    """原子写入 JSON 文件
+
+    Args:
+        file_path: 目标文件路径
+        data: 要保存的数据
+        fsync: 替换前是否将临时文件同步到磁盘
+        **kwargs: 传给 json.dump 的参数（如 indent、ensure_ascii）
+    """
+    with atomic_write(file_path, "w", fsync=fsync) as f:
+        json.dump(data, f, **kwargs)
+
+
+@contextlib.contextmanager
+def file_lock(file_path):
+    """跨进程的文件锁，用于多个进程（分片）对同一文件的“读取-修改-写入”
+
+    锁文件为同目录下的 .<文件名>.lock；没有 fcntl 的平台（Windows）上不加锁
+
+    Args:
+        file_path: 要保护的文件路径
+    """
+    if fcntl is None:
+        yield
+        return
+
+    directory = os.path.dirname(file_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    lock_path = os.path.join(directory, f".{os.path.basename(file_path)}.lock")
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_MISSING = object()
+
+
+def merge_changes(base, ours, theirs):
+    """三方合并 JSON 数据：把本进程相对 base 的修改应用到 theirs 上
+
+    字典按键递归合并，其他类型（包括列表）整体替换；双方修改了同一个值时以本进程为准
+
+    Args:
+        base: 本进程上次读取或写入时的数据
+        ours: 本进程的当前数据
+        theirs: 文件中的最新数据
+
+    Returns:
+        合并后的数据
+    """
+    if ours == base:
+        return theirs
+    if theirs == base:
+        return ours
+    if not (isinstance(base, dict) and isinstance(ours, dict)
+            and isinstance(theirs, dict)):
+        return ours
+
+    merged = {}
+    for key in [*theirs, *(key for key in ours if key not in theirs)]:
+        value = merge_changes(base.get(key, _MISSING), ours.get(key, _MISSING),
+                              theirs.get(key, _MISSING))
+        if value is not _MISSING:
+            merged[key] = value
+    return merged
+
+
+class SharedJsonFile:
+    """多个进程（分片）共同修改的 JSON 文件
+
+    记录上次读取或写入的内容，保存时在文件锁内把本进程的修改合并到文件中的
+    最新内容后再写入，不会整体覆盖其他进程的修改
+    """
+
+    def __init__(self, file_path):
+        """初始化
+
+        Args:
+            file_path: 文件路径
+        """
+        self.file_path = file_path
+        self.base = None  # 上次读取或写入的内容
+
+    def load(self, default=None):
+        """读取文件
+
+        Args:
+            default: 文件不存在时的返回值
+
+        Returns:
+            文件内容
+        """
+        if not os.path.exists(self.file_path):
+            return default
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.base = copy.deepcopy(data)
+        return data
+
+    def save(self, data, **kwargs):
+        """合并文件中的最新内容后原子写入
+
+        Args:
+            data: 本进程的当前数据
+            **kwargs: 传给 json.dump 的参数
+
+        Returns:
+            写入的数据（包含其他进程的修改）
+        """
+        with file_lock(self.file_path):
+            merged = data
+            if self.base is not None and os.path.exists(self.file_path):
+                try:
+                    with open(self.file_path, "r", encoding="utf-8") as f:
+                        merged = merge_changes(self.base, data, json.load(f))
+                except json.JSONDecodeError:
+                    # 文件损坏时以本进程的数据为准
+                    pass
+            atomic_write_json(self.file_path, merged, **kwargs)
+        self.base = copy.deepcopy(merged)
+        return merged
+
+    def update(self, updater, default=None, **kwargs):
+        """在文件锁内读取、修改并写入（如递增计数器）
+
+        Args:
+            updater: 修改函数 (文件中的数据) -> 新数据
+            default: 文件不存在时传给 updater 的数据
+            **kwargs: 传给 json.dump 的参数
+
+        Returns:
+            写入的数据
+        """
+        with file_lock(self.file_path):
+            data = default
+            if os.path.exists(self.file_path):
+                with open(self.file_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            data = updater(data)
+            atomic_write_json(self.file_path, data, **kwargs)
+        self.base = copy.deepcopy(data)
+        return data
@@ -0,0 +1,67 @@
+# utils/event_loop.py - 事件循环选择
+
+import sys
+import asyncio
+from utils.logger import setup_logger
+
+# 支持的事件循环
+LOOP_CHOICES = ("asyncio", "uvloop")
+
+
+def get_loop_factory(name="asyncio"):
+    """获取事件循环工厂
+
+    uvloop 未安装或当前平台不支持时退回到 asyncio
+
+    Args:
+        name: 事件循环名称，"asyncio" 或 "uvloop"
+
+    Returns:
+        tuple: (工厂函数, 实际使用的事件循环名称)
+    """
+    if name not in LOOP_CHOICES:
+        raise ValueError(f"不支持的事件循环: {name}")
+
+    if name == "uvloop":
+        logger = setup_logger("EventLoop")
+        if sys.platform == "win32":
+            logger.warning("uvloop 不支持 Windows，改为使用 asyncio 事件循环")
+        else:
+            try:
+                import uvloop
+                return uvloop.new_event_loop, "uvloop"
+            except ImportError:
+                logger.warning("未安装 uvloop，改为使用 asyncio 事件循环")
+
+    # 在 Windows 上需要使用 Selector 事件循环
+    if sys.platform == "win32":
+        return asyncio.SelectorEventLoop, "asyncio"
+    return asyncio.new_event_loop, "asyncio"
+
+
+def run(main, loop="asyncio"):
+    """在指定的事件循环中运行协程
+
+    Args:
+        main: 协程对象
+        loop: 事件循环名称
+
+    Returns:
+        协程的返回值
+    """
+    factory, _ = get_loop_factory(loop)
+    with asyncio.Runner(loop_factory=factory) as runner:
+        return runner.run(main)
+
+
+def get_loop_name(loop=None):
+    """获取事件循环的名称
+
+    Args:
+        loop: 事件循环，为 None 时使用当前运行的事件循环
+
+    Returns:
+        str: "uvloop" 或 "asyncio"
+    """
+    loop = loop or asyncio.get_running_loop()
+    return "uvloop" if type(loop).__module__.startswith("uvloop") else "asyncio"
@@ -0,0 +1,141 @@
+# utils/gc_tuner.py - 垃圾回收调优
+
+import gc
+import time
+from collections import deque
+from utils.logger import setup_logger
+
+# 计算暂停时间分位数使用的最近样本数量
+PAUSE_SAMPLES = 512
+
+
+class GCTuner:
+    """垃圾回收调优器
+
+    通过 gc.callbacks 统计每一代回收的次数和暂停时间；启动完成后冻结已有对象，
+    让长期存在的对象（处理器、模块全局数据表等）不再参与完整回收；
+    只在第 2 代对象明显增长时才主动执行完整回收
+    """
+
+    def __init__(self, growth_ratio=0.25, min_objects=10000):
+        """初始化调优器
+
+        Args:
+            growth_ratio: 第 2 代对象数量相对上次完整回收后增长超过该比例时执行完整回收
+            min_objects: 第 2 代对象至少增长该数量才执行完整回收
+        """
+        self.growth_ratio = growth_ratio
+        self.min_objects = min_objects
+        self.logger = setup_logger("GCTuner")
+
+        self.frozen = 0  # 冻结的对象数量
+        self.gen2_baseline = None  # 上次完整回收后第 2 代的对象数量
+
+        self.stats = {
+            "collections": [0, 0, 0],
+            "collected": 0,
+            "uncollectable": 0,
+            "pause_total": 0.0,
+            "pause_max": 0.0,
+            "full_pause_max": 0.0,
+            "adaptive_runs": 0,
+            "adaptive_skips": 0
+        }
+        self._pauses = deque(maxlen=PAUSE_SAMPLES)
+        self._started = None
+        self._installed = False
+
+    def install(self, thresholds=None):
+        """注册回调并设置分代阈值
+
+        Args:
+            thresholds: 分代回收阈值 [gen0, gen1, gen2]，为空时保留 Python 默认值
+        """
+        if thresholds:
+            gc.set_threshold(*thresholds)
+            self.logger.info(f"已设置垃圾回收阈值: {gc.get_threshold()}")
+        if not self._installed:
+            gc.callbacks.append(self._callback)
+            self._installed = True
+
+    def uninstall(self):
+        """移除回调"""
+        if self._installed:
+            gc.callbacks.remove(self._callback)
+            self._installed = False
+
+    def _callback(self, phase, info):
+        """gc.callbacks 回调，统计回收次数和暂停时间"""
+        if phase == "start":
+            self._started = time.perf_counter()
+            return
+
+        if self._started is None:
+            return
+        pause = time.perf_counter() - self._started
+        self._started = None
+
+        generation = info["generation"]
+        self.stats["collections"][generation] += 1
+        self.stats["collected"] += info["collected"]
+        self.stats["uncollectable"] += info["uncollectable"]
+        self.stats["pause_total"] += pause
+        self.stats["pause_max"] = max(self.stats["pause_max"], pause)
+        if generation == 2:
+            self.stats["full_pause_max"] = max(self.stats["full_pause_max"],
+                                               pause)
+        self._pauses.append(pause)
+
+    def freeze(self):
+        """回收一次后冻结当前所有对象，之后的回收不再扫描它们
+
+        Returns:
+            int: 冻结的对象数量
+        """
+        gc.collect()
+        gc.freeze()
+        self.frozen = gc.get_freeze_count()
+        self.gen2_baseline = len(gc.get_objects(generation=2))
+        self.logger.info(f"已冻结 {self.frozen} 个启动时创建的对象")
+        return self.frozen
+
+    def maybe_collect(self):
+        """第 2 代对象明显增长时执行完整回收
+
+        Returns:
+            int: 回收的对象数量，未执行时返回 None
+        """
+        gen2 = len(gc.get_objects(generation=2))
+        if self.gen2_baseline is None:
+            self.gen2_baseline = gen2
+
+        growth = gen2 - self.gen2_baseline
+        if growth < max(self.min_objects,
+                        self.gen2_baseline * self.growth_ratio):
+            self.stats["adaptive_skips"] += 1
+            self.logger.debug(f"第 2 代对象增长 {growth}，跳过完整回收")
+            return None
+
+        collected = gc.collect()
+        self.gen2_baseline = len(gc.get_objects(generation=2))
+        self.stats["adaptive_runs"] += 1
+        self.logger.debug(f"第 2 代对象增长 {growth}，完整回收了 {collected} 个对象")
+        return collected
+
+    def get_stats(self):
+        """获取垃圾回收统计信息
+
+        Returns:
+            dict: 统计信息
+        """
+        pauses = sorted(self._pauses)
+        count = sum(self.stats["collections"])
+        stats = dict(self.stats)
+        stats.update({
+            "collections": list(self.stats["collections"]),
+            "pause_avg": self.stats["pause_total"] / count if count else 0.0,
+            "pause_p99": pauses[int(len(pauses) * 0.99)] if pauses else 0.0,
+            "frozen": self.frozen,
+            "threshold": gc.get_threshold()
+        })
+        return stats
@@ -0,0 +1,249 @@
+# utils/live_message.py - 流式更新的消息
+
+import time
+import asyncio
+import logging
+import telegram
+
+# Telegram 单条消息的最大长度（UTF-16 码元）
+MAX_MESSAGE_LENGTH = 4096
+
+
+def utf16_length(text):
+    """计算文本的 UTF-16 长度（Telegram 按 UTF-16 码元限制消息长度）
+
+    Args:
+        text: 文本
+
+    Returns:
+        int: UTF-16 码元数量
+    """
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+def find_split(text, max_length):
+    """找出文本的分割位置，优先在换行或空格处分割
+
+    Args:
+        text: 文本
+        max_length: 第一段的最大 UTF-16 长度
+
+    Returns:
+        int: 分割位置（字符下标），不需要分割时返回 None
+    """
+    if utf16_length(text) <= max_length:
+        return None
+
+    # 找出 UTF-16 长度不超过上限的最长前缀
+    units = 0
+    cut = 0
+    for cut, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > max_length:
+            break
+
+    # 在后半段找换行或空格，避免把一行或一个单词分到两条消息
+    for separator in ("\n", " "):
+        index = text.rfind(separator, cut // 2, cut)
+        if index > 0:
+            return index + 1
+    return cut
+
+
+class LiveMessage:
+    """流式更新的消息
+
+    合并高频的文本更新，按自适应的间隔编辑消息：文本越长编辑越慢，
+    遇到 RetryAfter 时延长间隔并逐渐恢复；文本超过单条消息长度时
+    分割到后续消息中，已写满的消息不再编辑；结束时把完整文本格式化后更新
+    """
+
+    def __init__(self,
+                 message,
+                 min_interval=1.0,
+                 max_interval=10.0,
+                 max_length=MAX_MESSAGE_LENGTH,
+                 logger=None):
+        """初始化流式消息
+
+        Args:
+            message: 用于显示内容的第一条消息（如"正在思考"消息）
+            min_interval: 最短编辑间隔（秒）
+            max_interval: 最长编辑间隔（秒）
+            max_length: 每条消息的最大 UTF-16 长度
+            logger: 日志记录器
+        """
+        self.messages = [message]
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_length = max_length
+        self.logger = logger or logging.getLogger("LiveMessage")
+
+        self.text = ""  # 最新的完整文本
+        self.shown = [None]  # 每条消息当前显示的文本
+        self.boundaries = []  # 已写满的消息在文本中的结束位置
+
+        self.interval = min_interval
+        self.next_edit = 0.0  # 下次允许编辑的时间
+        self.retry_at = 0.0  # 限流结束的时间
+        self.lock = asyncio.Lock()
+
+        self.stats = {"updates": 0, "edits": 0, "sends": 0, "retry_after": 0}
+
+    def _split(self, text):
+        """把文本分割为每条消息的内容
+
+        文本只会在末尾增长，已写满的消息的分割位置保持不变
+        """
+        if self.boundaries and len(text) < self.boundaries[-1]:
+            # 文本被替换（如出错时），重新分割
+            self.boundaries = []
+
+        parts = []
+        start = 0
+        for end in self.boundaries:
+            parts.append(text[start:end])
+            start = end
+        while True:
+            cut = find_split(text[start:], self.max_length)
+            if cut is None:
+                parts.append(text[start:])
+                return parts
+            self.boundaries.append(start + cut)
+            parts.append(text[start:start + cut])
+            start += cut
+
+    def _base_interval(self, size):
+        """根据消息长度计算编辑间隔：每 1000 字增加 0.5 秒"""
+        return min(self.max_interval,
+                   self.min_interval + size / 1000 * 0.5)
+
+    async def update(self, text):
+        """更新文本，距离上次编辑不足间隔时只记录文本，等待下次更新或结束时发送
+
+        Args:
+            text: 当前的完整文本
+        """
+        self.text = text
+        self.stats["updates"] += 1
+        if time.monotonic() < self.next_edit or self.lock.locked():
+            return
+        async with self.lock:
+            try:
+                await self._flush(self.text)
+            except telegram.error.TelegramError as e:
+                self.logger.error(f"更新消息失败: {e}")
+
+    async def _flush(self, text, formatter=None, parse_mode=None):
+        """把文本同步到消息，只编辑内容有变化的消息
+
+        Returns:
+            bool: 是否全部同步成功（受到限流时返回 False）
+        """
+        parts = self._split(text)
+        last_size = 0
+        for index, part in enumerate(parts):
+            if not part.strip() and index == len(parts) - 1:
+                continue
+
+            # 长度限制按解析后的文本计算，格式化后的内容由 Telegram 判断是否可以发送
+            content, mode = part, None
+            if formatter:
+                content, mode = formatter(part), parse_mode
+
+            if index < len(self.shown) and self.shown[index] == content:
+                continue
+
+            while True:
+                try:
+                    await self._send(index, content, mode)
+                except telegram.error.RetryAfter as e:
+                    retry_after = e.retry_after
+                    if hasattr(retry_after, "total_seconds"):
+                        retry_after = retry_after.total_seconds()
+                    self.stats["retry_after"] += 1
+                    self.interval = min(self.max_interval,
+                                        max(self.interval * 2, retry_after))
+                    self.retry_at = time.monotonic() + retry_after
+                    self.next_edit = time.monotonic() + max(
+                        retry_after, self.interval)
+                    self.logger.debug(f"编辑消息受到限流，{retry_after} 秒后重试")
+                    return False
+                except telegram.error.BadRequest as e:
+                    if "Message is not modified" in str(e):
+                        self.shown[index] = content
+                    elif mode:
+                        # 格式化后的内容无法解析或超长时发送纯文本
+                        self.logger.debug(f"发送格式化内容失败，改为纯文本: {e}")
+                        content, mode = part, None
+                        continue
+                    else:
+                        raise
+                break
+            last_size = utf16_length(part)
+
+        # 成功后间隔逐渐恢复到与消息长度对应的水平
+        self.interval = max(self._base_interval(last_size),
+                            self.interval * 0.8)
+        self.next_edit = time.monotonic() + self.interval
+        return True
+
+    async def _send(self, index, content, parse_mode):
+        """编辑第 index 条消息，不存在时作为上一条消息的回复发送"""
+        if index < len(self.messages):
+            await self.messages[index].edit_text(content,
+                                                 parse_mode=parse_mode)
+            self.stats["edits"] += 1
+        else:
+            message = await self.messages[-1].reply_text(
+                content, parse_mode=parse_mode)
+            self.messages.append(message)
+            self.shown.append(None)
+            self.stats["sends"] += 1
+        self.shown[index] = content
+
+    async def finish(self, text=None, formatter=None, parse_mode="HTML"):
+        """发送最终内容，必要时等待限流结束
+
+        Args:
+            text: 最终的完整文本，为 None 时使用最近一次更新的文本
+            formatter: 格式化函数 (文本) -> 格式化后的文本，无法发送的部分改为纯文本
+            parse_mode: 格式化内容的解析模式
+        """
+        if text is not None:
+            self.text = text
+        if not self.text.strip():
+            return
+
+        async with self.lock:
+            try:
+                for _ in range(3):
+                    delay = self.retry_at - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    if await self._flush(self.text, formatter, parse_mode):
+                        break
+            except telegram.error.TelegramError as e:
+                self.logger.error(f"发送最终消息失败: {e}")
+
+            # 文本变短时删除多余的消息
+            parts = len(self._split(self.text))
+            for message in self.messages[parts:]:
+                try:
+                    await message.delete()
+                except telegram.error.TelegramError:
+                    pass
+            del self.messages[parts:]
+            del self.shown[parts:]
+
+    def get_stats(self):
+        """获取更新统计信息
+
+        Returns:
+            dict: 统计信息
+        """
+        stats = dict(self.stats)
+        stats["messages"] = len(self.messages)
+        return stats
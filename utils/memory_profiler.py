@@ -0,0 +1,312 @@
+# utils/memory_profiler.py - 内存分析
+
+import os
+import time
+import asyncio
+import tracemalloc
+from collections import defaultdict, deque
+from utils.logger import setup_logger
+
+# 按文件归类内存分配时使用的项目目录
+PROJECT_DIRS = ("modules", "utils", "core")
+
+# 不计入统计的分配（tracemalloc 自身和导入机制）
+IGNORED_FILES = ("<frozen importlib._bootstrap>",
+                 "<frozen importlib._bootstrap_external>", tracemalloc.__file__,
+                 "<unknown>")
+
+
+def get_rss():
+    """获取当前进程的常驻内存
+
+    Returns:
+        int: 字节数，无法获取时返回 None
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    # 没有 psutil 时读取 /proc（仅 Linux）
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def format_size(size):
+    """格式化字节数
+
+    Args:
+        size: 字节数（可为负数）
+
+    Returns:
+        str: 格式化后的文本
+    """
+    if abs(size) < 1024:
+        return f"{size} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if abs(size) < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+
+
+def rss_slope(samples):
+    """用最小二乘法计算常驻内存的增长速度
+
+    Args:
+        samples: [(time.monotonic(), rss 字节数), ...]
+
+    Returns:
+        float: 每小时增长的字节数，样本不足时返回 0
+    """
+    if len(samples) < 2:
+        return 0.0
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_r = sum(r for _, r in samples) / n
+    var_t = sum((t - mean_t)**2 for t, _ in samples)
+    if var_t == 0:
+        return 0.0
+    cov = sum((t - mean_t) * (r - mean_r) for t, r in samples)
+    return cov / var_t * 3600
+
+
+class MemoryProfiler:
+    """内存分析器
+
+    通过 tracemalloc 记录快照并比较，按分配发生的项目文件（modules/*.py、utils/*.py、core/*.py）
+    归类内存占用；后台定期采样常驻内存，增长速度超过阈值时发出提醒
+    """
+
+    def __init__(self, project_root, frames=10):
+        """初始化分析器
+
+        Args:
+            project_root: 项目根目录，用于识别项目文件
+            frames: tracemalloc 记录的调用栈深度，越深归类越准确，开销也越大
+        """
+        self.project_root = os.path.abspath(project_root)
+        self.frames = max(1, frames)
+        self.logger = setup_logger("MemoryProfiler")
+
+        self.baseline = None  # 开始分析时的快照
+        self.last_snapshot = None  # 最近一次快照
+        self.started_at = None
+
+        # 常驻内存采样 [(time.monotonic(), rss)]
+        self.rss_samples = deque()
+        self.last_alert = 0
+
+    @property
+    def tracing(self):
+        """是否正在记录内存分配"""
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        """开始记录内存分配并保存基准快照
+
+        Returns:
+            bool: 是否新开始记录（已在记录时返回 False）
+        """
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(self.frames)
+        self.started_at = time.time()
+        self.baseline = self._take_snapshot()
+        self.last_snapshot = self.baseline
+        self.logger.info(f"已开始记录内存分配（调用栈深度 {self.frames}）")
+        return True
+
+    def stop(self):
+        """停止记录内存分配并释放快照"""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.logger.info("已停止记录内存分配")
+        self.baseline = None
+        self.last_snapshot = None
+        self.started_at = None
+
+    def _take_snapshot(self):
+        """获取过滤后的快照"""
+        snapshot = tracemalloc.take_snapshot()
+        return snapshot.filter_traces([
+            tracemalloc.Filter(False, filename) for filename in IGNORED_FILES
+        ])
+
+    def _relative_path(self, filename):
+        """获取项目文件的相对路径
+
+        Args:
+            filename: 文件路径
+
+        Returns:
+            str: 项目文件的相对路径（如 modules/ai.py），不是项目文件时返回 None
+        """
+        if not filename.startswith(self.project_root):
+            return None
+        relative = os.path.relpath(filename, self.project_root)
+        if relative.split(os.sep, 1)[0] not in PROJECT_DIRS:
+            return None
+        return relative.replace(os.sep, "/")
+
+    def _attribute(self, traceback):
+        """找出分配对应的项目代码位置（调用栈中最内层的项目帧）
+
+        Args:
+            traceback: tracemalloc.Traceback
+
+        Returns:
+            tuple: (文件, 行号)，调用栈中没有项目文件时返回 ("其他", 0)
+        """
+        # 调用栈按从外到内排列
+        for frame in reversed(traceback):
+            relative = self._relative_path(frame.filename)
+            if relative:
+                return relative, frame.lineno
+        return "其他", 0
+
+    def snapshot(self, top=10):
+        """获取当前快照并按文件归类内存占用
+
+        Args:
+            top: 返回的文件数量
+
+        Returns:
+            dict: {"total", "count", "files": [(文件, 字节数, 分配次数)]}，未开始记录时返回 None
+        """
+        if not tracemalloc.is_tracing():
+            return None
+
+        self.last_snapshot = self._take_snapshot()
+        files = defaultdict(lambda: [0, 0])
+        total = count = 0
+        for stat in self.last_snapshot.statistics("traceback"):
+            filename, _ = self._attribute(stat.traceback)
+            files[filename][0] += stat.size
+            files[filename][1] += stat.count
+            total += stat.size
+            count += stat.count
+
+        ordered = sorted(((name, size, n) for name, (size, n) in files.items()),
+                         key=lambda x: x[1],
+                         reverse=True)
+        return {"total": total, "count": count, "files": ordered[:top]}
+
+    def diff(self, top=10):
+        """比较当前内存分配与基准快照
+
+        Args:
+            top: 返回的文件和代码位置数量
+
+        Returns:
+            dict: {"total_diff", "files": [(文件, 增长字节数)],
+                "sites": [(文件:行号, 增长字节数, 分配次数变化)]}，未开始记录时返回 None
+        """
+        if not tracemalloc.is_tracing() or self.baseline is None:
+            return None
+
+        current = self._take_snapshot()
+        files = defaultdict(int)
+        sites = defaultdict(lambda: [0, 0])
+        total_diff = 0
+        for stat in current.compare_to(self.baseline, "traceback"):
+            if not stat.size_diff:
+                continue
+            filename, lineno = self._attribute(stat.traceback)
+            files[filename] += stat.size_diff
+            site = f"{filename}:{lineno}" if lineno else filename
+            sites[site][0] += stat.size_diff
+            sites[site][1] += stat.count_diff
+            total_diff += stat.size_diff
+        self.last_snapshot = current
+
+        return {
+            "total_diff": total_diff,
+            "files": sorted(files.items(), key=lambda x: x[1],
+                            reverse=True)[:top],
+            "sites": sorted(((site, size, n) for site, (size, n) in sites.items()),
+                            key=lambda x: x[1],
+                            reverse=True)[:top]
+        }
+
+    def get_status(self):
+        """获取分析器状态
+
+        Returns:
+            dict: 状态信息
+        """
+        traced, peak = tracemalloc.get_traced_memory() if self.tracing else (0, 0)
+        samples = list(self.rss_samples)
+        return {
+            "tracing": self.tracing,
+            "started_at": self.started_at,
+            "traced": traced,
+            "peak": peak,
+            "overhead": tracemalloc.get_tracemalloc_memory() if self.tracing else 0,
+            "rss": get_rss(),
+            "rss_slope": rss_slope(samples),
+            "rss_samples": len(samples)
+        }
+
+    def add_rss_sample(self, max_samples):
+        """记录一次常驻内存采样
+
+        Args:
+            max_samples: 保留的样本数量
+
+        Returns:
+            int: 当前常驻内存，无法获取时返回 None
+        """
+        rss = get_rss()
+        if rss is None:
+            return None
+        self.rss_samples.append((time.monotonic(), rss))
+        while len(self.rss_samples) > max_samples:
+            self.rss_samples.popleft()
+        return rss
+
+    async def watch_rss(self, alert_callback, interval=300, window=12,
+                        slope_threshold=5, cooldown=21600):
+        """定期采样常驻内存，增长速度持续超过阈值时调用提醒回调
+
+        Args:
+            alert_callback: 异步回调 (消息文本) -> None
+            interval: 采样间隔（秒）
+            window: 计算增长速度使用的样本数量
+            slope_threshold: 提醒阈值（MiB/小时）
+            cooldown: 两次提醒之间的最短间隔（秒）
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                if self.add_rss_sample(window) is None:
+                    self.logger.warning("无法获取常驻内存，停止内存监控")
+                    return
+
+                # 样本覆盖整个窗口后才判断，避免启动初期的正常增长触发提醒
+                if len(self.rss_samples) < window:
+                    continue
+
+                slope = rss_slope(self.rss_samples) / 1024 / 1024
+                now = time.monotonic()
+                if slope < slope_threshold or now - self.last_alert < cooldown:
+                    continue
+
+                self.last_alert = now
+                first = self.rss_samples[0][1]
+                last = self.rss_samples[-1][1]
+                message = (f"⚠️ 内存持续增长: {slope:.1f} MiB/小时"
+                           f"（{format_size(first)} → {format_size(last)}，"
+                           f"最近 {len(self.rss_samples) * interval / 3600:.1f} 小时）\n"
+                           f"可使用 /memprof start 和 /memprof diff 查找增长来源")
+                self.logger.warning(message)
+                try:
+                    await alert_callback(message)
+                except Exception as e:
+                    self.logger.error(f"发送内存提醒失败: {e}")
+        except asyncio.CancelledError:
+            self.logger.debug("内存监控任务已取消")
+            raise
@@ -6,6 +6,7 @@ import json
 import os
 from collections import defaultdict
 from utils.logger import setup_logger
+from utils.atomic_file import atomic_write_json
 
 
 class SessionManager:
@@ -64,6 +65,10 @@ class SessionManager:
                 pass
             self.logger.info("会话清理任务已停止")
 
+    def flush(self):
+        """立即保存会话数据（停止前调用）"""
+        self._save_sessions()
+
     async def _cleanup_loop(self):
         """清理过期会话的循环"""
         try:
@@ -518,6 +523,23 @@ class SessionManager:
                 count += 1
         return count
 
+    async def get_module_session_count(self, module_name):
+        """获取某个模块持有的活跃会话数量
+
+        Args:
+            module_name: 模块名称
+
+        Returns:
+            int: 活跃会话数量
+        """
+        now = time.time()
+        count = 0
+        for session in self.sessions.values():
+            if session.get("active_module") == module_name and session.get(
+                    "last_activity", 0) + self.timeout >= now:
+                count += 1
+        return count
+
     async def get_user_sessions(self, user_id):
         """获取用户在所有聊天中的会话
 
@@ -618,8 +640,8 @@ class SessionManager:
 
             # 保存到文件
             sessions_file = os.path.join(self.storage_dir, "sessions.json")
-            with open(sessions_file, 'w', encoding='utf-8') as f:
-                json.dump(active_sessions, f, ensure_ascii=False, indent=2)
+            atomic_write_json(sessions_file, active_sessions, fsync=False,
+                              ensure_ascii=False, indent=2)
 
         except Exception as e:
             self.logger.error(f"保存会话数据时出错: {e}")
@@ -0,0 +1,354 @@
+# utils/startup_profiler.py - 启动耗时分析
+
+import sys
+import json
+import time
+import asyncio
+import threading
+import contextlib
+import importlib.abc
+from collections import defaultdict
+from utils.logger import setup_logger
+
+# 导入耗时低于该值的模块不写入追踪文件（秒）
+MIN_TRACED_IMPORT = 0.001
+
+# 追踪文件中各类事件使用的线程编号
+TRACE_LANES = {"stage": 1, "import": 2}
+
+# 全局分析器（未启用时为 None）
+_state = {"profiler": None}
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """包装模块加载器，统计 exec_module 耗时"""
+
+    def __init__(self, loader, profiler, fullname):
+        self._loader = loader
+        self._profiler = profiler
+        self._fullname = fullname
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # 只统计主线程中的导入，避免多个线程的导入栈互相干扰
+        if threading.current_thread() is not threading.main_thread():
+            return self._loader.exec_module(module)
+
+        self._profiler._enter_import(self._fullname)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._exit_import(self._fullname)
+
+    def __getattr__(self, name):
+        # 其他属性（get_resource_reader 等）交给原加载器
+        return getattr(self._loader, name)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """位于 sys.meta_path 最前面的查找器，为找到的模块包装计时加载器"""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader,
+                                                   "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, self.profiler,
+                                           fullname)
+            return spec
+        return None
+
+
+class StartupProfiler:
+    """启动耗时分析器
+
+    记录各启动阶段、模块导入和模块初始化的耗时，输出排序后的报告，
+    并可导出 Chrome Trace 格式的追踪文件（可用 chrome://tracing、Perfetto 或 speedscope 查看）
+    """
+
+    def __init__(self):
+        """初始化分析器"""
+        self.origin = time.perf_counter()
+        self.logger = setup_logger("StartupProfiler")
+
+        self.events = []  # [{"name", "category", "start", "duration"}]
+        self.marks = {}  # 标记名称 -> 相对启动的时间
+        self.package_times = defaultdict(float)  # 顶层包 -> 导入自身耗时
+        self.import_count = 0
+
+        self._import_stack = []  # [(模块名, 开始时间, 子模块耗时)]
+        self._import_timer = None
+
+    def install_import_hook(self):
+        """开始统计模块导入耗时"""
+        if self._import_timer is None:
+            self._import_timer = _ImportTimer(self)
+            sys.meta_path.insert(0, self._import_timer)
+
+    def remove_import_hook(self):
+        """停止统计模块导入耗时"""
+        if self._import_timer is not None:
+            try:
+                sys.meta_path.remove(self._import_timer)
+            except ValueError:
+                pass
+            self._import_timer = None
+
+    def _enter_import(self, fullname):
+        self._import_stack.append([fullname, time.perf_counter(), 0.0])
+
+    def _exit_import(self, fullname):
+        name, start, children = self._import_stack.pop()
+        duration = time.perf_counter() - start
+
+        # 自身耗时计入顶层包，包含子模块的总耗时计入父模块的子模块耗时
+        self.package_times[name.partition(".")[0]] += duration - children
+        self.import_count += 1
+        if self._import_stack:
+            self._import_stack[-1][2] += duration
+
+        if duration >= MIN_TRACED_IMPORT:
+            self.record(name, start, duration, "import")
+
+    def record(self, name, start, duration, category="stage"):
+        """记录一个已完成的事件
+
+        Args:
+            name: 事件名称
+            start: 开始时间（time.perf_counter）
+            duration: 耗时（秒）
+            category: 事件类别（stage、module、import）
+        """
+        self.events.append({
+            "name": name,
+            "category": category,
+            "start": start - self.origin,
+            "duration": duration
+        })
+
+    @contextlib.contextmanager
+    def stage(self, name, category="stage"):
+        """统计代码块耗时
+
+        Args:
+            name: 阶段名称
+            category: 事件类别
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, category)
+
+    def mark(self, name):
+        """记录一个时间点（只记录第一次）
+
+        Args:
+            name: 标记名称
+        """
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.origin
+
+    async def wait_for_mark(self, name, timeout):
+        """等待某个标记出现
+
+        Args:
+            name: 标记名称
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            bool: 标记是否已出现
+        """
+        deadline = time.monotonic() + timeout
+        while name not in self.marks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return name in self.marks
+
+    def report(self, top=15):
+        """生成排序后的耗时报告
+
+        Args:
+            top: 每部分最多显示的条目数
+
+        Returns:
+            str: 报告文本
+        """
+        lines = ["启动耗时报告"]
+
+        for title, category in (("启动阶段", "stage"), ("模块", "module")):
+            events = sorted(
+                (e for e in self.events if e["category"] == category),
+                key=lambda e: e["duration"],
+                reverse=True)
+            if not events:
+                continue
+            lines.append(f"\n{title}:")
+            for event in events[:top]:
+                lines.append(f"  {event['duration'] * 1000:9.1f} ms  "
+                             f"@{event['start'] * 1000:8.1f} ms  {event['name']}")
+
+        if self.package_times:
+            total = sum(self.package_times.values())
+            lines.append(
+                f"\n导入耗时 (共 {self.import_count} 个模块, {total * 1000:.1f} ms):")
+            packages = sorted(self.package_times.items(),
+                              key=lambda x: x[1],
+                              reverse=True)
+            for package, duration in packages[:top]:
+                lines.append(f"  {duration * 1000:9.1f} ms  {package}")
+
+        if self.marks:
+            lines.append("\n时间点:")
+            for name, at in sorted(self.marks.items(), key=lambda x: x[1]):
+                lines.append(f"  {at * 1000:9.1f} ms  {name}")
+
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """导出 Chrome Trace 格式的追踪文件
+
+        Args:
+            path: 输出文件路径
+        """
+        trace_events = []
+        lanes = {}  # 线程编号 -> 线程名称
+        lane_ends = {}  # 模块事件使用的线程编号 -> 最后一个事件的结束时间
+        next_lane = max(TRACE_LANES.values()) + 1
+
+        for event in sorted(self.events, key=lambda e: e["start"]):
+            category = event["category"]
+            if category in TRACE_LANES:
+                tid = TRACE_LANES[category]
+                lanes[tid] = category
+            else:
+                # 模块并发初始化，互相重叠的事件放到不同的线程上
+                tid = next(
+                    (lane for lane, end in lane_ends.items()
+                     if end <= event["start"]), None)
+                if tid is None:
+                    tid = next_lane
+                    next_lane += 1
+                    lanes[tid] = f"{category} {tid - len(TRACE_LANES)}"
+                lane_ends[tid] = event["start"] + event["duration"]
+
+            trace_events.append({
+                "name": event["name"],
+                "cat": category,
+                "ph": "X",
+                "ts": round(event["start"] * 1e6),
+                "dur": round(event["duration"] * 1e6),
+                "pid": 1,
+                "tid": tid
+            })
+
+        for name, at in self.marks.items():
+            trace_events.append({
+                "name": name,
+                "cat": "mark",
+                "ph": "i",
+                "s": "g",
+                "ts": round(at * 1e6),
+                "pid": 1,
+                "tid": TRACE_LANES["stage"]
+            })
+
+        for tid, name in lanes.items():
+            trace_events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": tid,
+                "args": {
+                    "name": name
+                }
+            })
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "traceEvents": trace_events,
+                "displayTimeUnit": "ms"
+            }, f)
+
+        self.logger.info(f"启动追踪已写入 {path}")
+
+    async def finish(self, trace_path=None, wait_mark=None, timeout=30):
+        """结束分析：等待指定标记后输出报告并导出追踪文件
+
+        Args:
+            trace_path: 追踪文件路径，为 None 时不导出
+            wait_mark: 需要等待的标记（如首次轮询成功）
+            timeout: 等待标记的最长时间（秒）
+        """
+        if wait_mark and not await self.wait_for_mark(wait_mark, timeout):
+            self.logger.warning(f"等待 {wait_mark} 超时，报告中不包含该时间点")
+
+        self.remove_import_hook()
+        self.logger.info(self.report())
+
+        if trace_path:
+            try:
+                self.write_trace(trace_path)
+            except Exception as e:
+                self.logger.error(f"写入启动追踪失败: {e}")
+
+
+def enable(import_hook=True):
+    """启用全局启动分析器
+
+    Args:
+        import_hook: 是否统计模块导入耗时
+
+    Returns:
+        StartupProfiler: 分析器实例
+    """
+    if _state["profiler"] is None:
+        _state["profiler"] = StartupProfiler()
+        if import_hook:
+            _state["profiler"].install_import_hook()
+    return _state["profiler"]
+
+
+def get_profiler():
+    """获取全局启动分析器
+
+    Returns:
+        StartupProfiler: 分析器实例，未启用时返回 None
+    """
+    return _state["profiler"]
+
+
+def stage(name, category="stage"):
+    """统计代码块耗时，未启用分析器时不做任何事
+
+    Args:
+        name: 阶段名称
+        category: 事件类别
+
+    Returns:
+        上下文管理器
+    """
+    profiler = _state["profiler"]
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, category)
+
+
+def record(name, start, duration, category="stage"):
+    """记录一个已完成的事件，未启用分析器时忽略"""
+    if _state["profiler"] is not None:
+        _state["profiler"].record(name, start, duration, category)
+
+
+def mark(name):
+    """记录一个时间点，未启用分析器时忽略"""
+    if _state["profiler"] is not None:
+        _state["profiler"].mark(name)
@@ -4,6 +4,8 @@ import json
 import os
 import pickle
 from utils.logger import setup_logger
+from utils.atomic_file import (atomic_write, atomic_write_json, file_lock,
+                               merge_changes)
 
 
 class StateManager:
@@ -18,6 +20,9 @@ class StateManager:
         self.storage_dir = storage_dir
         self.logger = setup_logger("StateManager")
 
+        # 状态变化回调 (module_name) -> None，分片模式下用于通知其他进程
+        self.change_listeners = []
+
         # 创建目录
         os.makedirs(storage_dir, exist_ok=True)
 
@@ -50,22 +55,61 @@ class StateManager:
         try:
             file_path = self.get_state_file_path(module_name, format)
 
+            # 状态文件保存频繁且在事件循环中执行，不等待落盘
             if format == "json":
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(state, f, ensure_ascii=False, indent=2)
+                atomic_write_json(file_path, state, fsync=False,
+                                  ensure_ascii=False, indent=2)
             elif format == "pickle":
-                with open(file_path, 'wb') as f:
+                with atomic_write(file_path, 'wb', fsync=False) as f:
                     pickle.dump(state, f)
             else:
                 self.logger.warning(f"不支持的存储格式: {format}")
                 return False
 
+            self.notify_change(module_name)
             return True
 
         except Exception as e:
             self.logger.error(f"保存模块 {module_name} 状态时出错: {e}")
             return False
 
+    def update_state(self, module_name, updater, default=None, format="json"):
+        """在文件锁内读取、修改并保存模块状态
+
+        用于多个分片共享同一个状态文件的情况：每个分片只修改自己负责的部分，
+        其余部分以文件中的最新内容为准，避免整体覆盖其他分片写入的数据
+
+        Args:
+            module_name: 模块名称
+            updater: 修改函数 (文件中的状态) -> 新状态
+            default: 文件不存在时传给 updater 的默认值
+            format: 存储格式
+
+        Returns:
+            任意: 保存的新状态，保存失败时返回 None
+        """
+        with file_lock(self.get_state_file_path(module_name, format)):
+            state = updater(self.load_state(module_name, default, format))
+            if self.save_state(module_name, state, format):
+                return state
+            return None
+
+    def merge_state(self, module_name, state, base, format="json"):
+        """把本进程相对 base 的修改合并到文件中的最新状态后保存
+
+        Args:
+            module_name: 模块名称
+            state: 本进程的当前状态
+            base: 本进程上次读取或保存的状态
+            format: 存储格式
+
+        Returns:
+            任意: 保存的状态（包含其他分片的修改），保存失败时返回 None
+        """
+        return self.update_state(
+            module_name, lambda saved: merge_changes(base, state, saved),
+            default=base, format=format)
+
     def load_state(self, module_name, default=None, format="json"):
         """加载模块状态
 
@@ -121,3 +165,23 @@ class StateManager:
         except Exception as e:
             self.logger.error(f"删除模块 {module_name} 状态时出错: {e}")
             return False
+
+    def add_change_listener(self, callback):
+        """添加状态变化回调
+
+        Args:
+            callback: 回调函数 (module_name) -> None
+        """
+        self.change_listeners.append(callback)
+
+    def notify_change(self, module_name):
+        """通知模块状态已变化
+
+        Args:
+            module_name: 模块名称
+        """
+        for listener in self.change_listeners:
+            try:
+                listener(module_name)
+            except Exception as e:
+                self.logger.error(f"执行状态变化回调时出错: {e}")
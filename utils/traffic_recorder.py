@@ -0,0 +1,240 @@
+# utils/traffic_recorder.py - 流量录制工具
+
+import os
+import re
+import glob
+import gzip
+import json
+import time
+import hmac
+import hashlib
+from utils.logger import setup_logger
+
+# 需要匿名化的 ID 字段（仅处理整数值）
+ANONYMIZED_ID_KEYS = {"id", "user_id", "chat_id"}
+
+# 需要遮盖的文本字段
+MASKED_TEXT_KEYS = {
+    "text", "caption", "query", "first_name", "last_name", "username",
+    "title", "phone_number", "email", "bio", "description", "address"
+}
+
+# 命令前缀匹配（保留命令名以便回放时命中相同的处理器）
+COMMAND_PATTERN = re.compile(r"^(/[A-Za-z0-9_]+(?:@[A-Za-z0-9_]+)?)")
+
+
+class TrafficRecorder:
+    """更新流量录制器，将原始更新追加写入可轮转的 JSONL 文件"""
+
+    def __init__(self,
+                 storage_dir="data/captures",
+                 compress=True,
+                 anonymize=True,
+                 salt="",
+                 max_bytes=50 * 1024 * 1024,
+                 backup_count=10,
+                 flush_interval=1.0,
+                 bot_id=None):
+        """初始化录制器
+
+        Args:
+            storage_dir: 录制文件存储目录
+            compress: 是否使用 gzip 压缩
+            anonymize: 是否匿名化用户文本和 ID
+            salt: 匿名化使用的盐值，为空时每次启动随机生成
+            max_bytes: 单个录制文件的最大字节数（未压缩）
+            backup_count: 保留的录制文件数量
+            flush_interval: 刷新到磁盘的最小间隔（秒）
+            bot_id: Bot 自身的用户 ID，匿名化时保留原值
+        """
+        self.storage_dir = storage_dir
+        self.compress = compress
+        self.anonymize = anonymize
+        self.salt = (salt or os.urandom(16).hex()).encode("utf-8")
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.bot_id = bot_id
+        self.logger = setup_logger("TrafficRecorder")
+
+        # 当前文件状态
+        self._file = None
+        self._file_path = None
+        self._bytes_written = 0
+        self._last_flush = 0
+
+        # 统计
+        self.recorded = 0
+
+        os.makedirs(storage_dir, exist_ok=True)
+
+    def record(self, update_data):
+        """记录一条原始更新
+
+        Args:
+            update_data: update.to_dict() 的结果
+        """
+        try:
+            if self.anonymize:
+                update_data = self._anonymize(update_data)
+
+            line = json.dumps({
+                "ts": time.time(),
+                "update": update_data
+            },
+                              ensure_ascii=False,
+                              separators=(",", ":")) + "\n"
+
+            if self._file is None or self._bytes_written >= self.max_bytes:
+                self._rotate()
+
+            self._file.write(line)
+            self._bytes_written += len(line.encode("utf-8"))
+            self.recorded += 1
+
+            # 按间隔刷新，避免每条更新都触发磁盘写入
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+        except Exception as e:
+            self.logger.error(f"录制更新失败: {e}")
+
+    def close(self):
+        """关闭当前录制文件"""
+        if self._file:
+            try:
+                self._file.close()
+            except Exception as e:
+                self.logger.error(f"关闭录制文件 {self._file_path} 失败: {e}")
+            self._file = None
+            self.logger.debug(
+                f"录制文件已关闭: {self._file_path}，共录制 {self.recorded} 条更新")
+
+    def _rotate(self):
+        """关闭当前文件并创建新的录制文件"""
+        self.close()
+
+        suffix = ".jsonl.gz" if self.compress else ".jsonl"
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+
+        # 文件名带序号，同一秒内多次轮转时避免覆盖，且按文件名排序即为录制顺序
+        index = 0
+        while True:
+            self._file_path = os.path.join(
+                self.storage_dir, f"updates-{timestamp}-{index:03d}{suffix}")
+            if not os.path.exists(self._file_path):
+                break
+            index += 1
+
+        if self.compress:
+            self._file = gzip.open(self._file_path, "at", encoding="utf-8")
+        else:
+            self._file = open(self._file_path, "a", encoding="utf-8")
+
+        self._bytes_written = 0
+        self._last_flush = time.monotonic()
+        self.logger.debug(f"开始录制到文件: {self._file_path}")
+
+        self._cleanup_old_files()
+
+    def _cleanup_old_files(self):
+        """只保留最新的 backup_count 个录制文件"""
+        files = sorted(
+            glob.glob(os.path.join(self.storage_dir, "updates-*.jsonl*")))
+        for file_path in files[:-self.backup_count]:
+            try:
+                os.remove(file_path)
+                self.logger.debug(f"已删除旧录制文件: {file_path}")
+            except Exception as e:
+                self.logger.error(f"删除录制文件 {file_path} 失败: {e}")
+
+    def _anonymize(self, value, key=None):
+        """递归匿名化更新数据
+
+        Args:
+            value: 待处理的值
+            key: 该值在父字典中的键名
+
+        Returns:
+            匿名化后的值
+        """
+        if isinstance(value, dict):
+            return {k: self._anonymize(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._anonymize(v, key) for v in value]
+        if key in ANONYMIZED_ID_KEYS and isinstance(
+                value, int) and not isinstance(value, bool) and value != self.bot_id:
+            return self._anonymize_id(value)
+        if key in MASKED_TEXT_KEYS and isinstance(value, str):
+            return self._mask_text(value)
+        return value
+
+    def _anonymize_id(self, value):
+        """将 ID 映射为稳定的匿名 ID，保留正负号（群组 ID 为负数）
+
+        Args:
+            value: 原始 ID
+
+        Returns:
+            int: 匿名 ID
+        """
+        digest = hmac.new(self.salt, str(abs(value)).encode("utf-8"),
+                          hashlib.sha256).digest()
+        anon = int.from_bytes(digest[:6], "big") % 10**12 + 1
+        return -anon if value < 0 else anon
+
+    @staticmethod
+    def _mask_text(text):
+        """遮盖文本内容，保留命令名和 UTF-16 长度（实体偏移保持有效）
+
+        Args:
+            text: 原始文本
+
+        Returns:
+            str: 遮盖后的文本
+        """
+        prefix = ""
+        match = COMMAND_PATTERN.match(text)
+        if match:
+            prefix = match.group(1)
+            text = text[len(prefix):]
+
+        masked = []
+        for char in text:
+            if char.isspace():
+                masked.append(char)
+            elif ord(char) > 0xFFFF:
+                masked.append("xx")
+            else:
+                masked.append("x")
+        return prefix + "".join(masked)
+
+
+def iter_capture(paths):
+    """按顺序读取录制文件中的更新
+
+    Args:
+        paths: 录制文件路径列表
+
+    Yields:
+        tuple: (录制时间戳, 更新数据)
+    """
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 进程异常退出时最后一行可能不完整
+                        continue
+                    yield record.get("ts", 0), record.get("update", {})
+            except EOFError:
+                # 未正常关闭的 gzip 文件缺少结尾，读取到此为止
+                continue